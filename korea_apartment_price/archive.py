@@ -0,0 +1,219 @@
+import os
+import re
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from korea_apartment_price.path import TRADE_DATA_ROOT, RENT_DATA_ROOT
+
+
+__all__ = ('list_entries', 'has_entry', 'read_month', 'write_month', 'read_table', 'convert_json_files')
+
+# raw API rows are archived as {kind root}/{year}/{region code}.parquet (zstd),
+# one file per (year, region) holding every month of that year.
+
+_SCHEMAS: Dict[str, pa.Schema] = {
+  'trades': pa.schema([
+    ('serial', pa.string()),
+    ('price', pa.int64()),
+    ('created_at', pa.int64()),
+    ('addr_road', pa.string()),
+    ('addrcode_bld', pa.int64()),
+    ('addrcode_bld_sub', pa.int64()),
+    ('addrcode_city', pa.int64()),
+    ('addrcode_serial', pa.int64()),
+    ('addrcode', pa.int64()),
+    ('lawaddr_dong', pa.string()),
+    ('lawaddrcode_main', pa.int64()),
+    ('lawaddrcode_sub', pa.int64()),
+    ('lawaddrcode_city', pa.int64()),
+    ('lawaddrcode_dong', pa.int64()),
+    ('lawaddrcode_jibun', pa.int64()),
+    ('name', pa.string()),
+    ('date_serial', pa.int64()),
+    ('year', pa.int64()),
+    ('month', pa.int64()),
+    ('date', pa.int64()),
+    ('size', pa.float64()),
+    ('jibun', pa.int64()),
+    ('location_code', pa.int64()),
+    ('floor', pa.int64()),
+    ('is_canceled', pa.bool_()),
+    ('canceled_date', pa.int64()),
+  ]),
+  'rents': pa.schema([
+    ('price_deposit', pa.int64()),
+    ('price_monthly', pa.int64()),
+    ('created_at', pa.int64()),
+    ('rent_extended', pa.bool_()),
+    ('lawaddr_dong', pa.string()),
+    ('name', pa.string()),
+    ('contract_type', pa.string()),
+    ('contract_duration', pa.string()),
+    ('date_serial', pa.int64()),
+    ('year', pa.int64()),
+    ('month', pa.int64()),
+    ('date', pa.int64()),
+    ('size', pa.float64()),
+    ('prev_deposit', pa.int64()),
+    ('prev_monthly', pa.int64()),
+    ('jibun', pa.int64()),
+    ('location_code', pa.int64()),
+    ('floor', pa.int64()),
+  ]),
+}
+
+_ROOTS: Dict[str, str] = {
+  'trades': TRADE_DATA_ROOT,
+  'rents': RENT_DATA_ROOT,
+}
+
+def _partition_path(kind: str, year: int, region: int)->str:
+  return os.path.join(_ROOTS[kind], f'{year:04d}', f'{region}.parquet')
+
+
+def _read_months(path: str)->List[int]:
+  metadata = pq.read_schema(path).metadata or {}
+  return json.loads(metadata.get(b'months', b'[]'))
+
+
+def _read_partition(path: str, columns: Optional[List[str]]=None, filters: Optional[List[Tuple[str, str, Any]]]=None)->pa.Table:
+  return pq.read_table(path, columns=columns, filters=filters, partitioning=None)
+
+
+def _write_partition(path: str, tables: List[pa.Table], months: Set[int]):
+  if len(months) == 0:
+    if os.path.exists(path): os.remove(path)
+    return
+
+  table = pa.concat_tables(tables).replace_schema_metadata({'months': json.dumps(sorted(months))})
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = path + '.tmp'
+  pq.write_table(table, tmp_path, compression='zstd')
+  os.replace(tmp_path, path)
+
+
+def list_entries(kind: str)->List[Tuple[int, int, int]]:
+  root = _ROOTS[kind]
+  res = []
+  if not os.path.exists(root): return res
+
+  regex = re.compile(r'^([0-9]{5})\.parquet$')
+  for year_dir in os.listdir(root):
+    if not re.match(r'^[0-9]{4}$', year_dir): continue
+    year = int(year_dir)
+    for fname in os.listdir(os.path.join(root, year_dir)):
+      gp = regex.match(fname)
+      if gp is None: continue
+      region = int(gp.group(1))
+      for month in _read_months(os.path.join(root, year_dir, fname)):
+        res.append((year, month, region))
+  return res
+
+
+def has_entry(kind: str, year: int, month: int, region: int)->bool:
+  path = _partition_path(kind, year, region)
+  if not os.path.exists(path): return False
+  return month in _read_months(path)
+
+
+def read_month(kind: str, year: int, month: int, region: int, columns: Optional[List[str]]=None)->List[Dict[str, Any]]:
+  path = _partition_path(kind, year, region)
+  if not os.path.exists(path): return []
+  return _read_partition(path, columns=columns, filters=[('month', '=', month)]).to_pylist()
+
+
+def write_month(kind: str, year: int, month: int, region: int, rows: List[Dict[str, Any]]):
+  # replaces the rows of the given month. an empty list removes the month from the archive.
+  schema = _SCHEMAS[kind]
+  path = _partition_path(kind, year, region)
+  tables = []
+  months = set()
+
+  if os.path.exists(path):
+    table = _read_partition(path)
+    table = table.filter(pc.not_equal(table['month'], month))
+    if table.num_rows > 0:
+      tables.append(table.select(schema.names).cast(schema))
+      months.update(_read_months(path))
+    months.discard(month)
+
+  if len(rows) > 0:
+    tables.append(pa.Table.from_pylist(rows, schema=schema))
+    months.add(month)
+
+  _write_partition(path, tables, months)
+
+
+def read_table(kind: str, columns: Optional[List[str]]=None, years: Optional[List[int]]=None, regions: Optional[List[int]]=None)->pa.Table:
+  # reads only the requested columns out of the requested year/region partitions
+  root = _ROOTS[kind]
+  paths = []
+  for year_dir in sorted(os.listdir(root)) if os.path.exists(root) else []:
+    if not re.match(r'^[0-9]{4}$', year_dir): continue
+    if years is not None and int(year_dir) not in years: continue
+    for fname in sorted(os.listdir(os.path.join(root, year_dir))):
+      gp = re.match(r'^([0-9]{5})\.parquet$', fname)
+      if gp is None: continue
+      if regions is not None and int(gp.group(1)) not in regions: continue
+      paths.append(os.path.join(root, year_dir, fname))
+
+  schema = _SCHEMAS[kind]
+  if len(paths) == 0:
+    return schema.empty_table() if columns is None else schema.empty_table().select(columns)
+  return ds.dataset(paths, schema=schema, format='parquet').to_table(columns=columns)
+
+
+def convert_json_files(kind: str, remove: bool=False, skip_existing: bool=False)->int:
+  # moves the legacy {YYYYMM}-{code5}.json cache into the parquet archive.
+  # with skip_existing, months already in the archive are left as they are and only the
+  # partitions that gain a month are rewritten. returns the number of months moved in
+  # (empty months are never archived)
+  root = _ROOTS[kind]
+  regex = re.compile(r'^([0-9]{4})([0-9]{2})-([0-9]{5}).json$')
+  fnames = sorted([fname for fname in os.listdir(root) if regex.match(fname)]) if os.path.exists(root) else []
+
+  by_partition: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
+  for fname in fnames:
+    gp = regex.match(fname)
+    key = (int(gp.group(1)), int(gp.group(3)))
+    by_partition.setdefault(key, []).append((int(gp.group(2)), fname))
+  if len(by_partition) == 0: return 0
+
+  schema = _SCHEMAS[kind]
+  num_converted = 0
+  for (year, region), entries in tqdm(sorted(by_partition.items())):
+    tables = []
+    months = set()
+    path = _partition_path(kind, year, region)
+    if os.path.exists(path):
+      months.update(_read_months(path))
+      if skip_existing:
+        entries = [(month, fname) for month, fname in entries if month not in months]
+        if len(entries) == 0: continue
+      tables.append(_read_partition(path).select(schema.names).cast(schema))
+
+    is_changed = False
+    for month, fname in entries:
+      with open(os.path.join(root, fname), 'r') as f:
+        rows = json.loads(f.read())
+      if len(rows) == 0: continue
+      if month in months:
+        tables = [t.filter(pc.not_equal(t['month'], month)) for t in tables]
+      tables.append(pa.Table.from_pylist(rows, schema=schema))
+      months.add(month)
+      is_changed = True
+      num_converted += 1
+
+    if is_changed or not skip_existing:
+      _write_partition(path, tables, months)
+
+    if remove:
+      for _, fname in entries:
+        os.remove(os.path.join(root, fname))
+  return num_converted
@@ -0,0 +1,153 @@
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from bs4 import BeautifulSoup
+
+from korea_apartment_price.config import get_cfg
+from korea_apartment_price.db import RowBldLedger
+from korea_apartment_price.utils.converter import safe_float, safe_int
+from korea_apartment_price.utils.http_cache import CachedSession
+from korea_apartment_price.utils.throttle import Throttler, get_throttler
+
+
+__all__ = ('BuildingLedgerDownloader', 'BuildingLedgerError')
+
+_logger = logging.getLogger(__name__)
+
+class BuildingLedgerError(Exception): pass
+
+
+class BuildingLedgerDownloader:
+  # pages of the 건축물대장 API go through the shared http cache (30 days ttl),
+  # so re-running over a region only hits the API for pages that were never fetched
+  def __init__(self,
+               timeout:float=20.0,
+               throttler:Optional[Throttler]=None,
+               max_concurrent_pages:int=4,
+               use_cache:bool=True,
+               ):
+    self.api_key = get_cfg()['BLD_LEDGER_API_KEY']
+    self.timeout = timeout
+    self.throttler = throttler if throttler is not None else get_throttler('apis.data.go.kr', 10.0, adaptive=True)
+    self.max_concurrent_pages = max_concurrent_pages
+    self.session = CachedSession(refresh=not use_cache)
+
+  def _fetch_page(self, target: str, lawaddrcode_city: int, lawaddrcode_dong: int, bun: Optional[str], ji: Optional[str], num_rows: int, page_idx: int)->BeautifulSoup:
+    params = {
+        'sigunguCd': lawaddrcode_city,
+        'bjdongCd': f'{lawaddrcode_dong:05d}',
+        'serviceKey': self.api_key,
+        'numOfRows': num_rows,
+        'pageNo': page_idx,
+    }
+    if bun is not None: params['bun'] = bun
+    if ji is not None: params['ji'] = ji
+
+    url = f'http://apis.data.go.kr/1613000/BldRgstService_v2/{target}'
+    try:
+      resp = self._get(url, params)
+    except requests.exceptions.Timeout:
+      self.throttler.report_failure()
+      raise
+
+    soup = BeautifulSoup(resp.content, 'lxml-xml')
+    if resp.status_code != 200 or len(soup.findAll('totalCount')) == 0:
+      self.throttler.report_failure()
+      raise BuildingLedgerError(f'{target} {lawaddrcode_city}{lawaddrcode_dong:05d} page {page_idx}: {resp.content.decode("utf-8", errors="replace")[:200]}')
+    self.throttler.report_success()
+    return soup
+
+  def _get(self, url: str, params: Dict[str, Any])->requests.Response:
+    # pages served from the cache do not use up the request rate
+    if not self.session.is_fresh('GET', url, params):
+      self.throttler.throttle()
+    return self.session.get(url, params=params, timeout=self.timeout)
+
+  def _fetch_items(self, target: str, keylist: List[Tuple[str, str]], lawaddrcode_city: int, lawaddrcode_dong: int, bun: Optional[str], ji: Optional[str])->List[Dict[str, Optional[str]]]:
+    num_rows = 1000
+
+    def parse(soup: BeautifulSoup)->List[Dict[str, Optional[str]]]:
+      res = []
+      for v in soup.findAll('item'):
+        item_en = {}
+        for key, key_en in keylist:
+          elem = v.find(key)
+          item_en[key_en] = elem.text.strip() if elem is not None else None
+        res.append(item_en)
+      return res
+
+    def fetch_page(page_idx: int)->List[Dict[str, Optional[str]]]:
+      return parse(self._fetch_page(target, lawaddrcode_city, lawaddrcode_dong, bun, ji, num_rows, page_idx))
+
+    first_page = self._fetch_page(target, lawaddrcode_city, lawaddrcode_dong, bun, ji, num_rows, 1)
+    total_cnt = int(first_page.findAll('totalCount')[0].text)
+    num_pages = max(1, (total_cnt + num_rows - 1) // num_rows)
+
+    pages = [parse(first_page)]
+    if num_pages > 1:
+      max_workers = min(self.max_concurrent_pages, num_pages - 1)
+      with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages += list(executor.map(fetch_page, range(2, num_pages + 1)))
+    res = [e for page in pages for e in page]
+    _logger.debug('%s fetched %d%05d pages=%d items=%d total=%d', target, lawaddrcode_city, lawaddrcode_dong, num_pages, len(res), total_cnt)
+    return res
+
+  def get(self,
+          lawaddrcode_city:int,
+          lawaddrcode_dong: int,
+          bun: Optional[str] = None,
+          ji: Optional[str] = None,
+          )->List[RowBldLedger]:
+    now = datetime.datetime.now()
+
+    keylist = [
+      ('newPlatPlc', 'addr_road'), # 도로명 주소
+      ('platPlc', 'lawaddr'), # 예전 주소
+      ('bun', 'bun'), # 번
+      ('ji', 'ji'), # 지
+      ('platArea', 'plat_area'), # 대지 면적
+      ('bcRat', 'building_coverage_ratio'), # 건폐율
+      ('vlRat', 'floor_area_ratio'), # 용적률
+      ('bldNm', 'name'), # 이름
+      ('hhldCnt', 'household_cnt'), # 세대수
+      ('useAprDay', 'used_after'), # 사용승인일
+      ('mgmBldrgstPk', 'pk'), # 건축물 관리대장 일련번호
+    ]
+    res_in_dict: Dict[str, RowBldLedger] = {}
+    for e in self._fetch_items('getBrRecapTitleInfo', keylist, lawaddrcode_city, lawaddrcode_dong, bun, ji): # 총괄표제부
+      res_in_dict[e['pk']] = {
+        '_id': e['pk'],
+        'pk': e['pk'],
+        'lawaddrcode_city': lawaddrcode_city,
+        'lawaddrcode_dong': lawaddrcode_dong,
+        'bun': safe_int(e['bun']),
+        'ji': safe_int(e['ji']),
+        'addr_road': e['addr_road'],
+        'lawaddr': e['lawaddr'],
+        'name': e['name'],
+        'plat_area': safe_float(e['plat_area']),
+        'building_coverage_ratio': safe_float(e['building_coverage_ratio']),
+        'floor_area_ratio': safe_float(e['floor_area_ratio']),
+        'household_cnt': safe_int(e['household_cnt']),
+        'used_after': safe_int(e['used_after']),
+        'jigu': [],
+        'fetched_at': now,
+      }
+
+    keylist = [
+      ('mgmBldrgstPk', 'pk'), # 건축물 관리대장 일련번호
+      ('jijiguCdNm', 'jigu'), # 지역지구구역
+      ('jijiguGbCdNm', 'jigu_gb'), # 지역지구구역
+      ('etcJijigu', 'jigu_etc'), # 지역지구구역
+    ]
+    for e in self._fetch_items('getBrJijiguInfo', keylist, lawaddrcode_city, lawaddrcode_dong, bun, ji): # 지역지구구역
+      if e['pk'] in res_in_dict and e.get('jigu', None) is not None:
+        res_in_dict[e['pk']]['jigu'].append(e['jigu'])
+
+    return list(res_in_dict.values())
+
+  def close(self):
+    self.session.close()
@@ -1,10 +1,13 @@
 from enum import Enum
 from typing import Callable, Optional, List, Tuple, TypedDict, Union, Dict, Any
 
+import bisect
 import datetime
+import hashlib
+import json
 from pprint import pprint
 import pymongo
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
 from pymongo.database import Database
 from pymongo.collection import Collection
 
@@ -24,6 +27,18 @@ __all__ = (
   'query_geocode',
   'pick_size',
   'pick_price',
+  'row_hash',
+  'content_hash',
+  'sync_rows',
+  'get_ingest_manifest_collection',
+  'get_crawl_jobs_collection',
+  'get_bld_ledger_collection',
+  'join_bld_ledger',
+  'get_meta_collection',
+  'get_volume_daily_collection',
+  'get_volume_weekly_collection',
+  'bump_data_version',
+  'get_data_version',
   'create_indices',
 )
 
@@ -36,7 +51,17 @@ _geocodes_collection: Optional[Collection] = None
 _kbliiv_apt_collection: Optional[Collection] = None
 _kbliiv_apt_type_collection: Optional[Collection] = None
 _kbliiv_apt_orderbook_collection: Optional[Collection] = None
+_kbliiv_apt_orderbook_delta_collection: Optional[Collection] = None
+_kbliiv_apt_orderbook_fetch_collection: Optional[Collection] = None
+_kbliiv_apt_detail_collection: Optional[Collection] = None
+_kbliiv_apt_orderbook_detail_collection: Optional[Collection] = None
 _deposit_interest_rate_collection: Optional[Collection] = None
+_ingest_manifest_collection: Optional[Collection] = None
+_crawl_jobs_collection: Optional[Collection] = None
+_bld_ledger_collection: Optional[Collection] = None
+_meta_collection: Optional[Collection] = None
+_volume_daily_collection: Optional[Collection] = None
+_volume_weekly_collection: Optional[Collection] = None
 
 
 def get_conn()->MongoClient:
@@ -69,6 +94,19 @@ def get_rents_collection()->Collection:
     _rents_collection = get_db()['rents']
   return _rents_collection
 
+# pre-aggregated trade counts, maintained by korea_apartment_price.trade_volume
+def get_volume_daily_collection()->Collection:
+  global _volume_daily_collection
+  if _volume_daily_collection is None:
+    _volume_daily_collection = get_db()['volume_daily']
+  return _volume_daily_collection
+
+def get_volume_weekly_collection()->Collection:
+  global _volume_weekly_collection
+  if _volume_weekly_collection is None:
+    _volume_weekly_collection = get_db()['volume_weekly']
+  return _volume_weekly_collection
+
 
 def pick_size(ent)->int:
   return int(ent['size'] / 3.3)
@@ -329,6 +367,164 @@ def query_trades(
 
 
 
+### Related to incremental ingestion
+def row_hash(row: Dict[str, Any])->str:
+  content = json.dumps({k: v for k, v in row.items() if k != '_id'}, ensure_ascii=False, sort_keys=True, default=str)
+  return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def content_hash(rows: List[Dict[str, Any]])->str:
+  m = hashlib.sha1()
+  for h in sorted([row_hash(r) for r in rows]):
+    m.update(h.encode('utf-8'))
+  return m.hexdigest()
+
+
+def sync_rows(col: Collection, cond: Dict[str, Any], rows: List[Dict[str, Any]])->Tuple[int, int]:
+  # rows matching cond are replaced by the given rows, touching only the ones that differ.
+  # returns (# of inserted rows, # of deleted rows)
+  stored: Dict[str, List[Any]] = {}
+  for ent in col.find(cond):
+    stored.setdefault(row_hash(ent), []).append(ent['_id'])
+
+  to_insert = []
+  for row in rows:
+    ids = stored.get(row_hash(row), None)
+    if ids: ids.pop()
+    else: to_insert.append(row)
+
+  to_delete = [i for ids in stored.values() for i in ids]
+  if len(to_delete) > 0:
+    col.delete_many({'_id': {'$in': to_delete}})
+  if len(to_insert) > 0:
+    col.insert_many(to_insert)
+  return len(to_insert), len(to_delete)
+
+
+class RowIngestManifest(TypedDict):
+  _id: str
+  kind: str                      # 수집 대상 (trades, rents)
+  region: int                    # 지역코드 (시군구 5자리)
+  ym: int                        # 년월 (YYYYMM)
+  status: str                    # loading: 적재중, done: 적재완료
+  row_cnt: int                   # 레코드 수
+  content_hash: Optional[str]    # 레코드 전체의 content_hash
+  fetched_at: datetime.datetime  # 적재일시
+
+
+def get_ingest_manifest_collection()->Collection:
+  global _ingest_manifest_collection
+  if _ingest_manifest_collection is None:
+    _ingest_manifest_collection = get_db()['ingest_manifest']
+  return _ingest_manifest_collection
+
+
+def _ingest_manifest_id(kind: str, year: int, month: int, region: int)->str:
+  return f'{kind}:{year:04d}{month:02d}-{region}'
+
+
+def get_ingest_manifest(kind: str, year: int, month: int, region: int)->Optional[RowIngestManifest]:
+  col = get_ingest_manifest_collection()
+  return col.find_one({'_id': _ingest_manifest_id(kind, year, month, region)})
+
+
+def list_ingest_manifest(kind: str, status: str='done')->List[Tuple[int, int, int]]:
+  # region-months that came back empty only keep their content hash for --refresh-window.
+  # they have no rows in the db nor in the archive, so they are not listed
+  col = get_ingest_manifest_collection()
+  res = []
+  for ent in col.find({'kind': kind, 'status': status, 'row_cnt': {'$ne': 0}}, {'ym': 1, 'region': 1}):
+    res.append((ent['ym'] // 100, ent['ym'] % 100, ent['region']))
+  return res
+
+
+def begin_ingest(kind: str, year: int, month: int, region: int):
+  # marks the region-month dirty before touching its rows so that an interrupted load
+  # is detected (and redone) on the next run
+  col = get_ingest_manifest_collection()
+  col.update_one({'_id': _ingest_manifest_id(kind, year, month, region)}, {'$set': {
+    'kind': kind,
+    'region': region,
+    'ym': year * 100 + month,
+    'status': 'loading',
+    'fetched_at': datetime.datetime.now(),
+  }}, upsert=True)
+
+
+def finish_ingest(kind: str, year: int, month: int, region: int, rows: List[Dict[str, Any]], rows_hash: Optional[str]=None):
+  col = get_ingest_manifest_collection()
+  row: RowIngestManifest = {
+    '_id': _ingest_manifest_id(kind, year, month, region),
+    'kind': kind,
+    'region': region,
+    'ym': year * 100 + month,
+    'status': 'done',
+    'row_cnt': len(rows),
+    'content_hash': rows_hash if rows_hash is not None else content_hash(rows),
+    'fetched_at': datetime.datetime.now(),
+  }
+  col.replace_one({'_id': row['_id']}, row, upsert=True)
+
+
+def backfill_ingest_manifest(kind: str, entries: List[Tuple[int, int, int, int]]):
+  # entries: (year, month, region, row_cnt) of the rows already stored before the manifest existed
+  if len(entries) == 0: return
+  col = get_ingest_manifest_collection()
+  now = datetime.datetime.now()
+  rows: List[RowIngestManifest] = []
+  for year, month, region, row_cnt in entries:
+    rows.append({
+      '_id': _ingest_manifest_id(kind, year, month, region),
+      'kind': kind,
+      'region': region,
+      'ym': year * 100 + month,
+      'status': 'done',
+      'row_cnt': row_cnt,
+      'content_hash': None,
+      'fetched_at': now,
+    })
+  col.insert_many(rows)
+
+
+def remove_ingest_manifest(kind: str, ymregions: List[Tuple[int, int, int]]):
+  if len(ymregions) == 0: return
+  col = get_ingest_manifest_collection()
+  col.delete_many({'_id': {'$in': [_ingest_manifest_id(kind, *e) for e in ymregions]}})
+
+
+
+def get_crawl_jobs_collection()->Collection:
+  global _crawl_jobs_collection
+  if _crawl_jobs_collection is None:
+    _crawl_jobs_collection = get_db()['crawl_jobs']
+  return _crawl_jobs_collection
+
+
+### Related to data version (webapp response cache)
+def get_meta_collection()->Collection:
+  global _meta_collection
+  if _meta_collection is None:
+    _meta_collection = get_db()['meta']
+  return _meta_collection
+
+
+def bump_data_version(kind: str)->int:
+  # ingestion scripts call this after writing, so cached api responses built from older data are dropped
+  col = get_meta_collection()
+  now = datetime.datetime.now()
+  ent = col.find_one_and_update({'_id': 'data_version'}, {
+    '$inc': {'version': 1},
+    '$set': {'updated_at': now, f'updated_by.{kind}': now},
+  }, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+  return ent['version']
+
+
+def get_data_version()->int:
+  ent = get_meta_collection().find_one({'_id': 'data_version'}, {'version': 1})
+  return ent['version'] if ent is not None else 0
+
+
+
 ### Related to geocode
 class RowGeocode(TypedDict):
   _id: Any
@@ -371,7 +567,10 @@ class RowKBApart(TypedDict):
   apttype: Optional[int]           # 매물타입 (1-아파트, 4-오피스텔)
   lat: float                       # 위도
   lng: float                       # 경도
-  detail: Any                      # 기타 상세정보
+
+class RowKBDetail(TypedDict):
+  _id: Any        # 원본 document의 _id
+  detail: Any     # KB 원본 응답
 
 class RowKBApartType(TypedDict):
   _id: Any
@@ -398,7 +597,30 @@ class RowKBOrderbook(TypedDict):
   apt_dong: Optional[str]                 # 건물동명
   apt_ho: Optional[str]                   # 건물호명
   trade_type: TradeType                   # 매물거래구분
-  detail: Any                             # 세부사항
+  min_price: Optional[float]              # 최소매매가
+  listing_id: Optional[int]               # 매물일련번호
+
+class RowKBOrderbookDelta(TypedDict):
+  _id: Any
+  apart_id: int                           # KB 단지기본일련번호
+  listing_key: str                        # 매물 식별자 + 내용의 hash
+  price: Union[Tuple[float,float], float] # 매매가/전세가/(보증금,월세)
+  size: float                             # 전용면적(평)
+  confirmed_at: datetime.datetime         # 확인일자
+  floor: str                              # 층수
+  apt_dong: Optional[str]                 # 건물동명
+  apt_ho: Optional[str]                   # 건물호명
+  trade_type: int                         # 매물거래구분
+  min_price: Optional[float]              # 최소매매가
+  listing_id: Optional[int]               # 매물일련번호
+  first_seen: datetime.datetime           # 처음 수집된 일시
+  last_seen: datetime.datetime            # 마지막으로 수집된 일시
+
+class RowKBOrderbookFetch(TypedDict):
+  _id: Any
+  apart_id: int                   # KB 단지기본일련번호
+  fetched_at: datetime.datetime   # 다운로드일시
+  num_listings: int               # 매물 수
 
 class EntryNotFound(Exception): pass
 
@@ -421,6 +643,85 @@ def get_kbliiv_apt_orderbook_collection()->Collection:
     _kbliiv_apt_orderbook_collection = get_db()['kbliiv_apt_orderbook']
   return _kbliiv_apt_orderbook_collection
 
+def get_kbliiv_apt_orderbook_delta_collection()->Collection:
+  global _kbliiv_apt_orderbook_delta_collection
+  if _kbliiv_apt_orderbook_delta_collection is None:
+    _kbliiv_apt_orderbook_delta_collection = get_db()['kbliiv_apt_orderbook_delta']
+  return _kbliiv_apt_orderbook_delta_collection
+
+def get_kbliiv_apt_orderbook_fetch_collection()->Collection:
+  global _kbliiv_apt_orderbook_fetch_collection
+  if _kbliiv_apt_orderbook_fetch_collection is None:
+    _kbliiv_apt_orderbook_fetch_collection = get_db()['kbliiv_apt_orderbook_fetch']
+  return _kbliiv_apt_orderbook_fetch_collection
+
+def get_kbliiv_apt_detail_collection()->Collection:
+  global _kbliiv_apt_detail_collection
+  if _kbliiv_apt_detail_collection is None:
+    _kbliiv_apt_detail_collection = get_db()['kbliiv_apt_detail']
+  return _kbliiv_apt_detail_collection
+
+def get_kbliiv_apt_orderbook_detail_collection()->Collection:
+  global _kbliiv_apt_orderbook_detail_collection
+  if _kbliiv_apt_orderbook_detail_collection is None:
+    _kbliiv_apt_orderbook_detail_collection = get_db()['kbliiv_apt_orderbook_detail']
+  return _kbliiv_apt_orderbook_detail_collection
+
+
+# the raw KB payloads are kept in side collections keyed by the _id of the owning document
+# so that the hot collections only carry the typed fields
+def _pop_details(rows: List[Dict[str, Any]])->List[Any]:
+  return [row.pop('detail', None) for row in rows]
+
+def _insert_details(col: Collection, rows: List[Dict[str, Any]], details: List[Any]):
+  docs = [{'_id': row['_id'], 'detail': detail} for row, detail in zip(rows, details) if detail is not None]
+  if len(docs) > 0:
+    col.insert_many(docs, ordered=False)
+
+def upsert_kb_apart(row: RowKBApart, detail: Any):
+  get_kbliiv_apt_collection().replace_one({'_id': row['_id']}, row, upsert=True)
+  get_kbliiv_apt_detail_collection().replace_one({'_id': row['_id']}, {'_id': row['_id'], 'detail': detail}, upsert=True)
+
+def bulk_upsert_kb_aparts(entries: List[Tuple[RowKBApart, Any, List[RowKBApartType]]]):
+  # (apartment row, raw detail, area type rows) in three unordered bulk writes
+  apt_ops = []
+  detail_ops = []
+  type_ops = []
+  for row, detail, type_rows in entries:
+    apt_ops.append(ReplaceOne({'_id': row['_id']}, row, upsert=True))
+    detail_ops.append(ReplaceOne({'_id': row['_id']}, {'_id': row['_id'], 'detail': detail}, upsert=True))
+    for type_row in type_rows:
+      type_ops.append(ReplaceOne({'_id': type_row['_id']}, type_row, upsert=True))
+
+  if len(apt_ops) > 0:
+    get_kbliiv_apt_collection().bulk_write(apt_ops, ordered=False)
+    get_kbliiv_apt_detail_collection().bulk_write(detail_ops, ordered=False)
+  if len(type_ops) > 0:
+    get_kbliiv_apt_type_collection().bulk_write(type_ops, ordered=False)
+
+def query_kb_apart_detail(apart_id: int)->Any:
+  ent = get_kbliiv_apt_detail_collection().find_one({'_id': apart_id})
+  if ent is None: return None
+  return ent['detail']
+
+def insert_kb_orderbook(rows: List[Dict[str, Any]]):
+  if len(rows) == 0: return
+  details = _pop_details(rows)
+  get_kbliiv_apt_orderbook_collection().insert_many(rows)
+  _insert_details(get_kbliiv_apt_orderbook_detail_collection(), rows, details)
+
+def query_kb_orderbook_details(ids: List[Any])->Dict[Any, Any]:
+  col = get_kbliiv_apt_orderbook_detail_collection()
+  return {ent['_id']: ent['detail'] for ent in col.find({'_id': {'$in': list(set(ids))}})}
+
+def remove_kb_orderbook_since(start: datetime.datetime):
+  col = get_kbliiv_apt_orderbook_collection()
+  ids = [ent['_id'] for ent in col.find({'fetched_at': {'$gte': start}}, {'_id': 1})]
+  col.delete_many({'_id': {'$in': ids}})
+  get_kbliiv_apt_orderbook_detail_collection().delete_many({'_id': {'$in': ids}})
+  remove_kb_orderbook_delta_since(start)
+
+
 def query_kb_apart(apt_id: ApartmentId)->RowKBApart:
   trade_col = get_trades_collection()
   kb_col = get_kbliiv_apt_collection()
@@ -441,7 +742,7 @@ def query_kb_apart(apt_id: ApartmentId)->RowKBApart:
       'lawaddrcode_dong': lawaddrcode_dong,
       'lawaddrcode_main': ent['lawaddrcode_main'],
       'lawaddrcode_sub': ent['lawaddrcode_sub'],
-    })
+    }, {'detail': 0})
 
     kb_apts = list(kb_apts)
 
@@ -450,7 +751,7 @@ def query_kb_apart(apt_id: ApartmentId)->RowKBApart:
     kb_apts: RowKBApart = kb_col.find({
       'lawaddrcode_city': lawaddrcode_city,
       'lawaddrcode_dong': lawaddrcode_dong,
-    })
+    }, {'detail': 0})
     kb_apts = list(kb_apts)
     assert len(kb_apts) > 0
 
@@ -488,7 +789,7 @@ def query_kb_apart_by_lawaddrcode(lawaddrcode: int)->List[RowKBApart]:
       'lawaddrcode_city': int(str_lawaddrcode[:5]),
     }
 
-  kb_apts: List[RowKBApart] = kb_col.find(query)
+  kb_apts: List[RowKBApart] = kb_col.find(query, {'detail': 0})
   return kb_apts
 
 
@@ -526,7 +827,157 @@ def query_kb_orderbook(apt_id: ApartmentId, size_from: Optional[int]=None, size_
     day = fetched_to % 100
     cond.append({'fetched_at': {"$lte": datetime.datetime(year, month, day)}})
 
-  return col.find({'$and':cond})
+  res = list(col.find({'$and':cond}, {'detail': 0}))
+  res += _query_kb_orderbook_delta(kb_apt['id'], cond[1:])
+  return res
+
+
+def _kb_orderbook_listing_key(row: Dict[str, Any])->str:
+  # KB 매물일련번호 if available, otherwise the location of the listing. the content is part of the key
+  # so that a changed price starts a new interval
+  identity = row.get('listing_id', None)
+  if identity is None:
+    identity = [row.get('apt_dong'), row.get('apt_ho'), row.get('floor'), row.get('size')]
+  content = [identity, row.get('trade_type'), row.get('price'), row.get('confirmed_at')]
+  return hashlib.sha1(json.dumps(content, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def insert_kb_orderbook_delta(apart_id: int, rows: List[Dict[str, Any]], fetched_at: datetime.datetime)->Tuple[int, int]:
+  # extends the listings that are unchanged since the previous fetch and appends new/changed ones.
+  # returns (# of extended listings, # of inserted listings)
+  delta_col = get_kbliiv_apt_orderbook_delta_collection()
+  fetch_col = get_kbliiv_apt_orderbook_fetch_collection()
+
+  prev = fetch_col.find_one({'apart_id': apart_id, 'fetched_at': {'$lt': fetched_at}}, sort=[('fetched_at', -1)])
+  open_listings: Dict[str, List[Any]] = {}
+  if prev is not None:
+    for ent in delta_col.find({'apart_id': apart_id, 'last_seen': prev['fetched_at']}, {'listing_key': 1}):
+      open_listings.setdefault(ent['listing_key'], []).append(ent['_id'])
+
+  extended = []
+  new_rows: List[RowKBOrderbookDelta] = []
+  for row in rows:
+    key = _kb_orderbook_listing_key(row)
+    ids = open_listings.get(key, None)
+    if ids:
+      extended.append(ids.pop())
+      continue
+    new_row = {k: v for k, v in row.items() if k not in ['_id', 'fetched_at']}
+    new_row.update({
+      'apart_id': apart_id,
+      'listing_key': key,
+      'first_seen': fetched_at,
+      'last_seen': fetched_at,
+    })
+    new_rows.append(new_row)
+
+  if len(extended) > 0:
+    delta_col.update_many({'_id': {'$in': extended}}, {'$set': {'last_seen': fetched_at}})
+  if len(new_rows) > 0:
+    details = _pop_details(new_rows)
+    delta_col.insert_many(new_rows)
+    _insert_details(get_kbliiv_apt_orderbook_detail_collection(), new_rows, details)
+  fetch_col.update_one(
+    {'apart_id': apart_id, 'fetched_at': fetched_at},
+    {'$set': {'num_listings': len(rows)}},
+    upsert=True)
+  return len(extended), len(new_rows)
+
+
+def remove_kb_orderbook_delta_since(start: datetime.datetime):
+  delta_col = get_kbliiv_apt_orderbook_delta_collection()
+  fetch_col = get_kbliiv_apt_orderbook_fetch_collection()
+
+  fetch_col.delete_many({'fetched_at': {'$gte': start}})
+  ids = [ent['_id'] for ent in delta_col.find({'first_seen': {'$gte': start}}, {'_id': 1})]
+  delta_col.delete_many({'_id': {'$in': ids}})
+  get_kbliiv_apt_orderbook_detail_collection().delete_many({'_id': {'$in': ids}})
+  for apart_id in delta_col.distinct('apart_id', {'last_seen': {'$gte': start}}):
+    prev = fetch_col.find_one({'apart_id': apart_id}, sort=[('fetched_at', -1)])
+    if prev is None:
+      # no fetch of the complex is left before the cutoff, so none of its listings was ever seen
+      ids = [ent['_id'] for ent in delta_col.find({'apart_id': apart_id}, {'_id': 1})]
+      delta_col.delete_many({'_id': {'$in': ids}})
+      get_kbliiv_apt_orderbook_detail_collection().delete_many({'_id': {'$in': ids}})
+      continue
+    delta_col.update_many(
+      {'apart_id': apart_id, 'last_seen': {'$gte': start}},
+      {'$set': {'last_seen': prev['fetched_at']}})
+
+
+def _query_kb_orderbook_delta(apart_id: int, cond: List[Dict[str, Any]])->List[RowKBOrderbook]:
+  # rebuilds the per-fetch orderbook rows out of the listing intervals
+  fetch_col = get_kbliiv_apt_orderbook_fetch_collection()
+  fetch_cond = [{'apart_id': apart_id}] + [c for c in cond if 'fetched_at' in c]
+  fetch_times = [e['fetched_at'] for e in fetch_col.find({'$and': fetch_cond}, {'fetched_at': 1}).sort('fetched_at', 1)]
+  if len(fetch_times) == 0: return []
+
+  delta_cond = [
+    {'apart_id': apart_id},
+    {'first_seen': {'$lte': fetch_times[-1]}},
+    {'last_seen': {'$gte': fetch_times[0]}},
+  ] + [c for c in cond if 'size' in c]
+
+  res = []
+  col = get_kbliiv_apt_orderbook_delta_collection()
+  for ent in col.find({'$and': delta_cond}, {'detail': 0}):
+    first_seen = ent.pop('first_seen')
+    last_seen = ent.pop('last_seen')
+    del ent['listing_key']
+    idx_from = bisect.bisect_left(fetch_times, first_seen)
+    idx_to = bisect.bisect_right(fetch_times, last_seen)
+    for fetched_at in fetch_times[idx_from:idx_to]:
+      row = ent.copy()
+      row['fetched_at'] = fetched_at
+      res.append(row)
+  return res
+
+
+### Related to building ledger
+class RowBldLedger(TypedDict):
+  _id: Any
+  pk: str                              # 건축물 관리대장 일련번호
+  lawaddrcode_city: int                # 법정동코드(시)
+  lawaddrcode_dong: int                # 법정동코드(동)
+  bun: Optional[int]                   # 번
+  ji: Optional[int]                    # 지
+  addr_road: Optional[str]             # 도로명 주소
+  lawaddr: Optional[str]               # 예전 주소
+  name: Optional[str]                  # 건물명
+  plat_area: Optional[float]           # 대지 면적
+  building_coverage_ratio: Optional[float] # 건폐율
+  floor_area_ratio: Optional[float]    # 용적률
+  household_cnt: Optional[int]         # 세대수
+  used_after: Optional[int]            # 사용승인일 (YYYYMMDD)
+  jigu: List[str]                      # 지역지구구역
+  fetched_at: datetime.datetime        # 다운로드일시
+
+
+def get_bld_ledger_collection()->Collection:
+  global _bld_ledger_collection
+  if _bld_ledger_collection is None:
+    _bld_ledger_collection = get_db()['bld_ledger']
+  return _bld_ledger_collection
+
+
+def join_bld_ledger(rows: List[Dict[str, Any]], batch_size: int=500)->List[Optional[RowBldLedger]]:
+  # looks up the ledger of many kbliiv_apt or trade rows at once, matching their
+  # lawaddrcode_city/dong/main/sub to the ledger's city/dong/bun/ji.
+  # when a lot has several ledgers, the one with the most households is picked.
+  def key_of(row: Dict[str, Any])->Tuple:
+    return (row.get('lawaddrcode_city'), row.get('lawaddrcode_dong'), row.get('lawaddrcode_main'), row.get('lawaddrcode_sub'))
+
+  keys = list(set([key_of(row) for row in rows if None not in key_of(row)]))
+  col = get_bld_ledger_collection()
+  found: Dict[Tuple, RowBldLedger] = {}
+  for idx in range(0, len(keys), batch_size):
+    cond = [{'lawaddrcode_city': c, 'lawaddrcode_dong': d, 'bun': b, 'ji': j} for c, d, b, j in keys[idx:idx+batch_size]]
+    for ent in col.find({'$or': cond}):
+      key = (ent['lawaddrcode_city'], ent['lawaddrcode_dong'], ent['bun'], ent['ji'])
+      prev = found.get(key, None)
+      if prev is None or (ent['household_cnt'] or 0) > (prev['household_cnt'] or 0):
+        found[key] = ent
+  return [found.get(key_of(row), None) for row in rows]
 
 
 ### Related to deposit interest rate (전월세 전환율)
@@ -576,6 +1027,8 @@ def create_indices():
   col.create_index('year')
   col.create_index('month')
   col.create_index('date')
+  # /export/rents: region filter, sorted by date_serial
+  col.create_index([('location_code', 1), ('date_serial', 1)])
 
   col = get_trades_collection()
   col.create_index('lawaddrcode_city')
@@ -588,6 +1041,9 @@ def create_indices():
   col.create_index('date')
   col.create_index('is_canceled')
   col.create_index('canceled_date')
+  col.create_index([('addrcode_city', 1), ('date_serial', 1), ('size', 1), ('price', 1)])
+  # /export/trades: region filter, sorted by date_serial
+  col.create_index([('lawaddrcode_city', 1), ('date_serial', 1)])
 
   col = get_geocodes_collection()
   col.create_index('addrcode_city')
@@ -620,6 +1076,34 @@ def create_indices():
   col.create_index('fetched_at')
   col.create_index('trade_type')
 
+  col = get_ingest_manifest_collection()
+  col.create_index([('kind', 1), ('status', 1)])
+
+  col = get_crawl_jobs_collection()
+  col.create_index([('job', 1), ('status', 1), ('next_try_at', 1)])
+  col.create_index([('job', 1), ('lease_expires', 1)])
+
+  col = get_kbliiv_apt_orderbook_delta_collection()
+  col.create_index([('apart_id', 1), ('last_seen', 1)])
+  col.create_index([('apart_id', 1), ('first_seen', 1)])
+  col.create_index('size')
+
+  col = get_kbliiv_apt_orderbook_fetch_collection()
+  col.create_index([('apart_id', 1), ('fetched_at', 1)], unique=True)
+  col.create_index('fetched_at')
+
+  col = get_bld_ledger_collection()
+  col.create_index([('lawaddrcode_city', 1), ('lawaddrcode_dong', 1), ('bun', 1), ('ji', 1)])
+
+  col = get_volume_daily_collection()
+  col.create_index([('lawaddrcode_city', 1), ('date_serial', 1)])
+  col.create_index([('lawaddrcode_city', 1), ('week', 1)])
+  col.create_index([('addrcode_city', 1), ('date_serial', 1)])
+
+  col = get_volume_weekly_collection()
+  col.create_index([('lawaddrcode_city', 1), ('week', 1)])
+  col.create_index([('addrcode_city', 1), ('week', 1)])
+
   col = get_deposit_interest_rate_collection()
   col.create_index('region')
   col.create_index('size_min')
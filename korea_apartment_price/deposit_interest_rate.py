@@ -1,4 +1,10 @@
-from typing import List, Optional
+import functools
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
 from korea_apartment_price.db import RowDepositInterestRate, query_deposit_interest_rate
 from korea_apartment_price.region_code import RegionCode
 from korea_apartment_price.utils import editdist
@@ -68,7 +74,48 @@ class RegionCodeToRatioRegion:
 
 _convert = RegionCodeToRatioRegion()
 
+@functools.lru_cache(maxsize=4096)
+def _ratio_region(address: str)->str:
+  return _convert.get({'address': address})
+
+
 def query(rc: RegionCode, size: Optional[int]=None, start_ym:Optional[int]=None, end_ym: Optional[int]=None)->List[RowDepositInterestRate]:
-  region = _convert.get(rc)
+  region = _ratio_region(rc['address'])
   return query_deposit_interest_rate(region, size=size, start_ym=start_ym, end_ym=end_ym)
 
+
+# the rates are published monthly and a series is a few hundred rows, so whole series are kept in memory
+SERIES_TTL = 3600.0
+_series_cache: Dict[Tuple[str, Optional[int]], Tuple[float, np.ndarray, np.ndarray]] = {}
+_series_lock = threading.Lock()
+
+def query_series(rc: RegionCode, size: Optional[int]=None)->Tuple[np.ndarray, np.ndarray]:
+  # (yyyymm, value) arrays of the region in ascending order
+  key = (_ratio_region(rc['address']), size)
+  now = time.monotonic()
+  with _series_lock:
+    ent = _series_cache.get(key, None)
+  if ent is not None and now - ent[0] < SERIES_TTL:
+    return ent[1], ent[2]
+
+  rows = list(query_deposit_interest_rate(key[0], size=size))
+  yms = np.array([r['date_serial'] for r in rows], dtype=np.int64)
+  values = np.array([r['value'] for r in rows], dtype=np.float64)
+  order = np.argsort(yms, kind='stable')
+  yms, values = yms[order], values[order]
+  with _series_lock:
+    _series_cache[key] = (now, yms, values)
+  return yms, values
+
+
+def match(rc: RegionCode, size: Optional[int], date_serials: np.ndarray)->Tuple[np.ndarray, np.ndarray]:
+  # for each yyyymmdd, the rate of its month or, if that month is not published, of the next
+  # published month (the last one for dates after it). returns (values, yyyymm) or empty
+  # arrays when the region has no rates at all.
+  yms, values = query_series(rc, size)
+  if len(yms) == 0:
+    return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64)
+  idx = np.searchsorted(yms, np.asarray(date_serials, dtype=np.int64) // 100, side='left')
+  idx = np.minimum(idx, len(yms) - 1)
+  return values[idx], yms[idx]
+
@@ -0,0 +1,147 @@
+import datetime
+import os
+import socket
+import threading
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+
+import pymongo
+from pymongo import UpdateOne
+
+from korea_apartment_price import db
+
+
+__all__ = ('RowCrawlJob', 'JobStateStore')
+
+
+class RowCrawlJob(TypedDict):
+  _id: str
+  job: str                                     # 작업 이름 (예: kb_orderbook:20230101)
+  key: str                                     # 작업 안에서의 task 식별자
+  status: str                                  # pending, running, done, failed, dead
+  attempts: int                                # 시도 횟수
+  last_error: Optional[str]                    # 마지막 오류
+  owner: Optional[str]                         # 실행중인 worker
+  lease_expires: Optional[datetime.datetime]   # running 상태의 만료일시
+  next_try_at: datetime.datetime               # 다음 시도 가능 일시
+  payload: Any                                 # task 입력값
+  updated_at: datetime.datetime
+
+
+def _default_owner()->str:
+  return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+class JobStateStore:
+  # per-task crawl state in the crawl_jobs collection. tasks are claimed with an atomic
+  # find_one_and_update so several processes can split a job without taking the same task,
+  # and a claim whose lease expired (crashed worker) becomes claimable again.
+  def __init__(self, job: str, max_attempts: int=5, lease_sec: float=600.0, backoff_base: float=10.0, backoff_max: float=600.0):
+    self.job = job
+    self.max_attempts = max_attempts
+    self.lease_sec = lease_sec
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+    self.col = db.get_crawl_jobs_collection()
+
+  def _id(self, key: str)->str:
+    return f'{self.job}:{key}'
+
+  def add_tasks(self, tasks: List[Tuple[str, Any]])->int:
+    # registers (key, payload) pairs. tasks that already exist keep their state.
+    now = datetime.datetime.now()
+    ops = [UpdateOne({'_id': self._id(key)}, {'$setOnInsert': {
+      'job': self.job,
+      'key': key,
+      'status': 'pending',
+      'attempts': 0,
+      'last_error': None,
+      'owner': None,
+      'lease_expires': None,
+      'next_try_at': now,
+      'payload': payload,
+      'updated_at': now,
+    }}, upsert=True) for key, payload in tasks]
+    if len(ops) == 0: return 0
+    res = self.col.bulk_write(ops, ordered=False)
+    return res.upserted_count
+
+  def claim(self, owner: Optional[str]=None)->Optional[RowCrawlJob]:
+    now = datetime.datetime.now()
+    return self.col.find_one_and_update({
+      'job': self.job,
+      '$or': [
+        {'status': {'$in': ['pending', 'failed']}, 'next_try_at': {'$lte': now}},
+        {'status': 'running', 'lease_expires': {'$lt': now}},
+      ],
+    }, {
+      '$set': {
+        'status': 'running',
+        'owner': owner if owner is not None else _default_owner(),
+        'lease_expires': now + datetime.timedelta(seconds=self.lease_sec),
+        'updated_at': now,
+      },
+      '$inc': {'attempts': 1},
+    }, sort=[('next_try_at', 1)], return_document=pymongo.ReturnDocument.AFTER)
+
+  def complete(self, key: str):
+    self.complete_many([key])
+
+  def complete_many(self, keys: List[str]):
+    if len(keys) == 0: return
+    self.col.update_many({'_id': {'$in': [self._id(key) for key in keys]}}, {'$set': {
+      'status': 'done',
+      'owner': None,
+      'lease_expires': None,
+      'updated_at': datetime.datetime.now(),
+    }})
+
+  def fail(self, task: RowCrawlJob, error: str)->bool:
+    # returns True if the task will be retried
+    now = datetime.datetime.now()
+    retry = task['attempts'] < self.max_attempts
+    backoff = min(self.backoff_max, self.backoff_base * (2 ** (task['attempts'] - 1)))
+    self.col.update_one({'_id': task['_id']}, {'$set': {
+      'status': 'failed' if retry else 'dead',
+      'last_error': error,
+      'owner': None,
+      'lease_expires': None,
+      'next_try_at': now + datetime.timedelta(seconds=backoff),
+      'updated_at': now,
+    }})
+    return retry
+
+  def wait_time(self)->Optional[float]:
+    # seconds until the next task becomes claimable, None if nothing is left to do
+    now = datetime.datetime.now()
+    waits = []
+    ent = self.col.find_one({'job': self.job, 'status': {'$in': ['pending', 'failed']}}, sort=[('next_try_at', 1)])
+    if ent is not None: waits.append((ent['next_try_at'] - now).total_seconds())
+    ent = self.col.find_one({'job': self.job, 'status': 'running'}, sort=[('lease_expires', 1)])
+    if ent is not None: waits.append((ent['lease_expires'] - now).total_seconds())
+    if len(waits) == 0: return None
+    return max(0.0, min(waits))
+
+  def counts(self)->Dict[str, int]:
+    res = {}
+    for ent in self.col.aggregate([{'$match': {'job': self.job}}, {'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+      res[ent['_id']] = ent['count']
+    return res
+
+  def list_tasks(self, status: str)->List[RowCrawlJob]:
+    return list(self.col.find({'job': self.job, 'status': status}))
+
+  def reset(self):
+    # makes every task of the job pending again
+    now = datetime.datetime.now()
+    self.col.update_many({'job': self.job}, {'$set': {
+      'status': 'pending',
+      'attempts': 0,
+      'last_error': None,
+      'owner': None,
+      'lease_expires': None,
+      'next_try_at': now,
+      'updated_at': now,
+    }})
+
+  def clear(self):
+    self.col.delete_many({'job': self.job})
@@ -1,14 +1,21 @@
 import datetime
+import logging
 import random
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 import requests
+import requests.adapters
 from typing import Any, Callable, Dict, List, Optional, TypeVar
 from enum import Enum
 from korea_apartment_price.db import RowKBOrderbook, TradeType
-from korea_apartment_price.utils.throttle import Throttler
 
 from korea_apartment_price.utils.converter import keyfilt, safe_float, safe_int
+from korea_apartment_price.utils.http_cache import CachedSession
+from korea_apartment_price.utils.throttle import Throttler
+
+_logger = logging.getLogger(__name__)
 
 class KBDo(Enum):
   SEOUL = '서울시'
@@ -53,15 +60,34 @@ def _convert_trade_type(d: str)->Optional[TradeType]:
   return TradeType._value2member_map_[idx]
 
 
+class _CountingAdapter(requests.adapters.HTTPAdapter):
+  # counts the requests that actually go out on the wire. cache hits never reach the adapter,
+  # while a revalidation (If-None-Match -> 304) does and is counted
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.num_sent = 0
+    self._lock = threading.Lock()
+
+  def send(self, request, *args, **kwargs):
+    with self._lock:
+      self.num_sent += 1
+    return super().send(request, *args, **kwargs)
+
+
 class KBLiivCrawler:
-  def __init__(self, timeout:float=60.0, reqeuests_args:Optional[Dict[str, any]]=None):
+  def __init__(self, timeout:float=60.0, reqeuests_args:Optional[Dict[str, any]]=None, pool_size:int=10, max_concurrent_pages:int=4,
+               base_url:str='https://api.kbland.kr', session:Optional[requests.Session]=None, throttler:Optional[Throttler]=None):
     datestr = datetime.date.today().strftime('%Y%m%d')
     randid = random.randint(1000, 9999)
     traceid = f'user_{datestr}{randid}'
     print(traceid)
 
-    self.url = 'https://api.kbland.kr'
+    self.url = base_url
     self.timeout = timeout
+    self.max_concurrent_pages = max_concurrent_pages
+    # every request that actually goes out waits for the throttler, including the orderbook
+    # pages fetched in parallel, so the rate holds per request rather than per complex
+    self.throttler = throttler
     self.requests_args = reqeuests_args if reqeuests_args is not None else dict()
     self.requests_args['headers'] = {
       'Accept': 'application/json, text/plain, */*',
@@ -80,24 +106,62 @@ class KBLiivCrawler:
       'WebService': '1',
     }
 
+    # keep-alive connections to api.kbland.kr are reused across calls. the complex catalogue
+    # and prices are cached on disk; orderbooks are never cached since every fetch is a snapshot
+    self._session = session if session is not None else CachedSession()
+    self._adapter = _CountingAdapter(pool_connections=1, pool_maxsize=pool_size)
+    self._session.mount('https://', self._adapter)
+    self._session.mount('http://', self._adapter)
+
+  def _throttle(self, method: str, url: str, params: Any=None, json_body: Any=None):
+    if self.throttler is None: return
+    # responses served from the cache do not use up the request rate
+    if isinstance(self._session, CachedSession) and self._session.is_fresh(method, url, params, json_body=json_body): return
+    self.throttler.throttle()
+
+  def _get(self, url: str, params: Dict[str, Any])->requests.Response:
+    self._throttle('GET', url, params=params)
+    return self._session.get(url, params=params, timeout=self.timeout, **self.requests_args)
+
+  def _post(self, url: str, data: Dict[str, Any])->requests.Response:
+    self._throttle('POST', url, json_body=data)
+    return self._session.post(url, json=data, timeout=self.timeout, **self.requests_args)
+
+  def connection_stats(self)->Dict[str, int]:
+    managers = [self._adapter.poolmanager] + list(self._adapter.proxy_manager.values())
+    num_connections = 0
+    for manager in managers:
+      for key in list(manager.pools.keys()):
+        pool = manager.pools.get(key)
+        if pool is not None: num_connections += pool.num_connections
+    num_requests = self._adapter.num_sent
+    return {
+      'requests': num_requests,
+      'connections': num_connections,
+      'reused': max(0, num_requests - num_connections),
+    }
+
+  def close(self):
+    self._session.close()
+
   def list_city(self, city: KBDo):
     url = f'{self.url}/land-complex/map/siGunGuAreaNameList'
     params = {'시도명': city.value}
-    resp = requests.get(url, params=params, timeout=self.timeout, **self.requests_args)
+    resp = self._get(url, params)
     data = resp.json()
     return data.get('dataBody', {}).get('data', list())
 
   def list_gu(self, city: KBDo, gu_name: str):
     url = f'{self.url}/land-complex/map/stutDongAreaNameList'
     params = {'시도명': city.value, '시군구명': gu_name}
-    resp = requests.get(url, params=params, timeout=self.timeout, **self.requests_args)
+    resp = self._get(url, params)
     data = resp.json()
     return data.get('dataBody', {}).get('data', list())
 
   def list_apts(self, lawaddrcode: str):
     url = f'{self.url}/land-complex/complexComm/hscmList'
     params = {'법정동코드': lawaddrcode}
-    resp = requests.get(url, params=params, timeout=self.timeout, **self.requests_args)
+    resp = self._get(url, params)
     data = resp.json()
     return data.get('dataBody', {}).get('data', list())
 
@@ -105,7 +169,7 @@ class KBLiivCrawler:
     url = f'{self.url}/land-complex/complex/main'
     params = {'단지기본일련번호': apt_id, '매물종별구분': apt_type}
     print(params)
-    resp = requests.get(url, params=params, timeout=self.timeout, **self.requests_args)
+    resp = self._get(url, params)
     data = resp.json()
     print(data)
     return data.get('dataBody', {}).get('data', {})
@@ -113,14 +177,14 @@ class KBLiivCrawler:
   def apt_type_info(self, apt_id: int):
     url = f'{self.url}/land-complex/complex/typInfo'
     params = {'단지기본일련번호': apt_id}
-    resp = requests.get(url, params=params, timeout=self.timeout, **self.requests_args)
+    resp = self._get(url, params)
     data = resp.json()
     return data.get('dataBody', {}).get('data', list())
 
   def apt_price_info (self, apt_id: int, area_type_id: int):
     url = f'{self.url}/land-price/price/BasePrcInfoNew'
     params = {'단지기본일련번호': apt_id, '면적일련번호': area_type_id}
-    resp = requests.get(url, params=params, timeout=self.timeout, **self.requests_args)
+    resp = self._get(url, params)
     data = resp.json()
     return data.get('dataBody', {}).get('data', list())
 
@@ -139,7 +203,7 @@ class KBLiivCrawler:
       '페이지목록수': items_per_page,
       '페이지번호': page_idx
     }
-    resp = requests.post(url, json=data, timeout=self.timeout, **self.requests_args)
+    resp = self._post(url, data)
     data = resp.json()
 
     total_cnt = data.get('dataBody', {}).get('data', {}).get('총조회수', -1)
@@ -148,15 +212,25 @@ class KBLiivCrawler:
     return (total_cnt, res)
 
   def orderbook(self, apt_id: int, order_by: str='date', aggregate: bool=True):
-    cnt, _ = self.partial_orderbook(apt_id, order_by, aggregate, 10, 1)
-
-    final_res = []
     cnt_per_page = 50
-    num_pages = int((cnt+cnt_per_page - 1) / cnt_per_page)
-    for pageidx in range(num_pages):
-      cnt, cur_res = self.partial_orderbook(apt_id, order_by, aggregate, cnt_per_page, pageidx + 1)
-      final_res += cur_res
-      print (f'Fetched apt_id={apt_id} cur_page={pageidx+1}/{num_pages} cnt={len(final_res)}/{cnt}')
+    cnt, first_page = self.partial_orderbook(apt_id, order_by, aggregate, cnt_per_page, 1)
+    num_pages = max(1, int((cnt + cnt_per_page - 1) / cnt_per_page))
+    _logger.debug('orderbook page fetched apt_id=%s page=%d/%d items=%d total=%d', apt_id, 1, num_pages, len(first_page), cnt)
+
+    def fetch_page(page_idx: int)->List[Dict[str, Any]]:
+      _, cur_res = self.partial_orderbook(apt_id, order_by, aggregate, cnt_per_page, page_idx)
+      _logger.debug('orderbook page fetched apt_id=%s page=%d/%d items=%d total=%d', apt_id, page_idx, num_pages, len(cur_res), cnt)
+      return cur_res
+
+    pages = [first_page]
+    if num_pages > 1:
+      # the remaining pages are fetched in parallel and reassembled in page order
+      max_workers = min(self.max_concurrent_pages, num_pages - 1)
+      with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages += list(executor.map(fetch_page, range(2, num_pages + 1)))
+
+    final_res = [e for page in pages for e in page]
+    _logger.info('orderbook fetched apt_id=%s pages=%d items=%d total=%d', apt_id, num_pages, len(final_res), cnt)
     return final_res
 
   def cleansed_orderbook(self, apt_id: int, order_by: str='date', aggregate: bool=True, trade_types: Optional[List[TradeType]]=None, sizes: Optional[List[float]]=None, include_detail:bool=True)->List[RowKBOrderbook]:
@@ -171,6 +245,8 @@ class KBLiivCrawler:
       ('건물동명', 'apt_dong'),
       ('건물호명', 'apt_ho'),
       ('매물거래구분', 'trade_type', _convert_trade_type),
+      ('최소매매가', 'min_price', safe_float),
+      ('매물일련번호', 'listing_id', safe_int),
       ('', 'fetched_at', lambda _: now),
       ('', 'apart_id', lambda _: apt_id),
     ]) for e in orig_data]
@@ -214,18 +290,38 @@ class KBLiivCrawler:
 
 T = TypeVar('T')
 
+def proxy_requests_args(proxy_addr: Optional[str], requests_args: Optional[Dict[str, Any]]=None)->Dict[str, Any]:
+  new_request_args = requests_args.copy() if requests_args is not None else dict()
+  if proxy_addr is not None:
+    new_request_args.update ({
+      "proxies": {
+        "https": proxy_addr,
+        "http": proxy_addr
+      },
+      "verify": False
+    })
+  return new_request_args
+
+
 class KBLiivCrawlerWithProxy:
   def __init__(self, 
                timeout:float=60.0, 
                reqeuests_args:Optional[Dict[str, any]]=None, 
                proxy_list: list[str]=[],
                max_retry_cnt: int = 10,
+               pool_size: int = 10,
+               max_concurrent_pages: int = 4,
+               base_url: str = 'https://api.kbland.kr',
                ):
+    self.base_url = base_url
     self.requests_args = reqeuests_args.copy() if reqeuests_args is not None else dict()
     self.proxy_list = [None] + proxy_list.copy()
     self.timeout = timeout
+    self.pool_size = pool_size
+    self.max_concurrent_pages = max_concurrent_pages
     self.active_proxy_index: int = 0
     self._crawler: Optional[KBLiivCrawler] = None
+    self._crawlers: Dict[int, KBLiivCrawler] = {}
     self.max_retry_cnt = max_retry_cnt
     self._proxy_fail_cnt = 0
 
@@ -234,23 +330,32 @@ class KBLiivCrawlerWithProxy:
     if self._crawler is None or with_new_proxy:
       if with_new_proxy:
         self.active_proxy_index += 1
-      proxy_addr = self.proxy_list[self.active_proxy_index % len(self.proxy_list)]
+      proxy_index = self.active_proxy_index % len(self.proxy_list)
+      proxy_addr = self.proxy_list[proxy_index]
       if proxy_addr is not None:
         print(f'[!] trying proxy: {proxy_addr}')
       else:
         print(f'[!] trying direct connection (no proxy)')
 
-      new_request_args = self.requests_args.copy()
-      if proxy_addr is not None:
-        new_request_args.update ({
-          "proxies": {
-            "https": proxy_addr,
-            "http": proxy_addr
-          },
-          "verify": False
-        })
-      self._crawler = KBLiivCrawler(timeout=self.timeout, reqeuests_args=new_request_args)
+      # one pooled crawler per proxy, kept alive for when the rotation comes back to it
+      if not proxy_index in self._crawlers:
+        new_request_args = proxy_requests_args(proxy_addr, self.requests_args)
+        self._crawlers[proxy_index] = KBLiivCrawler(
+          timeout=self.timeout, reqeuests_args=new_request_args, pool_size=self.pool_size, max_concurrent_pages=self.max_concurrent_pages,
+          base_url=self.base_url)
+      self._crawler = self._crawlers[proxy_index]
     return self._crawler
+
+  def connection_stats(self)->Dict[str, int]:
+    res = {'requests': 0, 'connections': 0, 'reused': 0}
+    for crawler in self._crawlers.values():
+      for k, v in crawler.connection_stats().items():
+        res[k] += v
+    return res
+
+  def close(self):
+    for crawler in self._crawlers.values():
+      crawler.close()
  
   
   def _retry(self, func: Callable[[KBLiivCrawler], T])->Optional[T]:
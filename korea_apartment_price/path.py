@@ -8,4 +8,5 @@ TRADE_DATA_ROOT=os.path.join(ROOT, 'data', 'trades')
 RENT_DATA_ROOT=os.path.join(ROOT, 'data', 'rents')
 GPS_DATA_ROOT=os.path.join(ROOT, 'data', 'gps')
 CACHE_ROOT=os.path.join(ROOT, 'data', 'cache')
+HTTP_CACHE_ROOT=os.path.join(ROOT, 'data', 'cache', 'http')
 SCRIPT_ROOT=os.path.join(ROOT, 'scripts')
\ No newline at end of file
@@ -0,0 +1,184 @@
+import calendar
+import datetime
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+from korea_apartment_price import db
+
+
+__all__ = (
+  'SIZE_BUCKET',
+  'PRICE_BUCKET',
+  'RowVolumeCell',
+  'week_start',
+  'update_volume_cube',
+  'rebuild_volume_cube',
+  'query_volume_cube',
+)
+
+# trades are counted per (addrcode_city, day or week, size bucket, price bucket) cell.
+# volume_daily is rebuilt from the trades of one (year, month, lawaddrcode_city) whenever the
+# ingestion touches it, and volume_weekly is rebuilt from the daily cells of the weeks that month overlaps.
+SIZE_BUCKET = 3.3     # m² -> 평, same as db.pick_size
+PRICE_BUCKET = 1000   # 만원 -> 천만원
+
+
+class RowVolumeCell(TypedDict):
+  lawaddrcode_city: int  # 법정동시군구코드 (수집 단위)
+  addrcode_city: int     # 도로명시군구코드 (조회 단위)
+  date_serial: int       # 매매일 (volume_daily 만)
+  week: int              # 주 시작일 (월요일, yyyymmdd)
+  size_bucket: int       # 평
+  price_bucket: int      # 천만원
+  cnt: int               # 거래 건수
+  money: int             # 거래 금액 합계 (만원)
+
+
+def _to_date(date_serial: int)->datetime.date:
+  return datetime.date(date_serial // 10000, date_serial // 100 % 100, date_serial % 100)
+
+
+def _to_serial(date: datetime.date)->int:
+  return date.year * 10000 + date.month * 100 + date.day
+
+
+def week_start(date_serial: int)->int:
+  # monday of the iso week containing the date
+  date = _to_date(date_serial)
+  return _to_serial(date - datetime.timedelta(days=date.weekday()))
+
+
+def _month_weeks(year: int, month: int)->List[int]:
+  num_days = calendar.monthrange(year, month)[1]
+  return sorted(set(week_start(year * 10000 + month * 100 + day) for day in range(1, num_days + 1)))
+
+
+def update_volume_cube(year: int, month: int, lawaddrcode_city: int):
+  trades = db.get_trades_collection()
+  daily = db.get_volume_daily_collection()
+  weekly = db.get_volume_weekly_collection()
+
+  cells: List[RowVolumeCell] = []
+  for e in trades.aggregate([
+    # rows without a day (stored as date 0 or null) have no week, the /volume fallback skips them too
+    {'$match': {'lawaddrcode_city': lawaddrcode_city, 'year': year, 'month': month, 'date': {'$gte': 1}}},
+    {'$group': {
+      '_id': {
+        'addrcode_city': '$addrcode_city',
+        'date_serial': '$date_serial',
+        'size_bucket': {'$floor': {'$divide': ['$size', SIZE_BUCKET]}},
+        'price_bucket': {'$floor': {'$divide': ['$price', PRICE_BUCKET]}},
+      },
+      'cnt': {'$sum': 1},
+      'money': {'$sum': '$price'},
+    }},
+  ]):
+    key = e['_id']
+    cells.append({
+      'lawaddrcode_city': lawaddrcode_city,
+      'addrcode_city': key['addrcode_city'],
+      'date_serial': key['date_serial'],
+      'week': week_start(key['date_serial']),
+      'size_bucket': int(key['size_bucket']),
+      'price_bucket': int(key['price_bucket']),
+      'cnt': e['cnt'],
+      'money': e['money'],
+    })
+
+  first_serial = year * 10000 + month * 100 + 1
+  last_serial = year * 10000 + month * 100 + calendar.monthrange(year, month)[1]
+  daily.delete_many({'lawaddrcode_city': lawaddrcode_city, 'date_serial': {'$gte': first_serial, '$lte': last_serial}})
+  if len(cells) > 0:
+    daily.insert_many(cells)
+
+  # weeks crossing a month boundary also hold cells of the neighboring month, so they are summed again from volume_daily
+  weeks = _month_weeks(year, month)
+  week_cells: List[RowVolumeCell] = []
+  for e in daily.aggregate([
+    {'$match': {'lawaddrcode_city': lawaddrcode_city, 'week': {'$in': weeks}}},
+    {'$group': {
+      '_id': {'addrcode_city': '$addrcode_city', 'week': '$week', 'size_bucket': '$size_bucket', 'price_bucket': '$price_bucket'},
+      'cnt': {'$sum': '$cnt'},
+      'money': {'$sum': '$money'},
+    }},
+  ]):
+    week_cells.append({'lawaddrcode_city': lawaddrcode_city, **e['_id'], 'cnt': e['cnt'], 'money': e['money']})
+  weekly.delete_many({'lawaddrcode_city': lawaddrcode_city, 'week': {'$in': weeks}})
+  if len(week_cells) > 0:
+    weekly.insert_many(week_cells)
+
+
+def _is_volume_cube_built()->bool:
+  return db.get_meta_collection().count_documents({'_id': 'volume_cube', 'built_at': {'$ne': None}}, limit=1) > 0
+
+
+def rebuild_volume_cube(progress=None):
+  # builds both cubes from scratch out of the whole trades collection. the marker in the meta
+  # collection is only set once every (year, month, region) is in, so an interrupted rebuild
+  # or cells written by the incremental ingests alone never count as a complete cube
+  meta = db.get_meta_collection()
+  meta.delete_one({'_id': 'volume_cube'})
+  db.get_volume_daily_collection().delete_many({})
+  db.get_volume_weekly_collection().delete_many({})
+  ymregions = sorted(
+    (e['_id']['year'], e['_id']['month'], e['_id']['lawaddrcode_city'])
+    for e in db.get_trades_collection().aggregate([
+      {'$match': {'year': {'$ne': None}, 'month': {'$ne': None}}},
+      {'$group': {'_id': {'year': '$year', 'month': '$month', 'lawaddrcode_city': '$lawaddrcode_city'}}},
+    ])
+  )
+  if progress is not None:
+    ymregions = progress(ymregions)
+  for year, month, lawaddrcode_city in ymregions:
+    update_volume_cube(year, month, lawaddrcode_city)
+  meta.update_one({'_id': 'volume_cube'}, {'$set': {'built_at': datetime.datetime.now()}}, upsert=True)
+
+
+def query_volume_cube(
+    addrcode_cities: List[int],
+    date_from: Optional[int]=None,
+    date_to: Optional[int]=None,
+    size_from: Optional[float]=None,
+    size_to: Optional[float]=None,
+    price_from: Optional[float]=None,
+    price_to: Optional[float]=None,
+  )->Optional[List[Tuple[int, int, int]]]:
+  # returns (week, cnt, money) sorted by week, or None when a filter boundary falls inside a bucket.
+  # size filters are in 평 (as db.pick_size), price filters in 만원, both inclusive.
+  if size_from is not None and size_from != int(size_from): return None
+  if size_to is not None and size_to != int(size_to): return None
+  if price_from is not None and price_from % PRICE_BUCKET != 0: return None
+  if price_to is not None and price_to % PRICE_BUCKET != PRICE_BUCKET - 1: return None
+  # not built yet (run scripts/download_trades.py --rebuild-volume-cube)
+  if not _is_volume_cube_built(): return None
+
+  cond: Dict[str, object] = {'addrcode_city': {'$in': addrcode_cities}}
+  if size_from is not None or size_to is not None:
+    cond['size_bucket'] = {}
+    if size_from is not None: cond['size_bucket']['$gte'] = int(size_from)
+    if size_to is not None: cond['size_bucket']['$lte'] = int(size_to)
+  if price_from is not None or price_to is not None:
+    cond['price_bucket'] = {}
+    if price_from is not None: cond['price_bucket']['$gte'] = int(price_from) // PRICE_BUCKET
+    if price_to is not None: cond['price_bucket']['$lte'] = int(price_to) // PRICE_BUCKET
+
+  # whole weeks are answered from volume_weekly, other date ranges from volume_daily
+  whole_weeks = (date_from is None or _to_date(date_from).weekday() == 0) and \
+                (date_to is None or _to_date(date_to).weekday() == 6)
+  if whole_weeks:
+    col = db.get_volume_weekly_collection()
+    if date_from is not None or date_to is not None:
+      cond['week'] = {}
+      if date_from is not None: cond['week']['$gte'] = date_from
+      if date_to is not None: cond['week']['$lte'] = week_start(date_to)
+  else:
+    col = db.get_volume_daily_collection()
+    cond['date_serial'] = {}
+    if date_from is not None: cond['date_serial']['$gte'] = date_from
+    if date_to is not None: cond['date_serial']['$lte'] = date_to
+
+  cursor = col.aggregate([
+    {'$match': cond},
+    {'$group': {'_id': '$week', 'cnt': {'$sum': '$cnt'}, 'money': {'$sum': '$money'}}},
+    {'$sort': {'_id': 1}},
+  ])
+  return [(e['_id'], e['cnt'], e['money']) for e in cursor]
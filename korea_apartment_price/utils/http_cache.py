@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from korea_apartment_price.path import HTTP_CACHE_ROOT
+
+
+__all__ = ('CachePolicy', 'CachedSession', 'DEFAULT_POLICIES')
+
+
+def _is_ok(resp: requests.Response)->bool:
+  return resp.status_code == 200
+
+def _has_total_count(resp: requests.Response)->bool:
+  # data.go.kr answers quota/key errors with 200 and an error document
+  return resp.status_code == 200 and b'<totalCount>' in resp.content
+
+
+class CachePolicy(NamedTuple):
+  pattern: str                          # regex searched in the url
+  ttl: Optional[float]                  # seconds served without asking the server. None: forever
+  methods: Tuple[str, ...] = ('GET',)
+  validator: Callable[[requests.Response], bool] = _is_ok  # only responses passing this are stored
+
+
+_HOUR = 3600.0
+_DAY = 24 * _HOUR
+
+# first matching policy wins. urls without a policy are never cached
+DEFAULT_POLICIES: List[CachePolicy] = [
+  # 실거래/전월세: the archive keeps the data; the cache only saves a crashed run from refetching
+  CachePolicy(r'apis\.data\.go\.kr/1613000/RTMS', 6 * _HOUR, validator=_has_total_count),
+  CachePolicy(r'apis\.data\.go\.kr/1613000/BldRgstService', 30 * _DAY, validator=_has_total_count),
+  CachePolicy(r'kosis\.kr/openapi/', _DAY),
+  CachePolicy(r'juso\.go\.kr/support/monthChangeFileDown\.do', _DAY),
+  CachePolicy(r'api\.kbland\.kr/land-complex/', 7 * _DAY),
+  CachePolicy(r'api\.kbland\.kr/land-price/', _DAY),
+]
+
+# credentials never take part in the cache key, so rotating a key keeps the cache
+SECRET_PARAMS = {'servicekey', 'apikey', 'api_key', 'confmkey'}
+
+# the cache is pruned at most once per PRUNE_INTERVAL when a session is created:
+# entries that can no longer be served or revalidated are removed, then the oldest
+# entries until the cache fits in max_bytes
+HTTP_CACHE_MAX_BYTES = 2 * 1024 ** 3
+PRUNE_INTERVAL = _DAY
+
+
+def _strip_secrets(url: str)->str:
+  # credentials never reach the disk either, the stored url drops them
+  parts = urlsplit(url)
+  if not parts.query: return url
+  query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in SECRET_PARAMS]
+  return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class CachedSession(requests.Session):
+  # drop-in requests.Session with an on-disk, content-addressed response cache.
+  # stale entries are revalidated with If-None-Match/If-Modified-Since when the server
+  # gave an ETag/Last-Modified, and a 304 refreshes the stored entry.
+  def __init__(self, cache_root: str=HTTP_CACHE_ROOT, policies: Optional[List[CachePolicy]]=None, refresh: bool=False,
+               max_bytes: Optional[int]=HTTP_CACHE_MAX_BYTES):
+    super().__init__()
+    self.cache_root = cache_root
+    self.policies = policies if policies is not None else DEFAULT_POLICIES
+    self.refresh = refresh
+    self.max_bytes = max_bytes
+    self.num_hits = 0
+    self.num_revalidated = 0
+    self.num_misses = 0
+    self._stats_lock = threading.Lock()
+    self._prune_if_due()
+
+  def _policy(self, method: str, url: str)->Optional[CachePolicy]:
+    for policy in self.policies:
+      if method.upper() in policy.methods and re.search(policy.pattern, url):
+        return policy
+    return None
+
+  @staticmethod
+  def cache_key(method: str, url: str, params: Any=None, data: Any=None, json_body: Any=None)->str:
+    items = []
+    if isinstance(params, dict): items = list(params.items())
+    elif params is not None: items = list(params)
+    items = sorted([(str(k), str(v)) for k, v in items if str(k).lower() not in SECRET_PARAMS])
+    body = json.dumps([method.upper(), url, items, data, json_body], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+  def _paths(self, key: str)->Tuple[str, str]:
+    prefix = os.path.join(self.cache_root, key[:2], key)
+    return prefix + '.json', prefix + '.body'
+
+  def _load(self, key: str)->Optional[Tuple[Dict[str, Any], bytes]]:
+    path_meta, path_body = self._paths(key)
+    try:
+      with open(path_meta, 'r') as f:
+        meta = json.load(f)
+      with open(path_body, 'rb') as f:
+        body = f.read()
+    except (OSError, ValueError):
+      return None
+    return meta, body
+
+  def _write(self, path: str, content: bytes):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+      f.write(content)
+    os.replace(tmp_path, path)
+
+  def _store(self, key: str, resp: requests.Response, body: Optional[bytes]=None):
+    path_meta, path_body = self._paths(key)
+    os.makedirs(os.path.dirname(path_meta), exist_ok=True)
+    headers = {k: v for k, v in resp.headers.items() if k.lower() not in ['content-encoding', 'content-length', 'transfer-encoding']}
+    meta = {
+      'url': _strip_secrets(resp.url),
+      'status': resp.status_code,
+      'headers': headers,
+      'encoding': resp.encoding,
+      'stored_at': time.time(),
+    }
+    # the body goes first so a meta file always points to a complete body
+    self._write(path_body, body if body is not None else resp.content)
+    self._write(path_meta, json.dumps(meta).encode('utf-8'))
+
+  def _to_response(self, meta: Dict[str, Any], body: bytes, request: Optional[requests.PreparedRequest]=None)->requests.Response:
+    resp = requests.Response()
+    resp.status_code = meta['status']
+    resp.headers = CaseInsensitiveDict(meta['headers'])
+    resp.url = meta['url']
+    resp.encoding = meta['encoding']
+    resp._content = body
+    resp.request = request
+    resp.from_cache = True
+    return resp
+
+  def is_fresh(self, method: str, url: str, params: Any=None, data: Any=None, json_body: Any=None)->bool:
+    # True if the request would be answered from the cache without touching the network
+    policy = self._policy(method, url)
+    if policy is None or self.refresh: return False
+    path_meta, _ = self._paths(self.cache_key(method, url, params, data, json_body))
+    try:
+      with open(path_meta, 'r') as f:
+        meta = json.load(f)
+    except (OSError, ValueError):
+      return False
+    return policy.ttl is None or time.time() - meta['stored_at'] < policy.ttl
+
+  def _count(self, name: str):
+    with self._stats_lock:
+      setattr(self, name, getattr(self, name) + 1)
+
+  def request(self, method, url, params=None, data=None, headers=None, **kwargs):
+    policy = self._policy(method, url)
+    if policy is None or kwargs.get('stream', False):
+      return super().request(method, url, params=params, data=data, headers=headers, **kwargs)
+
+    key = self.cache_key(method, url, params, data, kwargs.get('json', None))
+    cached = None if self.refresh else self._load(key)
+    headers = dict(headers) if headers is not None else {}
+    if cached is not None:
+      meta, body = cached
+      if policy.ttl is None or time.time() - meta['stored_at'] < policy.ttl:
+        self._count('num_hits')
+        return self._to_response(meta, body)
+      cached_headers = CaseInsensitiveDict(meta['headers'])
+      if 'ETag' in cached_headers:
+        headers['If-None-Match'] = cached_headers['ETag']
+      if 'Last-Modified' in cached_headers:
+        headers['If-Modified-Since'] = cached_headers['Last-Modified']
+
+    resp = super().request(method, url, params=params, data=data, headers=headers, **kwargs)
+    if resp.status_code == 304 and cached is not None:
+      meta, body = cached
+      self._count('num_revalidated')
+      fresh = self._to_response(meta, body, resp.request)
+      self._store(key, fresh, body)
+      return fresh
+
+    self._count('num_misses')
+    resp.from_cache = False
+    if policy.validator(resp):
+      self._store(key, resp)
+    return resp
+
+  def _prune_if_due(self):
+    path_marker = os.path.join(self.cache_root, '.pruned_at')
+    try:
+      if time.time() - os.path.getmtime(path_marker) < PRUNE_INTERVAL: return
+    except OSError:
+      if not os.path.isdir(self.cache_root): return
+    self.prune()
+    with open(path_marker, 'w'):
+      pass
+
+  def prune(self)->int:
+    # returns the number of removed entries
+    now = time.time()
+    entries = []  # (stored_at, size, path_meta, path_body)
+    num_removed = 0
+    for dirpath, _, filenames in os.walk(self.cache_root):
+      for filename in filenames:
+        if not filename.endswith('.json'): continue
+        path_meta = os.path.join(dirpath, filename)
+        path_body = path_meta[:-len('.json')] + '.body'
+        try:
+          with open(path_meta, 'r') as f:
+            meta = json.load(f)
+          size = os.path.getsize(path_meta) + os.path.getsize(path_body)
+        except (OSError, ValueError):
+          continue
+        # entries of urls this session has no policy for are left to the size cap
+        policy = self._policy('GET', meta['url']) or self._policy('POST', meta['url'])
+        stale = policy is not None and policy.ttl is not None and now - meta['stored_at'] >= policy.ttl
+        headers = CaseInsensitiveDict(meta['headers'])
+        if stale and 'ETag' not in headers and 'Last-Modified' not in headers:
+          self._remove(path_meta, path_body)
+          num_removed += 1
+          continue
+        if _strip_secrets(meta['url']) != meta['url']:
+          # written before the stored url dropped the credentials
+          meta['url'] = _strip_secrets(meta['url'])
+          self._write(path_meta, json.dumps(meta).encode('utf-8'))
+        entries.append((meta['stored_at'], size, path_meta, path_body))
+
+    if self.max_bytes is not None:
+      total = sum(e[1] for e in entries)
+      for _, size, path_meta, path_body in sorted(entries):
+        if total <= self.max_bytes: break
+        self._remove(path_meta, path_body)
+        total -= size
+        num_removed += 1
+    return num_removed
+
+  @staticmethod
+  def _remove(path_meta: str, path_body: str):
+    # meta first, so a body is never referenced after it is gone
+    for path in [path_meta, path_body]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+  def cache_stats(self)->Dict[str, int]:
+    return {'hits': self.num_hits, 'revalidated': self.num_revalidated, 'misses': self.num_misses}
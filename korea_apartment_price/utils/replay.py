@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from korea_apartment_price.utils.http_cache import SECRET_PARAMS
+
+
+__all__ = ('fixture_key', 'RecordingSession', 'ReplayServer')
+
+# fixtures are keyed by what goes over the wire (method, path, query, json body), so the
+# recorder and the replay server derive the same key without sharing any client state.
+
+def fixture_key(method: str, path: str, query: List[Tuple[str, str]], body: Optional[bytes])->str:
+  query = sorted([(k, v) for k, v in query if k.lower() not in SECRET_PARAMS])
+  body_json = None
+  if body:
+    try:
+      body_json = json.loads(body)
+    except ValueError:
+      body_json = body.decode('utf-8', errors='replace')
+  content = json.dumps([method.upper(), path, query, body_json], ensure_ascii=False, sort_keys=True)
+  return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class RecordingSession(requests.Session):
+  # requests.Session that writes every response it receives to fixture_root
+  def __init__(self, fixture_root: str):
+    super().__init__()
+    self.fixture_root = fixture_root
+    self.num_recorded = 0
+    self._lock = threading.Lock()
+    os.makedirs(fixture_root, exist_ok=True)
+
+  def is_fresh(self, method: str, url: str, params: Any=None, data: Any=None, json_body: Any=None)->bool:
+    # same interface as CachedSession.is_fresh. nothing is cached, every request goes out
+    return False
+
+  def request(self, method, url, *args, **kwargs):
+    resp = super().request(method, url, *args, **kwargs)
+    self.record(resp)
+    return resp
+
+  def record(self, resp: requests.Response):
+    req = resp.request
+    parts = urlsplit(req.url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    body = req.body.encode('utf-8') if isinstance(req.body, str) else req.body
+    key = fixture_key(req.method, parts.path, query, body)
+    fixture = {
+      'method': req.method,
+      'path': parts.path,
+      'query': [(k, v) for k, v in query if k.lower() not in SECRET_PARAMS],
+      'status': resp.status_code,
+      'content_type': resp.headers.get('Content-Type', 'application/octet-stream'),
+      'body': base64.b64encode(resp.content).decode('ascii'),
+    }
+    path = os.path.join(self.fixture_root, f'{key}.json')
+    with open(path + '.tmp', 'w') as f:
+      json.dump(fixture, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    with self._lock:
+      self.num_recorded += 1
+
+
+class ReplayServer:
+  # local stand-in for api.kbland.kr / apis.data.go.kr serving recorded fixtures.
+  # every response is delayed by latency (+ uniform jitter) and error_rate of them
+  # are answered with error_status instead. unknown requests get 404.
+  def __init__(self,
+               fixture_root: str,
+               host: str='127.0.0.1',
+               port: int=0,
+               latency: float=0.0,
+               jitter: float=0.0,
+               error_rate: float=0.0,
+               error_status: int=503,
+               ):
+    self.fixtures: Dict[str, Dict[str, Any]] = {}
+    for fname in os.listdir(fixture_root):
+      if not fname.endswith('.json'): continue
+      with open(os.path.join(fixture_root, fname), 'r') as f:
+        self.fixtures[fname[:-len('.json')]] = json.load(f)
+
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.error_status = error_status
+    self.stats = {'served': 0, 'errors': 0, 'missing': 0}
+    self._lock = threading.Lock()
+    self._thread: Optional[threading.Thread] = None
+
+    server = self
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def log_message(self, format, *args):
+        pass
+
+      def _respond(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def _handle(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        body = self.rfile.read(length) if length > 0 else None
+        key = fixture_key(self.command, parts.path, parse_qsl(parts.query, keep_blank_values=True), body)
+        server._serve(self, key)
+
+      do_GET = _handle
+      do_POST = _handle
+
+    self._server = ThreadingHTTPServer((host, port), Handler)
+    self._server.daemon_threads = True
+
+  def _count(self, name: str):
+    with self._lock:
+      self.stats[name] += 1
+
+  def _serve(self, handler: BaseHTTPRequestHandler, key: str):
+    delay = self.latency + random.uniform(0.0, self.jitter)
+    if delay > 0.0: time.sleep(delay)
+
+    if self.error_rate > 0.0 and random.random() < self.error_rate:
+      self._count('errors')
+      handler._respond(self.error_status, 'text/plain', b'injected error')
+      return
+
+    fixture = self.fixtures.get(key, None)
+    if fixture is None:
+      self._count('missing')
+      handler._respond(404, 'text/plain', b'no fixture')
+      return
+    self._count('served')
+    handler._respond(fixture['status'], fixture['content_type'], base64.b64decode(fixture['body']))
+
+  @property
+  def base_url(self)->str:
+    host, port = self._server.server_address[:2]
+    return f'http://{host}:{port}'
+
+  def start(self)->str:
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    self._thread.start()
+    return self.base_url
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+    if self._thread is not None:
+      self._thread.join()
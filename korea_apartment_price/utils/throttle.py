@@ -1,19 +1,69 @@
+import asyncio
+import threading
 import time
-import datetime
-from typing import Optional
+from typing import Dict, Optional
+
+__all__ = ('Throttler', 'get_throttler')
+
 
 class Throttler:
-  def __init__(self, max_req_per_sec:float):
-    self._min_interval = 1.0 / max_req_per_sec
-    self._last: Optional[float] = None
+  # token bucket on the monotonic clock, shareable between threads and asyncio tasks.
+  # with adaptive=True the rate is halved on every reported failure (429, timeout, ...)
+  # and grows back additively on success, never above max_req_per_sec.
+  def __init__(self,
+               max_req_per_sec:float,
+               burst:float=1.0,
+               adaptive:bool=False,
+               min_req_per_sec:Optional[float]=None,
+               increase_step:Optional[float]=None,
+               decrease_factor:float=0.5,
+               ):
+    self.max_rate = max_req_per_sec
+    self.min_rate = min_req_per_sec if min_req_per_sec is not None else max_req_per_sec / 20.0
+    self.increase_step = increase_step if increase_step is not None else max_req_per_sec / 20.0
+    self.decrease_factor = decrease_factor
+    self.adaptive = adaptive
+    self.burst = burst
+    self.rate = max_req_per_sec
+    self._tokens = burst
+    self._last = time.monotonic()
+    self._lock = threading.Lock()
 
-  def throttle(self):
-    now = datetime.datetime.now().timestamp()
-    if self._last is None:
+  def _reserve(self)->float:
+    # takes one token and returns how long the caller has to wait for it
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
       self._last = now
-      return
-    diff = self._min_interval - now + self._last 
-    self._last = now
-    if diff > 0.0: time.sleep(diff)
-    return
-     
\ No newline at end of file
+      self._tokens -= 1.0
+      if self._tokens >= 0.0: return 0.0
+      return -self._tokens / self.rate
+
+  def throttle(self):
+    wait = self._reserve()
+    if wait > 0.0: time.sleep(wait)
+
+  async def athrottle(self):
+    wait = self._reserve()
+    if wait > 0.0: await asyncio.sleep(wait)
+
+  def report_success(self):
+    if not self.adaptive: return
+    with self._lock:
+      self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+  def report_failure(self):
+    if not self.adaptive: return
+    with self._lock:
+      self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+
+
+_throttlers: Dict[str, Throttler] = {}
+_throttlers_lock = threading.Lock()
+
+def get_throttler(key: str, max_req_per_sec: float=1.0, **kwargs)->Throttler:
+  # one shared bucket per host/proxy. the arguments of the first call win.
+  with _throttlers_lock:
+    if not key in _throttlers:
+      _throttlers[key] = Throttler(max_req_per_sec, **kwargs)
+    return _throttlers[key]
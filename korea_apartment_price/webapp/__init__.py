@@ -16,6 +16,7 @@ WEBAPP_CFG = get_cfg().get('WEBAPP', {})
 DB_TYPE = WEBAPP_CFG.get('DB_TYPE', 'sqlite')
 DB_NAME = WEBAPP_CFG.get('DB_NAME', './db.sqlite')
 DB_ARGS = WEBAPP_CFG.get('DB_ARGS', {})
+DB_MAX_CONNECTIONS = WEBAPP_CFG.get('DB_MAX_CONNECTIONS', 20)
 SALT    = WEBAPP_CFG.get('ADMIN_PASSWORD', _random_chars(50))
 DEBUG   = WEBAPP_CFG.get('JWT_SECRET', _random_chars(50))
 JWT_SECRET     = WEBAPP_CFG.get('JWT_SECRET', _random_chars(50))
@@ -0,0 +1,178 @@
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import orjson
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, TypeAdapter
+
+from korea_apartment_price import db
+from korea_apartment_price.webapp import WEBAPP_CFG
+from korea_apartment_price.webapp.executor import run_blocking
+
+
+__all__ = ('LRUCache', 'RedisCache', 'get_response_cache', 'data_version', 'cached_response')
+
+CACHE_TTL = WEBAPP_CFG.get('CACHE_TTL', 24 * 3600)
+CACHE_MAX_ENTRIES = WEBAPP_CFG.get('CACHE_MAX_ENTRIES', 2048)
+CACHE_REDIS_URL = WEBAPP_CFG.get('CACHE_REDIS_URL', None)
+# how long a data version read from mongo is trusted before asking again
+CACHE_VERSION_CHECK_SEC = WEBAPP_CFG.get('CACHE_VERSION_CHECK_SEC', 5.0)
+
+
+class LRUCache:
+  def __init__(self, max_entries: int=CACHE_MAX_ENTRIES, ttl: Optional[float]=CACHE_TTL):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key: str)->Optional[Any]:
+    with self._lock:
+      ent = self._entries.get(key, None)
+      if ent is None: return None
+      value, expires_at = ent
+      if expires_at is not None and expires_at < time.monotonic():
+        del self._entries[key]
+        return None
+      self._entries.move_to_end(key)
+      return value
+
+  def set(self, key: str, value: Any, ttl: Optional[float]=None):
+    # ttl overrides the cache-wide ttl for this entry
+    ttl = ttl if ttl is not None else self.ttl
+    expires_at = time.monotonic() + ttl if ttl is not None else None
+    with self._lock:
+      self._entries[key] = (value, expires_at)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+
+class RedisCache:
+  # works with any client exposing get(key) and set(key, value, ex=seconds),
+  # e.g. redis.Redis or an in-memory stand-in such as fakeredis
+  def __init__(self, client: Any, ttl: Optional[float]=CACHE_TTL, prefix: str='kap:resp:'):
+    self.client = client
+    self.ttl = ttl
+    self.prefix = prefix
+
+  def get(self, key: str)->Optional[bytes]:
+    return self.client.get(self.prefix + key)
+
+  def set(self, key: str, value: bytes):
+    self.client.set(self.prefix + key, value, ex=int(self.ttl) if self.ttl is not None else None)
+
+
+_response_cache = None
+
+def get_response_cache():
+  global _response_cache
+  if _response_cache is None:
+    if CACHE_REDIS_URL:
+      import redis
+      _response_cache = RedisCache(redis.Redis.from_url(CACHE_REDIS_URL))
+    else:
+      _response_cache = LRUCache()
+  return _response_cache
+
+
+_version_lock = threading.Lock()
+_version: Optional[int] = None
+_version_checked_at = 0.0
+
+async def data_version()->int:
+  # bumped by the ingestion scripts (db.bump_data_version). part of every cache key and etag,
+  # so new data makes both the cached bodies and the browsers' copies stale.
+  # the mongo round trip runs in the db pool, never on the event loop
+  global _version, _version_checked_at
+  now = time.monotonic()
+  with _version_lock:
+    if _version is not None and now - _version_checked_at < CACHE_VERSION_CHECK_SEC:
+      return _version
+  version = await run_blocking(db.get_data_version)
+  with _version_lock:
+    _version, _version_checked_at = version, now
+  return version
+
+
+def _etag_matches(header: Optional[str], etag: str)->bool:
+  if header is None: return False
+  for tag in header.split(','):
+    tag = tag.strip()
+    if tag.startswith('W/'): tag = tag[2:]
+    if tag == '*' or tag == etag: return True
+  return False
+
+
+def _dump_trusted(res: Any)->bytes:
+  # rows straight from the db are serialized as they are, without a pydantic pass per row
+  if isinstance(res, BaseModel):
+    res = {k: getattr(res, k) for k in res.model_fields}
+  return orjson.dumps(res, option=orjson.OPT_NON_STR_KEYS)
+
+
+def cached_response(response_model: Any, validate: bool=True)->Callable:
+  # caches the serialized response of an endpoint keyed on (path, query string, request body, data version).
+  # response_model must match the route's response_model since the cached body is serialized here.
+  # with validate=False the result is written with orjson as returned, which is much faster for long
+  # histories but leaves it to the endpoint to return exactly the fields of response_model.
+  # the decorated endpoint gets an extra `request` parameter unless it already declares one.
+  adapter = TypeAdapter(response_model)
+
+  def decorator(func: Callable)->Callable:
+    sig = inspect.signature(func)
+    has_request = 'request' in sig.parameters
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+      request: Request = kwargs['request'] if has_request else kwargs.pop('request')
+      params = {k: v for k, v in kwargs.items() if k != 'request'}
+      key_src = json.dumps([
+        request.url.path,
+        sorted(request.query_params.multi_items()),
+        jsonable_encoder(params),
+        await data_version(),
+      ], ensure_ascii=False, sort_keys=True)
+      key = hashlib.sha256(key_src.encode('utf-8')).hexdigest()
+      headers = {
+        'ETag': f'"{key[:32]}"',
+        # private: responses are behind the login. no-cache: browsers revalidate every time and get 304s
+        'Cache-Control': 'private, no-cache',
+      }
+      if _etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+        return Response(status_code=304, headers=headers)
+
+      cache = get_response_cache()
+      entry = cache.get(key)
+      if entry is None:
+        res = await func(*args, **kwargs)
+        if isinstance(res, Response):
+          # already serialized by the endpoint (e.g. arrow)
+          media_type, body = res.media_type, res.body
+        elif validate:
+          media_type, body = 'application/json', adapter.dump_json(adapter.validate_python(jsonable_encoder(res)))
+        else:
+          media_type, body = 'application/json', _dump_trusted(res)
+        # stored as '<media type>\n<body>' so that the redis backend keeps plain bytes
+        entry = media_type.encode('utf-8') + b'\n' + body
+        cache.set(key, entry)
+      media_type, body = entry.split(b'\n', 1)
+      return Response(content=body, media_type=media_type.decode('utf-8'), headers=headers)
+
+    if not has_request:
+      params: List[inspect.Parameter] = list(sig.parameters.values())
+      params.append(inspect.Parameter('request', inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+      wrapper.__signature__ = sig.replace(parameters=params)
+    return wrapper
+  return decorator
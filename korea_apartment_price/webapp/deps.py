@@ -1,10 +1,20 @@
+import time
+
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer 
+from fastapi.security import OAuth2PasswordBearer
 
-from korea_apartment_price.webapp import models
+from korea_apartment_price.webapp import WEBAPP_CFG, models
+from korea_apartment_price.webapp.cache import LRUCache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/account/token")
 
+# verified tokens are remembered for a while so that each request does not decode the jwt again.
+# an entry never outlives the token's own exp.
+AUTH_CACHE_TTL = WEBAPP_CFG.get('AUTH_CACHE_TTL', 300)
+AUTH_CACHE_MAX_ENTRIES = WEBAPP_CFG.get('AUTH_CACHE_MAX_ENTRIES', 4096)
+
+_token_cache = LRUCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL)
+
 
 class UnauthenticatedError(HTTPException):
   def __init__(self):
@@ -14,31 +24,32 @@ class UnauthenticatedError(HTTPException):
       headers={"WWW-Authenticate": "Bearer"},
     )
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+
+def verify_token(token: str)->models.AuthClaims:
+  claims = _token_cache.get(token)
+  if claims is not None:
+    return claims
   try:
-    user = models.User.from_jwt(token)
-  except:
+    claims = models.AuthClaims.from_jwt(token)
+  except Exception:
     raise UnauthenticatedError()
-  return user
+  _token_cache.set(token, claims, ttl=min(AUTH_CACHE_TTL, claims.exp - time.time()))
+  return claims
 
 
-async def get_current_real_user(token: str = Depends(oauth2_scheme)):
-  try:
-    user = models.User.from_jwt(token)
-  except:
-    raise UnauthenticatedError()
+async def get_current_user(token: str = Depends(oauth2_scheme))->models.AuthClaims:
+  return verify_token(token)
+
+
+async def get_current_real_user(token: str = Depends(oauth2_scheme))->models.AuthClaims:
+  user = verify_token(token)
   if not user.is_real:
     raise UnauthenticatedError()
-
   return user
 
 
-async def get_current_admin_user(token: str = Depends(oauth2_scheme)):
-  try:
-    user = models.User.from_jwt(token)
-    if not user.is_admin:
-      raise UnauthenticatedError()
-  except:
+async def get_current_admin_user(token: str = Depends(oauth2_scheme))->models.AuthClaims:
+  user = verify_token(token)
+  if not user.is_admin:
     raise UnauthenticatedError()
   return user
-
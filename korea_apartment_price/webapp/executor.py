@@ -0,0 +1,120 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from korea_apartment_price.webapp import WEBAPP_CFG
+
+
+__all__ = ('BlockingPool', 'get_pool', 'run_blocking', 'blocking', 'pool_stats', 'shutdown_pools')
+
+# route handlers are async and hand every blocking call (pymongo, peewee, Finder/editdist)
+# to one of these pools, so a slow query occupies a pool thread instead of the event loop.
+# 'db' is for database round trips, 'search' for the cpu heavy apartment/region search.
+POOL_SIZES: Dict[str, int] = {
+  'db': 16,
+  'search': 4,
+  **WEBAPP_CFG.get('BLOCKING_POOL_SIZES', {}),
+}
+
+
+class BlockingPool:
+  def __init__(self, name: str, max_workers: int):
+    self.name = name
+    self.max_workers = max_workers
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'blocking-{name}')
+    self._lock = threading.Lock()
+    self.queued = 0          # submitted, waiting for a thread
+    self.running = 0
+    self.completed = 0
+    self.failed = 0
+    self.total_wait = 0.0    # seconds spent in the queue, summed over completed calls
+    self.total_run = 0.0
+    self.max_wait = 0.0
+    self.max_run = 0.0
+
+  def _run(self, submitted_at: float, func: Callable, args, kwargs):
+    started_at = time.monotonic()
+    with self._lock:
+      self.queued -= 1
+      self.running += 1
+    ok = False
+    try:
+      res = func(*args, **kwargs)
+      ok = True
+      return res
+    finally:
+      finished_at = time.monotonic()
+      wait, run = started_at - submitted_at, finished_at - started_at
+      with self._lock:
+        self.running -= 1
+        if ok: self.completed += 1
+        else: self.failed += 1
+        self.total_wait += wait
+        self.total_run += run
+        self.max_wait = max(self.max_wait, wait)
+        self.max_run = max(self.max_run, run)
+
+  async def run(self, func: Callable, *args, **kwargs)->Any:
+    with self._lock:
+      self.queued += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self._executor, functools.partial(self._run, time.monotonic(), func, args, kwargs))
+
+  def stats(self)->Dict[str, Any]:
+    with self._lock:
+      num_done = self.completed + self.failed
+      return {
+        'max_workers': self.max_workers,
+        'queued': self.queued,
+        'running': self.running,
+        'completed': self.completed,
+        'failed': self.failed,
+        'avg_wait_ms': 1000.0 * self.total_wait / num_done if num_done > 0 else 0.0,
+        'avg_run_ms': 1000.0 * self.total_run / num_done if num_done > 0 else 0.0,
+        'max_wait_ms': 1000.0 * self.max_wait,
+        'max_run_ms': 1000.0 * self.max_run,
+      }
+
+  def shutdown(self):
+    self._executor.shutdown(wait=False)
+
+
+_pools: Dict[str, BlockingPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(name: str)->BlockingPool:
+  with _pools_lock:
+    if name not in _pools:
+      _pools[name] = BlockingPool(name, POOL_SIZES.get(name, POOL_SIZES['db']))
+    return _pools[name]
+
+
+async def run_blocking(func: Callable, *args, pool: str='db', **kwargs)->Any:
+  return await get_pool(pool).run(func, *args, **kwargs)
+
+
+def blocking(pool: str='db')->Callable:
+  # turns a sync route handler into an async one that runs in the given pool
+  def decorator(func: Callable)->Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+      return await run_blocking(func, *args, pool=pool, **kwargs)
+    return wrapper
+  return decorator
+
+
+def pool_stats()->Dict[str, Dict[str, Any]]:
+  with _pools_lock:
+    pools = list(_pools.values())
+  return {p.name: p.stats() for p in pools}
+
+
+def shutdown_pools():
+  with _pools_lock:
+    pools = list(_pools.values())
+    _pools.clear()
+  for p in pools:
+    p.shutdown()
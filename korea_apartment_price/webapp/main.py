@@ -1,46 +1,27 @@
-import json
 import os
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from korea_apartment_price.webapp import DEBUG
+from korea_apartment_price.webapp import DEBUG, models
+from korea_apartment_price.webapp.deps import get_current_admin_user
+from korea_apartment_price.webapp.executor import pool_stats, shutdown_pools
 from korea_apartment_price.webapp.types import BaseResponse
 
 
-app = FastAPI()
-
-@app.exception_handler(StarletteHTTPException)
-async def http_exception_handler(request, exc):
-  res = BaseResponse(success=False, msg=exc.detail)
-  return PlainTextResponse(json.dumps(res, ensure_ascii=False), status_code=exc.status_code)
-
-@app.exception_handler(RequestValidationError)
-async def validation_exception_handler(request, exc):
-  res = BaseResponse(success=False, msg=str(exc))
-  return PlainTextResponse(json.dumps(res, ensure_ascii=False), status_code=400)
-
-
-if DEBUG:
-  app.add_middleware(
-    CORSMiddleware,
-    allow_origins=['*'],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-  )
-
-
 from korea_apartment_price.webapp.routers import (
   account,
   fav,
   apartment,
   volume,
   region_code,
+  export,
 )
 
 tags_metadata = [
@@ -64,18 +45,64 @@ tags_metadata = [
     "name": "Trading volume",
     "description": "주간 거래량 통계"
   },
+  {
+    "name": "Export",
+    "description": "지역별 실거래/전월세 내역 내려받기 (NDJSON, CSV)"
+  },
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  models.init_db()
+  yield
+  shutdown_pools()
+  models.close_db()
+
+
 app = FastAPI(
   title='한국 아파트 가격 분석',
+  lifespan=lifespan,
   openapi_tags=tags_metadata,
+  default_response_class=ORJSONResponse,
 )
 
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request, exc):
+  res = BaseResponse(success=False, msg=exc.detail)
+  return ORJSONResponse(res.model_dump(), status_code=exc.status_code, headers=getattr(exc, 'headers', None))
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request, exc):
+  res = BaseResponse(success=False, msg=str(exc))
+  return ORJSONResponse(res.model_dump(), status_code=400)
+
+
+if DEBUG:
+  app.add_middleware(
+    CORSMiddleware,
+    allow_origins=['*'],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+  )
+
+
+# long trade/rent histories compress well. brotli is left to the reverse proxy (see nginx.example.conf)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 app.include_router(account.router, prefix='/api')
 app.include_router(apartment.router, prefix='/api')
 app.include_router(fav.router, prefix='/api')
 app.include_router(region_code.router, prefix='/api')
 app.include_router(volume.router, prefix='/api')
+app.include_router(export.router, prefix='/api')
+
+
+@app.get('/api/metrics/pools', tags=['Account'], dependencies=[Depends(get_current_admin_user)])
+async def blocking_pool_metrics():
+  # queue depth and latency of the pools running blocking db/search calls
+  return BaseResponse(success=True, result=pool_stats())
+
 
 STATIC_PATH=os.path.realpath(os.path.join(os.path.dirname(__file__), 'static'))
 app.mount("/", StaticFiles(directory=STATIC_PATH, html=True), name="static")
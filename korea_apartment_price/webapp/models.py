@@ -1,26 +1,81 @@
 import re
+import functools
 import hashlib
 import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional
 
 import json
 import jwt
 from peewee import *
+from playhouse.pool import PooledMySQLDatabase
 from korea_apartment_price.webapp import *
 
+# requests run on the blocking pool threads and each one opens (sqlite) or borrows (mysql)
+# a connection for its duration, see with_db_connection
 if DB_TYPE == 'sqlite':
-  db = SqliteDatabase(DB_NAME, **DB_ARGS)
+  # wal lets the favorites reads go on while another thread writes
+  db = SqliteDatabase(DB_NAME, **{
+    'pragmas': {'journal_mode': 'wal', 'synchronous': 'normal', 'foreign_keys': 1},
+    'timeout': 10,
+    **DB_ARGS,
+  })
 elif DB_TYPE == 'mysql':
-  db = MySQLDatabase(DB_NAME, **DB_ARGS)
+  db = PooledMySQLDatabase(DB_NAME, **{
+    'max_connections': DB_MAX_CONNECTIONS,
+    'stale_timeout': 300,
+    **DB_ARGS,
+  })
 else:
   raise ValueError(f'Unsupported db type {DB_TYPE}')
 
 
+def with_db_connection(func):
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    with db.connection_context():
+      return func(*args, **kwargs)
+  return wrapper
+
+
 class BaseModel(Model):
   class Meta:
     database = db
 
 
+class AuthClaims(NamedTuple):
+  # what a verified token says about its user. authorization only needs these,
+  # so requests do not build a peewee model or touch the db
+  id: Optional[int]
+  email: str
+  is_admin: bool
+  is_active: bool
+  exp: float = 0.0   # unix time the token expires at
+
+  @property
+  def is_real(self)->bool:
+    return self.id is not None
+
+  def to_jwt(self)->bytes:
+    data ={
+      'user': {
+        'id': self.id,
+        'email': self.email,
+        'is_admin': self.is_admin,
+        'is_active': self.is_active,
+      },
+      'exp': datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(hours=24),
+    }
+    return jwt.encode(data, key=JWT_SECRET)
+
+  @classmethod
+  def from_jwt(cls, data:str)->"AuthClaims":
+    decoded = jwt.decode(data, key=JWT_SECRET, algorithms=['HS256'])
+    if 'user' in decoded:
+      user = decoded['user']
+      return cls(user.get('id'), user['email'], bool(user.get('is_admin')), bool(user.get('is_active')), float(decoded['exp']))
+    raise ValueError('cannot restore User object from jtw token')
+
+
 class User(BaseModel):
   id = PrimaryKeyField()
   email = CharField(255, unique=True)
@@ -79,23 +134,12 @@ class User(BaseModel):
 
 
   def to_jwt(self)->bytes: 
-    data ={
-      'user': {
-        'id': self.id,
-        'email': self.email,
-        'is_admin': self.is_admin,
-        'is_active': self.is_active,
-      },
-      'exp': datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(hours=24),
-    }
-    return jwt.encode(data, key=JWT_SECRET)
+    return AuthClaims(self.id, self.email, self.is_admin, self.is_active).to_jwt()
   
   @classmethod
   def from_jwt(cls, data:str)->"User":
-    decoded = jwt.decode(data, key=JWT_SECRET, algorithms=['HS256'])
-    if 'user' in decoded:
-      return cls(**decoded['user'])
-    raise ValueError('cannot restore User object from jtw token')
+    claims = AuthClaims.from_jwt(data)
+    return cls(id=claims.id, email=claims.email, is_admin=claims.is_admin, is_active=claims.is_active)
   
   @property
   def is_real(self):
@@ -123,12 +167,13 @@ class Favorite(BaseModel):
   size = IntegerField()
 
   @classmethod
-  def list(cls, user:"User")->Dict[str, List[Dict[str, Any]]]:
+  def list(cls, user:"AuthClaims")->Dict[str, List[Dict[str, Any]]]:
     res = {}
-    for fav in cls.select().join(User, attr=['id']).where(User.id == user.id).order_by(Favorite.address, Favorite.name, Favorite.size):
-      if not fav.address in res:
-        res[fav.address] = []
-      res[fav.address].append({'id':fav.id, 'name': fav.name, 'size': fav.size})
+    query = cls.select(cls.id, cls.address, cls.name, cls.size).where(cls.user == user.id).order_by(cls.address, cls.name, cls.size)
+    for fid, address, name, size in query.tuples():
+      if not address in res:
+        res[address] = []
+      res[address].append({'id': fid, 'name': name, 'size': size})
     return res
   
   def as_dict(self):
@@ -139,6 +184,14 @@ class Favorite(BaseModel):
       'size': self.size
     }
 
-for table in [User, Favorite]:
-  if not table.table_exists():
-    table.create_table()
\ No newline at end of file
+def init_db():
+  # called once at app startup
+  with db.connection_context():
+    db.create_tables([User, Favorite], safe=True)
+
+
+def close_db():
+  if isinstance(db, PooledMySQLDatabase):
+    db.close_all()
+  elif not db.is_closed():
+    db.close()
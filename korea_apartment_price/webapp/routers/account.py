@@ -6,6 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from fastapi.security import OAuth2PasswordRequestForm
 from korea_apartment_price.webapp import ADMIN_PASSWORD, models
+from korea_apartment_price.webapp.executor import blocking
 from korea_apartment_price.webapp.types import BaseResponse
 from korea_apartment_price.webapp.deps import (
   get_current_admin_user,
@@ -24,7 +25,9 @@ class Token(BaseModel):
 
 
 @router.post("/token", response_model=Token)
-async def login(f: OAuth2PasswordRequestForm=Depends()):
+@blocking()
+@models.with_db_connection
+def login(f: OAuth2PasswordRequestForm=Depends()):
   user = models.User.login(f.username, f.password)
   if not user:
     raise HTTPException(
@@ -36,7 +39,7 @@ async def login(f: OAuth2PasswordRequestForm=Depends()):
   return Token(access_token=token, token_type='bearer')
 
 @router.get("/token_refresh", response_model=Token)
-async def token_refresh(u: models.User = Depends(get_current_user)):
+async def token_refresh(u: models.AuthClaims = Depends(get_current_user)):
   token = u.to_jwt()
   return Token(access_token=token, token_type='bearer')
 
@@ -49,9 +52,14 @@ class AccountInfo(BaseModel):
   settings: Dict[str, Any]
 
 @router.get("/me", response_model=BaseResponse[AccountInfo])
-async def get_my_info(u: models.User = Depends(get_current_user)):
-  u = models.User.get(id=u.id)
-  uinfo = {k: v for k, v in u.__data__.items() if k in ['id', 'email', 'is_admin', 'date_created', 'settings']}
+@blocking()
+@models.with_db_connection
+def get_my_info(u: models.AuthClaims = Depends(get_current_user)):
+  User = models.User
+  try:
+    uinfo = User.select(User.id, User.email, User.is_admin, User.date_created, User.settings).where(User.id == u.id).dicts().get()
+  except User.DoesNotExist:
+    raise HTTPException(status.HTTP_404_NOT_FOUND)
   uinfo['date_created'] = uinfo['date_created'].isoformat()
   try:
     uinfo['settings'] = json.loads(uinfo['settings'])
@@ -65,7 +73,9 @@ class RegisterForm(BaseModel):
   password: str
 
 @router.post("/register", response_model=BaseResponse[dict])
-async def user_register(f: RegisterForm):
+@blocking()
+@models.with_db_connection
+def user_register(f: RegisterForm):
   if len(f.password) < 8:
     raise HTTPException(
       status_code=status.HTTP_400_BAD_REQUEST,
@@ -97,7 +107,9 @@ class UserList(BaseModel):
 
 
 @router.get("/", response_model=BaseResponse[UserList])
-async def user_list(u: models.User = Depends(get_current_admin_user), pageidx:int=1, items_per_page: int=50):
+@blocking()
+@models.with_db_connection
+def user_list(u: models.AuthClaims = Depends(get_current_admin_user), pageidx:int=1, items_per_page: int=50):
   user_cnt = models.User.select().count()
   users = list(models.User.select().order_by(models.User.date_created).paginate(pageidx, items_per_page))
   users_converted = []
@@ -118,7 +130,9 @@ async def user_list(u: models.User = Depends(get_current_admin_user), pageidx:in
   })
 
 @router.get("/{user_id}", response_model=BaseResponse[UserInfo])
-async def user_detail(user_id: int, u: models.User = Depends(get_current_user)):
+@blocking()
+@models.with_db_connection
+def user_detail(user_id: int, u: models.AuthClaims = Depends(get_current_user)):
   try:
     tu = models.User.get(id=user_id)
   except models.User.DoesNotExist:
@@ -144,7 +158,9 @@ class AccountSetReq(BaseModel):
 
 
 @router.post("/{user_id}", response_model=BaseResponse[dict])
-async def user_set(user_id:int, req: AccountSetReq, u: models.User = Depends(get_current_user)):
+@blocking()
+@models.with_db_connection
+def user_set(user_id:int, req: AccountSetReq, u: models.AuthClaims = Depends(get_current_user)):
   try:
     tu = models.User.get(id=user_id)
   except models.User.DoesNotExist:
@@ -1,11 +1,15 @@
 import re
 
 from typing import Any, Dict, List, Literal, Optional, Union
-from fastapi import APIRouter, Depends
+import numpy as np
+import pyarrow as pa
+from fastapi import APIRouter, Depends, Response
 from pydantic import BaseModel
 import korea_apartment_price
 import korea_apartment_price.deposit_interest_rate
 from korea_apartment_price.db import ApartmentId
+from korea_apartment_price.webapp.cache import cached_response
+from korea_apartment_price.webapp.executor import blocking
 from korea_apartment_price.webapp.types import BaseResponse
 from korea_apartment_price.webapp.deps import (
   get_current_user
@@ -25,7 +29,8 @@ class ApartmentIdModel(BaseModel):
   name: str
 
 @router.get("/search", response_model=BaseResponse[List[ApartmentIdModel]])
-async def search_apt(addr: str='', apt_name: str=''):
+@blocking('search')
+def search_apt(addr: str='', apt_name: str=''):
   aptlst = korea_apartment_price.shortcuts.search(addr, apt_name)
   return BaseResponse(success=True, result=aptlst)
 
@@ -49,8 +54,24 @@ def _keep_keys_in_dict(x: Dict[str, Any], keep:List[str])->Dict[str, Any]:
     if k in x: res[k] = x.get(k)
   return res
 
+def _to_columns(rows: List[Dict[str, Any]], keys:List[str])->Dict[str, List[Any]]:
+  # parallel arrays: {'price': [...], 'date_serial': [...], ...}
+  return {k: [r.get(k) for r in rows] for k in keys}
+
+def _to_arrow_response(columns: Dict[str, List[Any]], schema: pa.Schema)->Response:
+  table = pa.Table.from_pydict(columns, schema=schema)
+  sink = pa.BufferOutputStream()
+  with pa.ipc.new_stream(sink, schema) as writer:
+    writer.write_table(table)
+  return Response(content=sink.getvalue().to_pybytes(), media_type='application/vnd.apache.arrow.stream')
+
+# rows: list of objects, columnar: parallel arrays in json, arrow: the parallel arrays as an arrow ipc stream
+HistoryFormat = Literal['rows', 'columnar', 'arrow']
+
 @router.post("/sizes", response_model=BaseResponse[List[float]])
-async def query_sizes(query: AptIdRequest):
+@cached_response(BaseResponse[List[float]])
+@blocking()
+def query_sizes(query: AptIdRequest):
   apt_id: ApartmentId = {
     'address': query.address,
     'lawaddrcode': query.lawaddrcode,
@@ -67,10 +88,28 @@ class TradeEntry(BaseModel):
   date_serial: int
   floor: int
   is_canceled: bool
-  canceled_date: Optional[str]
-
-@router.post("/trades", response_model=BaseResponse[List[TradeEntry]])
-async def query_trades(query: HistoryRequest):
+  canceled_date: Optional[int]
+
+class TradeColumns(BaseModel):
+  price: List[float]
+  date_serial: List[int]
+  floor: List[int]
+  is_canceled: List[bool]
+  canceled_date: List[Optional[int]]
+
+TRADE_KEYS = ['price', 'date_serial', 'floor', 'is_canceled', 'canceled_date']
+TRADE_ARROW_SCHEMA = pa.schema([
+  ('price', pa.float64()),
+  ('date_serial', pa.int64()),
+  ('floor', pa.int64()),
+  ('is_canceled', pa.bool_()),
+  ('canceled_date', pa.int64()),
+])
+
+@router.post("/trades", response_model=BaseResponse[Union[List[TradeEntry], TradeColumns]])
+@cached_response(BaseResponse[Union[List[TradeEntry], TradeColumns]], validate=False)
+@blocking()
+def query_trades(query: HistoryRequest, format: HistoryFormat='rows'):
   apt_id: ApartmentId = {
     'address': query.address,
     'lawaddrcode': query.lawaddrcode,
@@ -84,8 +123,11 @@ async def query_trades(query: HistoryRequest):
     size_to = query.size,
   )
 
-  for e in trades: del e['_id']
-  trades = [_keep_keys_in_dict(r, ['price', 'date_serial', 'floor', 'is_canceled', 'canceled_date']) for r in trades]
+  if format == 'columnar':
+    return BaseResponse(success=True, result=_to_columns(trades, TRADE_KEYS))
+  if format == 'arrow':
+    return _to_arrow_response(_to_columns(trades, TRADE_KEYS), TRADE_ARROW_SCHEMA)
+  trades = [_keep_keys_in_dict(r, TRADE_KEYS) for r in trades]
   return BaseResponse(success=True, result=trades)
 
 
@@ -94,11 +136,31 @@ class RentEntry(BaseModel):
   price_monthly: float
   date_serial: int
   floor: int
-  deposit_interest_rate: float
-  deposit_interest_rate_ym: int
-
-@router.post("/rents", response_model=BaseResponse[List[RentEntry]])
-async def query_rents(query: HistoryRequest):
+  deposit_interest_rate: Optional[float]
+  deposit_interest_rate_ym: Optional[int]
+
+class RentColumns(BaseModel):
+  price_deposit: List[float]
+  price_monthly: List[float]
+  date_serial: List[int]
+  floor: List[int]
+  deposit_interest_rate: List[Optional[float]]
+  deposit_interest_rate_ym: List[Optional[int]]
+
+RENT_KEYS = ['price_deposit', 'price_monthly', 'date_serial', 'floor', 'deposit_interest_rate', 'deposit_interest_rate_ym']
+RENT_ARROW_SCHEMA = pa.schema([
+  ('price_deposit', pa.float64()),
+  ('price_monthly', pa.float64()),
+  ('date_serial', pa.int64()),
+  ('floor', pa.int64()),
+  ('deposit_interest_rate', pa.float64()),
+  ('deposit_interest_rate_ym', pa.int64()),
+])
+
+@router.post("/rents", response_model=BaseResponse[Union[List[RentEntry], RentColumns]])
+@cached_response(BaseResponse[Union[List[RentEntry], RentColumns]], validate=False)
+@blocking()
+def query_rents(query: HistoryRequest, format: HistoryFormat='rows'):
   apt_id: ApartmentId = {
     'address': query.address,
     'lawaddrcode': query.lawaddrcode,
@@ -113,23 +175,29 @@ async def query_rents(query: HistoryRequest):
     size_to = query.size
   )
 
-  dir_ents = korea_apartment_price.deposit_interest_rate.query(rc=apt_id, size=query.size, start_ym=int(query.date_from / 100), end_ym=int(query.date_to / 100))
-  dir_ents = list(dir_ents)
-  deidx = 0 
-
   rents = [_keep_keys_in_dict(r, ['price_deposit', 'price_monthly', 'date_serial', 'floor']) for r in rents]
-  for r in rents:
-    cur_ym = int(r['date_serial'] / 100)
-    while dir_ents[deidx]['date_serial'] < cur_ym and deidx < len(dir_ents) - 1:
-      deidx += 1
-    r['deposit_interest_rate'] = dir_ents[deidx]['value']
-    r['deposit_interest_rate_ym'] = dir_ents[deidx]['date_serial']
-
+  rates, rate_yms = korea_apartment_price.deposit_interest_rate.match(apt_id, query.size, np.array([r['date_serial'] for r in rents], dtype=np.int64))
+  if len(rates) > 0:
+    for r, rate, rate_ym in zip(rents, rates.tolist(), rate_yms.tolist()):
+      r['deposit_interest_rate'] = rate
+      r['deposit_interest_rate_ym'] = rate_ym
+  else:
+    # no conversion rate published for the region
+    for r in rents:
+      r['deposit_interest_rate'] = None
+      r['deposit_interest_rate_ym'] = None
+
+  if format == 'columnar':
+    return BaseResponse(success=True, result=_to_columns(rents, RENT_KEYS))
+  if format == 'arrow':
+    return _to_arrow_response(_to_columns(rents, RENT_KEYS), RENT_ARROW_SCHEMA)
   return BaseResponse(success=True, result=rents)
 
 
 @router.post("/info", response_model=BaseResponse[Dict])
-async def query_info(query: AptIdRequest):
+@cached_response(BaseResponse[Dict])
+@blocking()
+def query_info(query: AptIdRequest):
   apt_id: ApartmentId = {
     'address': query.address,
     'lawaddrcode': query.lawaddrcode,
@@ -139,7 +207,7 @@ async def query_info(query: AptIdRequest):
   info = korea_apartment_price.db.query_kb_apart (
     apt_id=apt_id,
   )
-  res = info['detail']
+  res = korea_apartment_price.db.query_kb_apart_detail(info['id']) or {}
   if 'regulList' in res:
     del res['regulList']
   return BaseResponse(success=True, result=res)
@@ -147,7 +215,9 @@ async def query_info(query: AptIdRequest):
 
 
 @router.post("/orderbook", response_model=BaseResponse[Any])
-async def query_orderbook(query: HistoryRequest, mode:Literal['simple', 'detail', 'agg']='agg'):
+@cached_response(BaseResponse[Any])
+@blocking()
+def query_orderbook(query: HistoryRequest, mode:Literal['simple', 'detail', 'agg']='agg'):
   apt_id: ApartmentId = {
     'address': query.address,
     'lawaddrcode': query.lawaddrcode,
@@ -186,8 +256,8 @@ async def query_orderbook(query: HistoryRequest, mode:Literal['simple', 'detail'
           apt_ho = matched.group(0) + '00호'
       if apt_ho is None: apt_ho = '호정보없음'
 
-      if o['detail']['최소매매가'] is not None:
-        price = int(o['detail']['최소매매가']) / 10000
+      if o.get('min_price', None) is not None:
+        price = int(o['min_price']) / 10000
       else:
         price = o['price'] / 10000
 
@@ -214,14 +284,16 @@ async def query_orderbook(query: HistoryRequest, mode:Literal['simple', 'detail'
         'fetched_date': fetched_date,
         'items': items
       })
-    print(res)
     return BaseResponse(success=True, result=res)
   elif mode == 'simple' or mode == 'detail':
+    details = {}
+    if mode == 'detail':
+      details = korea_apartment_price.db.query_kb_orderbook_details([o['_id'] for o in orderbook])
     for o in orderbook:
       if '_id' in o:
+        if mode == 'detail':
+          o['detail'] = details.get(o['_id'], None)
         del o['_id']
-        if mode == 'simple':
-          del o['detail']
   else:
     return []
   return BaseResponse(success=True, result=orderbook)
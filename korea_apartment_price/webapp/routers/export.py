@@ -0,0 +1,142 @@
+import csv
+import io
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Literal, Optional
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from pymongo.collection import Collection
+
+import korea_apartment_price
+from korea_apartment_price.db import RowRent, RowTrade
+from korea_apartment_price.webapp import WEBAPP_CFG
+from korea_apartment_price.webapp.deps import (
+  get_current_user
+)
+from korea_apartment_price.webapp.executor import run_blocking
+
+router = APIRouter(
+    prefix="/export",
+    tags=["Export"],
+    dependencies=[Depends(get_current_user)],
+    responses={404: {"description": "Not found"}},
+)
+
+# rows fetched from mongodb per round trip, and per chunk written to the client
+EXPORT_BATCH_SIZE = WEBAPP_CFG.get('EXPORT_BATCH_SIZE', 2000)
+
+ExportFormat = Literal['ndjson', 'csv']
+
+TRADE_FIELDS = [k for k in RowTrade.__annotations__ if k != '_id']
+RENT_FIELDS = [k for k in RowRent.__annotations__ if k != '_id']
+
+
+def _build_cond(region_key: str, region: str, date_from: Optional[int], date_to: Optional[int], size_from: Optional[int], size_to: Optional[int])->Dict[str, Any]:
+  if len(region) < 5 or not region[:5].isdigit():
+    raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='region should be a 5 digit region code (법정동코드 앞 5자리)')
+  cond: Dict[str, Any] = {region_key: int(region[:5])}
+
+  date_cond = {}
+  if date_from is not None: date_cond['$gte'] = date_from
+  if date_to is not None: date_cond['$lte'] = date_to
+  if len(date_cond) > 0: cond['date_serial'] = date_cond
+
+  # sizes in 평, matched the same way as db.query_trades / db.query_rents
+  size_cond = {}
+  if size_from is not None: size_cond['$gte'] = size_from * 3.3 - 1.6
+  if size_to is not None: size_cond['$lte'] = size_to * 3.3 + 1.6
+  if len(size_cond) > 0: cond['size'] = size_cond
+  return cond
+
+
+def _iter_batches(col: Collection, cond: Dict[str, Any])->Iterator[List[Dict[str, Any]]]:
+  cursor = col.find(cond, {'_id': 0}).sort('date_serial', 1).batch_size(EXPORT_BATCH_SIZE)
+  try:
+    batch = []
+    for row in cursor:
+      batch.append(row)
+      if len(batch) >= EXPORT_BATCH_SIZE:
+        yield batch
+        batch = []
+    if len(batch) > 0:
+      yield batch
+  finally:
+    cursor.close()
+
+
+def _ndjson_chunks(col: Collection, cond: Dict[str, Any])->Iterator[bytes]:
+  for batch in _iter_batches(col, cond):
+    yield b''.join(orjson.dumps(row) + b'\n' for row in batch)
+
+
+def _csv_chunks(col: Collection, cond: Dict[str, Any], fields: List[str])->Iterator[bytes]:
+  buf = io.StringIO()
+  writer = csv.DictWriter(buf, fieldnames=fields, extrasaction='ignore')
+  writer.writeheader()
+  # BOM so that excel opens the korean names correctly
+  yield ('﻿' + buf.getvalue()).encode('utf-8')
+  for batch in _iter_batches(col, cond):
+    buf.seek(0)
+    buf.truncate()
+    writer.writerows(batch)
+    yield buf.getvalue().encode('utf-8')
+
+
+async def _iter_in_pool(chunks: Iterator[bytes])->AsyncIterator[bytes]:
+  # every chunk is pulled in the db pool like the other routes' blocking calls, so the cursor
+  # does not hold up the event loop. memory use stays at one batch regardless of the export size.
+  # a cancelled await leaves its next() running in the pool, and close() has to wait for it
+  lock = threading.Lock()
+  def pull()->Optional[bytes]:
+    with lock:
+      return next(chunks, None)
+  def close():
+    with lock:
+      chunks.close()
+
+  try:
+    while True:
+      chunk = await run_blocking(pull)
+      if chunk is None: break
+      yield chunk
+  finally:
+    # closes the cursor, also when the client went away in the middle
+    await run_blocking(close)
+
+
+def _streaming_response(name: str, col: Collection, cond: Dict[str, Any], fields: List[str], format: ExportFormat)->StreamingResponse:
+  if format == 'csv':
+    content, media_type = _csv_chunks(col, cond, fields), 'text/csv; charset=utf-8'
+  else:
+    content, media_type = _ndjson_chunks(col, cond), 'application/x-ndjson'
+  headers = {'Content-Disposition': f'attachment; filename="{name}.{format}"'}
+  return StreamingResponse(_iter_in_pool(content), media_type=media_type, headers=headers)
+
+
+@router.get('/trades')
+async def export_trades(
+    region: str,
+    date_from: Optional[int]=None,
+    date_to: Optional[int]=None,
+    size_from: Optional[int]=None,
+    size_to: Optional[int]=None,
+    format: ExportFormat='ndjson',
+):
+  cond = _build_cond('lawaddrcode_city', region, date_from, date_to, size_from, size_to)
+  col = korea_apartment_price.db.get_trades_collection()
+  return _streaming_response(f'trades-{region[:5]}', col, cond, TRADE_FIELDS, format)
+
+
+@router.get('/rents')
+async def export_rents(
+    region: str,
+    date_from: Optional[int]=None,
+    date_to: Optional[int]=None,
+    size_from: Optional[int]=None,
+    size_to: Optional[int]=None,
+    format: ExportFormat='ndjson',
+):
+  cond = _build_cond('location_code', region, date_from, date_to, size_from, size_to)
+  col = korea_apartment_price.db.get_rents_collection()
+  return _streaming_response(f'rents-{region[:5]}', col, cond, RENT_FIELDS, format)
@@ -8,6 +8,7 @@ import korea_apartment_price
 from korea_apartment_price.db import ApartmentId
 from korea_apartment_price.webapp import models
 from korea_apartment_price.webapp.deps import  get_current_real_user
+from korea_apartment_price.webapp.executor import blocking
 from korea_apartment_price.webapp.types import BaseResponse
 
 router = APIRouter(
@@ -24,10 +25,10 @@ class SimpleFavEntry(BaseModel):
   size: int
 
 @router.get('/', response_model=BaseResponse[dict[str, Any]])
-def fav_list(u: models.User = Depends(get_current_real_user)):
+@blocking()
+@models.with_db_connection
+def fav_list(u: models.AuthClaims = Depends(get_current_real_user)):
   fav = models.Favorite.list(u)
-  print(fav)
-  print(fav.__class__)
   return BaseResponse(success=True, result=fav)
 
 class FavoriteAddReq(BaseModel):
@@ -37,7 +38,9 @@ class FavoriteAddReq(BaseModel):
   size: int
 
 @router.post('/', response_model=BaseResponse)
-def fav_add(f: FavoriteAddReq, u: models.User = Depends(get_current_real_user)):
+@blocking()
+@models.with_db_connection
+def fav_add(f: FavoriteAddReq, u: models.AuthClaims = Depends(get_current_real_user)):
   is_valid = False
   try:
     apt_id: ApartmentId = {
@@ -55,7 +58,7 @@ def fav_add(f: FavoriteAddReq, u: models.User = Depends(get_current_real_user)):
   if not is_valid:
     raise HTTPException(status.HTTP_400_BAD_REQUEST, detail='invalid inputs')
 
-  fav = models.Favorite(user=u, lawaddrcode=f.lawaddrcode, address=f.address, name=f.name, size=f.size)
+  fav = models.Favorite(user=u.id, lawaddrcode=f.lawaddrcode, address=f.address, name=f.name, size=f.size)
   try:
     fav.save()
     return BaseResponse(success=True)
@@ -71,22 +74,26 @@ class FavoriteDetail(BaseModel):
   size: int
 
 @router.get('/{fid}', response_model=BaseResponse[FavoriteDetail])
-def get_detail_of_favorite(fid:int, u: models.User = Depends(get_current_real_user)):
+@blocking()
+@models.with_db_connection
+def get_detail_of_favorite(fid:int, u: models.AuthClaims = Depends(get_current_real_user)):
   try:
     fav = models.Favorite.get(id=fid)
   except models.Favorite.DoesNotExist:
     raise HTTPException(status.HTTP_404_NOT_FOUND)
-  if fav.user.id != u.id:
+  if fav.user_id != u.id:
     raise HTTPException(status.HTTP_404_NOT_FOUND)
 
   return BaseResponse(success=True, result=fav.__data__)
 
 
 @router.delete('/{fid}')
-def delete_favorite(fid:int, u: models.User = Depends(get_current_real_user)):
+@blocking()
+@models.with_db_connection
+def delete_favorite(fid:int, u: models.AuthClaims = Depends(get_current_real_user)):
   try:
     fav = models.Favorite.get(id=fid)
-    if fav.user.id != u.id:
+    if fav.user_id != u.id:
       raise HTTPException(status.HTTP_404_NOT_FOUND)
     models.Favorite.delete_by_id(fid)
   except models.Favorite.DoesNotExist:
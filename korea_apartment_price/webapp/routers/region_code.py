@@ -8,6 +8,7 @@ import korea_apartment_price
 from korea_apartment_price.region_code import search, decode
 from korea_apartment_price.webapp import models
 from korea_apartment_price.webapp.deps import  get_current_real_user
+from korea_apartment_price.webapp.executor import blocking
 from korea_apartment_price.webapp.types import BaseResponse
 
 router = APIRouter(
@@ -22,7 +23,8 @@ class RegionCodeEntry(BaseModel):
     address: str
    
 @router.get('/', response_model=BaseResponse[List[RegionCodeEntry]])
-async def region_code_search(address: Optional[str]=None, code: Optional[str]=None):
+@blocking('search')
+def region_code_search(address: Optional[str]=None, code: Optional[str]=None):
     if address is not None:
         res = search(address)
         return BaseResponse(success=True, result=[RegionCodeEntry(**e) for e in res])
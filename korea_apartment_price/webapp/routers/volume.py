@@ -1,11 +1,10 @@
-import datetime
-from dateutil.relativedelta import relativedelta
-
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from typing_extensions import TypedDict
 from fastapi import APIRouter, Depends, HTTPException, Query
 import korea_apartment_price
 import korea_apartment_price.deposit_interest_rate
+from korea_apartment_price import trade_volume
+from korea_apartment_price.webapp.executor import blocking
 from korea_apartment_price.webapp.types import BaseResponse
 from korea_apartment_price.webapp.deps import (
   get_current_user
@@ -29,7 +28,8 @@ class VolumeQueryReq(TypedDict):
     addrcodes: List[str]
 
 @router.post('/', response_model=BaseResponse[VolumeQueryResp])
-async def get_data(
+@blocking()
+def get_data(
     req: VolumeQueryReq,
     date_from: Optional[int]=None,
     date_to: Optional[int]=None,
@@ -43,30 +43,80 @@ async def get_data(
         raise HTTPException(status_code=400)
 
     addrcodes = list(set([int(c[:5]) for c in addrcodes if len(c[:5]) == 5]))
-    col = korea_apartment_price.db.get_trades_collection()
 
-    query = dict()
-    query['addrcode_city'] = {'$in': addrcodes}
-    if date_from or date_to:
+    cells = trade_volume.query_volume_cube(addrcodes, date_from, date_to, size_from, size_to, price_from, price_to)
+    if cells is None:
+        cells = _query_trades_by_week(addrcodes, date_from, date_to, size_from, size_to, price_from, price_to)
+
+    x_str = []
+    y_cnt = []
+    y_total_price = []
+    y_avg_price = []
+    for week, cnt, money in cells:
+        x_str.append(f'{week // 10000:04d}-{week // 100 % 100:02d}-{week % 100:02d}')
+        y_cnt.append(cnt)
+        y_total_price.append(money / 10000)
+        y_avg_price.append(money / cnt / 10000)
+
+    return BaseResponse(success=True, result={
+        'dates': x_str,
+        'count': y_cnt,
+        'total_price': y_total_price,
+        'avg_price': y_avg_price,
+    })
+
+
+def _build_trades_filter(
+    addrcodes: List[int],
+    date_from: Optional[int],
+    date_to: Optional[int],
+    size_from: Optional[float],
+    size_to: Optional[float],
+    price_from: Optional[float],
+    price_to: Optional[float],
+)->Dict[str, Any]:
+    # sizes come in 평 and are matched the way db.pick_size buckets them (int(size / 3.3)),
+    # so the same request gives the same counts here and from the volume cube
+    query: Dict[str, Any] = {'addrcode_city': {'$in': addrcodes}}
+    if date_from is not None or date_to is not None:
         query['date_serial'] = {}
-        if date_from:
+        if date_from is not None:
             query['date_serial']['$gte'] = date_from
-        if date_to:
+        if date_to is not None:
             query['date_serial']['$lte'] = date_to
 
-    if size_from or size_to:
+    if size_from is not None or size_to is not None:
         query['size'] = {}
-        if date_from:
-            query['size']['$gte'] = size_from
-        if date_to:
-            query['size']['$lte'] = size_to
+        if size_from is not None:
+            query['size']['$gte'] = size_from * trade_volume.SIZE_BUCKET
+        if size_to is not None:
+            query['size']['$lt'] = (int(size_to) + 1) * trade_volume.SIZE_BUCKET
 
-    if price_from or price_to:
+    if price_from is not None or price_to is not None:
         query['price'] = {}
-        if date_from:
+        if price_from is not None:
             query['price']['$gte'] = price_from
-        if date_to:
+        if price_to is not None:
             query['price']['$lte'] = price_to
+    return query
+
+
+def _query_trades_by_week(
+    addrcodes: List[int],
+    date_from: Optional[int],
+    date_to: Optional[int],
+    size_from: Optional[float],
+    size_to: Optional[float],
+    price_from: Optional[float],
+    price_to: Optional[float],
+)->List[Tuple[int, int, int]]:
+    # filters the volume cube cannot answer exactly are run against the trades.
+    # the match is covered by the (addrcode_city, date_serial, size, price) index
+    # and the weeks are bucketed by mongodb ($dateTrunc needs mongodb 5.0+)
+    col = korea_apartment_price.db.get_trades_collection()
+    query = _build_trades_filter(addrcodes, date_from, date_to, size_from, size_to, price_from, price_to)
+    # rows without a full date (a missing day is stored as 0) have no week, same as in the volume cube
+    query.update({'year': {'$ne': None}, 'month': {'$ne': None}, 'date': {'$gte': 1}})
 
     cursor = col.aggregate([
         {
@@ -74,39 +124,19 @@ async def get_data(
         },
         {
             '$group': {
-                '_id': '$date_serial',
+                '_id': {
+                    '$dateTrunc': {
+                        'date': {'$dateFromParts': {'year': '$year', 'month': '$month', 'day': '$date'}},
+                        'unit': 'week',
+                        'startOfWeek': 'monday',
+                    }
+                },
                 'cnt': { '$sum': 1 },
                 'money': { '$sum': '$price' },
             }
-        }
+        },
+        {
+            '$sort': {'_id': 1}
+        },
     ])
-
-    hist_cnt: Dict[datetime.datetime, int] = {}
-    hist_total_price: Dict[datetime.datetime, float] = {}
-    hist_avg_price: Dict[datetime.datetime, float] = {}
-
-    for e in cursor:
-        year = int(e['_id'] / 10000)
-        month = int(e['_id'] / 100) % 100
-        date_val = int(e['_id']) % 100
-        date = datetime.date(year, month, date_val)
-        year, weekid, weekday = date.isocalendar()
-        first_date = datetime.date(year, 1, 1) + relativedelta(weeks=+weekid)
-        hist_cnt[first_date] = hist_cnt.get(first_date, 0) + e['cnt']
-        hist_total_price[first_date] = hist_total_price.get(first_date, 0.0) + e['money']
-
-    for d in hist_cnt:
-        hist_avg_price[d] = hist_total_price[d] / hist_cnt[d]
-
-    x = sorted(hist_cnt.keys())
-    x_str = [d.strftime('%Y-%m-%d') for d in sorted(hist_cnt.keys())]
-    y_cnt = [hist_cnt[v] for v in x]
-    y_total_price = [hist_total_price[v] / 10000 for v in x]
-    y_avg_price = [hist_avg_price[v] / 10000 for v in x]
-
-    return BaseResponse(success=True, result={
-        'dates': x_str,
-        'count': y_cnt,
-        'total_price': y_total_price,
-        'avg_price': y_avg_price,
-    })
+    return [(e['_id'].year * 10000 + e['_id'].month * 100 + e['_id'].day, e['cnt'], e['money']) for e in cursor]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import threading
+import time
+from typing import Callable, List
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from korea_apartment_price.webapp import deps, models
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--threads', default='1,8,32', help='comma separated numbers of concurrent request threads')
+  parser.add_argument('--requests', type=int, default=20000, help='authenticated requests per measurement')
+  parser.add_argument('--users', type=int, default=100, help='distinct tokens the requests are spread over')
+  return parser.parse_args()
+
+
+def run(verify: Callable[[str], object], tokens: List[str], num_requests: int, num_threads: int)->float:
+  # returns the number of verified requests per second
+  per_thread = num_requests // num_threads
+  def worker(offset: int):
+    for i in range(per_thread):
+      verify(tokens[(offset + i) % len(tokens)])
+  threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+  started_at = time.perf_counter()
+  for t in threads: t.start()
+  for t in threads: t.join()
+  return per_thread * num_threads / (time.perf_counter() - started_at)
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  tokens = [
+    models.AuthClaims(i, f'user{i}@example.com', False, True).to_jwt()
+    for i in range(args.users)
+  ]
+  tokens = [t.decode('utf-8') if isinstance(t, bytes) else t for t in tokens]
+  cases = [
+    # the path every request took before the token cache: decode and build a peewee User
+    ('User.from_jwt', models.User.from_jwt),
+    ('AuthClaims.from_jwt', models.AuthClaims.from_jwt),
+    ('verify_token (cached)', deps.verify_token),
+  ]
+  for num_threads in [int(e) for e in args.threads.split(',')]:
+    deps._token_cache.clear()
+    for name, verify in cases:
+      req_per_sec = run(verify, tokens, args.requests, num_threads)
+      print(f'threads={num_threads:3d} {name:22s} {req_per_sec:10.0f} req/sec {1e6 / req_per_sec * num_threads:8.1f} us/request')
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'scripts'))
+
+from korea_apartment_price.kb_liiv import KBLiivCrawler
+from korea_apartment_price.path import DATA_ROOT
+from korea_apartment_price.utils.http_cache import CachedSession
+from korea_apartment_price.utils.replay import ReplayServer
+from korea_apartment_price.utils.throttle import Throttler
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-f,--fixtures', dest='fixtures', default=os.path.join(DATA_ROOT, 'fixtures'), help='fixture directory (see record_fixtures.py)')
+  parser.add_argument('--trades', action='append', default=[], help='YYYYMM-REGION of recorded trades (repeatable)')
+  parser.add_argument('--rents', action='append', default=[], help='YYYYMM-REGION of recorded rents (repeatable)')
+  parser.add_argument('--kb_apt_id', type=int, action='append', default=[], help='KB apartment id of a recorded orderbook (repeatable)')
+  parser.add_argument('--workers', default='1,4,16', help='comma separated worker counts to compare. 1 is the serial script')
+  parser.add_argument('--repeat', type=int, default=5, help='how many times every job is run per measurement')
+  parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+  parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added on top of latency')
+  parser.add_argument('--error_rate', type=float, default=0.0, help='fraction of requests answered with 503')
+  return parser.parse_args()
+
+
+def parse_ymregion(s: str):
+  ym, region = s.split('-')
+  return int(ym), int(region)
+
+
+def no_cache_session()->CachedSession:
+  # no policy matches, so every request reaches the replay server
+  return CachedSession(cache_root=tempfile.mkdtemp(), policies=[], max_bytes=None)
+
+
+def no_throttle()->Throttler:
+  return Throttler(1e9, burst=1e9)
+
+
+def bench(name: str, server: ReplayServer, jobs: List[Callable[[], int]], num_workers: int):
+  served_before = server.stats['served'] + server.stats['errors']
+  started_at = time.monotonic()
+  with ThreadPoolExecutor(max_workers=num_workers) as executor:
+    num_rows = sum(n for n in executor.map(lambda job: job(), jobs) if n is not None)
+  elapsed = time.monotonic() - started_at
+  num_pages = server.stats['served'] + server.stats['errors'] - served_before
+  print(f'{name:8s} workers={num_workers:3d} pages={num_pages:6d} rows={num_rows:8d} '
+        f'time={elapsed:7.2f}s pages/sec={num_pages / elapsed:8.1f} rows/sec={num_rows / elapsed:10.1f}')
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  server = ReplayServer(args.fixtures, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+  base_url = server.start()
+  print(f'[*] replaying {len(server.fixtures)} fixtures at {base_url} (latency={args.latency}s, error_rate={args.error_rate})')
+
+  suites = []
+  if len(args.trades) > 0:
+    from download_trades import TradeDownloader
+    dn = TradeDownloader(session=no_cache_session(), throttler=no_throttle(), base_url=base_url)
+    suites.append(('trades', [lambda ent=ent: len(dn.get(*parse_ymregion(ent)) or []) for ent in args.trades]))
+  if len(args.rents) > 0:
+    from download_rents import RentDownloader
+    dn_rents = RentDownloader(session=no_cache_session(), throttler=no_throttle(), base_url=base_url)
+    suites.append(('rents', [lambda ent=ent: len(dn_rents.get(*parse_ymregion(ent)) or []) for ent in args.rents]))
+  if len(args.kb_apt_id) > 0:
+    crawler = KBLiivCrawler(session=no_cache_session(), base_url=base_url)
+    suites.append(('kb', [lambda apt_id=apt_id: len(crawler.orderbook(apt_id)) for apt_id in args.kb_apt_id]))
+
+  for name, jobs in suites:
+    for num_workers in [int(e) for e in args.workers.split(',')]:
+      bench(name, server, jobs * args.repeat, num_workers)
+
+  server.stop()
+  print(f'[+] {server.stats}')
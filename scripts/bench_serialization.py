@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List, Union
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from korea_apartment_price.webapp.cache import _dump_trusted
+from korea_apartment_price.webapp.routers.apartment import (
+  TRADE_ARROW_SCHEMA, TRADE_KEYS, TradeColumns, TradeEntry, _to_arrow_response, _to_columns
+)
+from korea_apartment_price.webapp.types import BaseResponse
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--rows', default='100,1000,10000', help='comma separated history lengths to measure')
+  parser.add_argument('--repeat', type=int, default=20, help='serializations per measurement')
+  return parser.parse_args()
+
+
+def make_trades(num_rows: int)->List[Dict[str, Any]]:
+  rows = []
+  for i in range(num_rows):
+    is_canceled = random.random() < 0.05
+    rows.append({
+      'price': float(random.randint(30000, 300000)),
+      'date_serial': 20060101 + i % 1000,
+      'floor': random.randint(1, 40),
+      'is_canceled': is_canceled,
+      'canceled_date': 20230101 if is_canceled else None,
+    })
+  return rows
+
+
+def measure(func: Callable[[], bytes], repeat: int):
+  size = len(func())
+  started_at = time.perf_counter()
+  for _ in range(repeat):
+    func()
+  return 1000.0 * (time.perf_counter() - started_at) / repeat, size
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  # the same adapter cached_response uses with validate=True, i.e. a pydantic pass per row
+  adapter = TypeAdapter(BaseResponse[Union[List[TradeEntry], TradeColumns]])
+
+  for num_rows in [int(e) for e in args.rows.split(',')]:
+    rows = make_trades(num_rows)
+    cases = [
+      ('pydantic rows', lambda: adapter.dump_json(adapter.validate_python(jsonable_encoder(BaseResponse(success=True, result=rows))))),
+      ('orjson rows', lambda: _dump_trusted(BaseResponse(success=True, result=rows))),
+      ('orjson columnar', lambda: _dump_trusted(BaseResponse(success=True, result=_to_columns(rows, TRADE_KEYS)))),
+      ('arrow', lambda: _to_arrow_response(_to_columns(rows, TRADE_KEYS), TRADE_ARROW_SCHEMA).body),
+    ]
+    baseline = None
+    for name, func in cases:
+      elapsed_ms, size = measure(func, args.repeat)
+      baseline = baseline if baseline is not None else elapsed_ms
+      print(f'rows={num_rows:6d} {name:16s} {elapsed_ms:9.3f} ms {size:9d} bytes  x{baseline / elapsed_ms:6.1f}')
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from korea_apartment_price import db, trade_volume
+from korea_apartment_price.webapp.routers.volume import _query_trades_by_week
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--date_from', type=int, default=None, help='yyyymmdd (a monday keeps the cube on volume_weekly)')
+  parser.add_argument('--date_to', type=int, default=None, help='yyyymmdd (a sunday keeps the cube on volume_weekly)')
+  parser.add_argument('--size_from', type=int, default=None, help='평')
+  parser.add_argument('--size_to', type=int, default=None, help='평')
+  parser.add_argument('--repeat', type=int, default=3, help='queries per measurement')
+  return parser.parse_args()
+
+
+def measure(func: Callable[[], Optional[List[Tuple[int, int, int]]]], repeat: int):
+  res = func()
+  started_at = time.perf_counter()
+  for _ in range(repeat):
+    func()
+  return 1000.0 * (time.perf_counter() - started_at) / repeat, res
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  # the whole country: every 시군구 that has a trade
+  addrcodes = [c for c in db.get_trades_collection().distinct('addrcode_city') if c is not None]
+  filters = (args.date_from, args.date_to, args.size_from, args.size_to, None, None)
+  print(f'[*] /volume over {len(addrcodes)} regions (date {args.date_from}~{args.date_to}, size {args.size_from}~{args.size_to})')
+
+  cube_ms, cube_res = measure(lambda: trade_volume.query_volume_cube(addrcodes, *filters), args.repeat)
+  if cube_res is None:
+    print('[!] the volume cube cannot answer this query (not built, or a filter falls inside a bucket).'
+          ' run ./scripts/download_trades.py --rebuild-volume-cube first')
+  agg_ms, agg_res = measure(lambda: _query_trades_by_week(addrcodes, *filters), args.repeat)
+
+  print(f'aggregation  {agg_ms:10.1f} ms  {len(agg_res):5d} weeks')
+  if cube_res is not None:
+    print(f'volume cube  {cube_ms:10.1f} ms  {len(cube_res):5d} weeks  x{agg_ms / cube_ms:6.1f}')
+    if cube_res != agg_res:
+      num_diff = len(set(cube_res).symmetric_difference(agg_res))
+      print(f'[!] the two paths disagree on {num_diff} weeks')
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from korea_apartment_price import archive
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--kind', choices=['trades', 'rents'], action='append', help='data to convert (default: both)')
+  parser.add_argument('--remove', action='store_true', help='remove json files after conversion')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  kinds = args.kind if args.kind is not None else ['trades', 'rents']
+  for kind in kinds:
+    print(f'[*] converting {kind} json files to parquet archive')
+    cnt = archive.convert_json_files(kind, remove=args.remove)
+    print(f'[+] {cnt} months converted')
@@ -9,18 +9,19 @@ ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(ROOT)
 
 from typing import List, Tuple
-import requests
 import korea_apartment_price
 import korea_apartment_price.db
 from korea_apartment_price.config import get_cfg
 from korea_apartment_price.utils import safe_int, safe_float
 from korea_apartment_price.db import RowDepositInterestRate
+from korea_apartment_price.utils.http_cache import CachedSession
 
 
 
 class DepositInterestRateDownloader:
   def __init__(self):
     self._api_key = get_cfg()['KOSIS_API_KEY']
+    self._session = CachedSession()
   
   def get(self, startym:int, endym:int)->List[any]:
     url = 'https://kosis.kr/openapi/Param/statisticsParameterData.do'
@@ -40,7 +41,7 @@ class DepositInterestRateDownloader:
       'tblId':	'DT_30404_N0009',
     }
 
-    resp = requests.get(url, params=params)
+    resp = self._session.get(url, params=params)
 
     """
     Example data
@@ -159,5 +160,6 @@ if __name__ == '__main__':
   entries_to_insert = dn.get(start_ym, end_ym)
   if len(entries_to_insert) > 0:
     col.insert_many(entries_to_insert)
+    korea_apartment_price.db.bump_data_version('deposit_interest_rate')
 
   print(f'[*] Done ({len(entries_to_insert)} entries added)')
@@ -7,11 +7,13 @@ ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(ROOT)
 
 
-import io
+import argparse
 import requests
 import datetime
-from typing import Any, Dict, List, Tuple, TypedDict
+import tempfile
+from typing import Any, Dict, Iterator, List, TextIO, Tuple, TypedDict
 from bs4 import BeautifulSoup
+import numpy as np
 import py7zr
 import pyproj
 
@@ -19,6 +21,7 @@ import korea_apartment_price
 from korea_apartment_price import db
 from korea_apartment_price.db import RowGeocode
 from korea_apartment_price.utils import safe_int, safe_float
+from korea_apartment_price.utils.http_cache import CachedSession
 
 
 class URLParams(TypedDict):
@@ -28,7 +31,7 @@ class URLParams(TypedDict):
 
 class GPSDBDownloader:
     def __init__(self):
-        pass
+        self.session = CachedSession()
 
     def get_db_urlparams(self, year: int)->List[Tuple[int, URLParams]]:
         params = {
@@ -38,7 +41,7 @@ class GPSDBDownloader:
 
         url = 'https://www.juso.go.kr/support/monthChangeFileDown.do'
 
-        resp = requests.get(url, params=params)
+        resp = self.session.get(url, params=params)
         html_doc = resp.content.decode('utf-8')
         soup = BeautifulSoup(html_doc, 'xml')
 
@@ -138,16 +141,15 @@ _proj_utmk = pyproj.Proj('+proj=tmerc +lat_0=38 +lon_0=127.5 +k=0.9996 +x_0=1000
 _proj_wgs84 = pyproj.Proj('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
 _transformer = pyproj.Transformer.from_proj(_proj_utmk, _proj_wgs84)
 
-def parse_building_file(f: io.BytesIO, exclude_no_coord: bool=True) -> List[BuildingCoord]:
-  wrapped_io = io.TextIOWrapper(f, encoding='uhc', errors='replace')
+def iter_building_chunks(f: TextIO, chunk_size: int=50000, exclude_no_coord: bool=True) -> Iterator[List[BuildingCoord]]:
+  fields = list(BuildingCoord.__annotations__.items())
   res = []
-  while True:
-    line = wrapped_io.readline()
-    if line == '': break
+  for line in f:
     line = line.strip()
+    if line == '': continue
     row: BuildingCoord = {}
     data = line.split('|')
-    for entry, (field_name, field_type) in zip(data, BuildingCoord.__annotations__.items()):
+    for entry, (field_name, field_type) in zip(data, fields):
       if field_type == float:
         row[field_name] = safe_float(entry.strip())
       elif field_type == int:
@@ -164,38 +166,50 @@ def parse_building_file(f: io.BytesIO, exclude_no_coord: bool=True) -> List[Buil
       include = True
     if include: res.append(row)
 
-  return res
+    if len(res) >= chunk_size:
+      yield res
+      res = []
+
+  if len(res) > 0:
+    yield res
 
-def building_coord_to_db_entry(b: BuildingCoord)->RowGeocode:
+def building_coords_to_db_entries(rows: List[BuildingCoord])->List[RowGeocode]:
   global _transformer
-  res: RowGeocode = {}
-  addrcode = b['addrcode'].strip()
-  res['addrcode_city'] = int(addrcode[:5])
-  res['addrcode'] = int(addrcode[5:])
-  res['addrcode_bld'] = int(b['addrcode_bld'])
-  res['addrcode_bld_sub'] = int(b['addrcode_bld_sub'])
-  res['name'] = b['name']
-
-  lng, lat = None, None
-  coord_exists = False
-  if b['center_x'] is not None and b['center_y'] is not None: 
-    coord_exists = True
-    x_coord, y_coord = float(b['center_x']), float(b['center_y'])
-  elif b['ent_x'] is not None and b['ent_y'] is not None:
-    coord_exists = True
-    x_coord, y_coord = float(b['ent_x']), float(b['ent_y'])
-  else: 
-    coord_exists = False
-
-  if coord_exists:
-    lng, lat = _transformer.transform(x_coord, y_coord)
-
-  res['lat'] = lat
-  res['lng'] = lng
+  xs = np.full(len(rows), np.nan)
+  ys = np.full(len(rows), np.nan)
+  for idx, b in enumerate(rows):
+    if b['center_x'] is not None and b['center_y'] is not None:
+      xs[idx], ys[idx] = b['center_x'], b['center_y']
+    elif b['ent_x'] is not None and b['ent_y'] is not None:
+      xs[idx], ys[idx] = b['ent_x'], b['ent_y']
+
+  # one vectorized call per chunk instead of one transform per building
+  lngs, lats = _transformer.transform(xs, ys)
+
+  res: List[RowGeocode] = []
+  for idx, b in enumerate(rows):
+    addrcode = b['addrcode'].strip()
+    coord_exists = not np.isnan(xs[idx])
+    res.append({
+      'addrcode_city': int(addrcode[:5]),
+      'addrcode': int(addrcode[5:]),
+      'addrcode_bld': int(b['addrcode_bld']),
+      'addrcode_bld_sub': int(b['addrcode_bld_sub']),
+      'name': b['name'],
+      'lat': float(lats[idx]) if coord_exists else None,
+      'lng': float(lngs[idx]) if coord_exists else None,
+    })
   return res
 
 
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--batch_size', type=int, default=50000, help='number of buildings parsed/converted/inserted at once')
+  return parser.parse_args()
+
+
 if __name__ == '__main__':
+  args = parse_args()
   dn = GPSDBDownloader()
   up = dn.get_latest_db_urlparams()
   print ('[*] Downloading latest address/coordinate data..') 
@@ -209,11 +223,21 @@ if __name__ == '__main__':
   col = db.get_geocodes_collection()
   db.create_indices()
 
-  for fname, f in zipf.read(targets=db_files).items():
-    print (f'[*] Reading {fname}..')
-    rows = parse_building_file(f)
-    print (f'[*] Converting {fname} to DB format..')
-    rows = [building_coord_to_db_entry(r) for r in rows]
-    print (f'[*] Writing {fname} to DB..')
-    col.insert_many(rows)
-
+  # decompress every member onto disk in a single pass over the (solid) archive, then
+  # stream the files line by line, so that memory usage is bounded by --batch_size
+  # rather than by the archive size
+  with tempfile.TemporaryDirectory(dir=korea_apartment_price.path.GPS_DATA_ROOT) as tmpdir:
+    print (f'[*] Extracting {len(db_files)} files..')
+    zipf.extract(path=tmpdir, targets=db_files)
+
+    for fname in db_files:
+      print (f'[*] Writing {fname} to DB..')
+      cnt = 0
+      fpath_txt = os.path.join(tmpdir, fname)
+      with open(fpath_txt, 'r', encoding='uhc', errors='replace') as f:
+        for rows in iter_building_chunks(f, chunk_size=args.batch_size):
+          col.insert_many(building_coords_to_db_entries(rows), ordered=False)
+          cnt += len(rows)
+      os.remove(fpath_txt)
+      print (f'[+] {fname}: {cnt}')
+  zipf.close()
@@ -1,37 +1,36 @@
 #!/usr/bin/env python3
 import os
 import sys
-from typing import List
+from typing import Any, Dict, List, Tuple
 
 ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(ROOT)
 
 import argparse
+import itertools
+import threading
 import time
 import math
-import pickle
-import requests
 from tqdm import tqdm
 from korea_apartment_price.db import RowKBApart, RowKBApartType
 from korea_apartment_price.kb_liiv import KBDo, KBLiivCrawlerWithProxy
 from korea_apartment_price.utils.converter import keyfilt, safe_float, safe_int
-from korea_apartment_price.path import *
 from korea_apartment_price import db
+from korea_apartment_price.job_state import JobStateStore
 
 def parse_args():
   parser = argparse.ArgumentParser()
   parser.add_argument('--skip_downloaded', action='store_false', help='skip already downloaded apartments')
   parser.add_argument('--truncate_db', action='store_true', help='drop collection before downloading')
-  parser.add_argument('--disable_cache', action='store_true', help='do not load previously downloaded gu list')
+  parser.add_argument('--disable_cache', action='store_true', help='forget the previously listed gu/apartments and start over')
+  parser.add_argument('--max_attempts', type=int, default=5, help='max attempts per apartment')
+  parser.add_argument('--workers', type=int, default=4, help='number of apartments fetched concurrently')
+  parser.add_argument('--batch_size', type=int, default=200, help='apartments written per bulk write')
   parser.add_argument('-p,--proxy', dest='proxy_list', help='proxy list file', default=os.path.join(ROOT, 'scripts/proxy_lst.txt'), required=False)
   return parser.parse_args()
 
 args = parse_args()
-gu_lst = None
-apt_lst = None
-is_updated = True
 proxy_list = []
-cur_proxy_idx = 0
 
 print ('[*] reading proxy list')
 with open(args.proxy_list, 'r') as f:
@@ -43,84 +42,91 @@ with open(args.proxy_list, 'r') as f:
 
 crawler = KBLiivCrawlerWithProxy(proxy_list=proxy_list)
 
-path_cache = os.path.join(CACHE_ROOT, 'kb_apt_summary.pkl')
-if os.path.exists(path_cache) and not args.disable_cache:
-  is_updated = False
-  with open(path_cache, 'rb') as f:
-    gu_lst, apt_lst = pickle.load(f)
+db.create_indices()
+gu_store = JobStateStore('kb_aprtlst:gu')
+apt_store = JobStateStore('kb_aprtlst:apt', max_attempts=args.max_attempts)
+if args.disable_cache:
+  gu_store.clear()
+  apt_store.clear()
 
 print('[*] Preparing gu list')
-if gu_lst is None:
+if len(gu_store.counts()) == 0:
   gu_lst = []
   for do_ent in tqdm(KBDo):
     cities = crawler.list_city(do_ent)
     for city in cities:
       gus = crawler.list_gu(do_ent, city['시군구명'])
       gu_lst.extend(gus)
+  gu_store.add_tasks([(gu_ent['법정동코드'], gu_ent) for gu_ent in gu_lst])
 
 print('[*] Preparing apartment list')
-if apt_lst is None:
-  apt_lst = []
-  for gu_ent in tqdm(gu_lst):
-    """
-      {
-          '단지기본일련번호': 424658,
-          '물건식별자': 'KBM224203',
-          'wgs84포인트': 'AAAAAAEBAAAAd7LlphfCX0DKJNnZRs1CQA==',
-          '단지명': '한솔에코빌',
-          '법정동코드': '1129013600',
-          '매물종별구분명': '오피스텔',
-          '매물종별구분': '04',
-          '재건축여부': '0',
-          'wgs84경도': '127.03269360',
-          'wgs84위도': '37.6037247'
-      }
-    """
-    lawaddrcode = gu_ent['법정동코드']
-    apts = crawler.list_apts(lawaddrcode)
-    apt_lst.extend(apts)
-
-if is_updated:
-  print('[*] Saving apartment list')
-  with open(path_cache, 'wb') as f:
-    pickle.dump((gu_lst, apt_lst), f)
+while True:
+  task = gu_store.claim()
+  if task is None:
+    wait = gu_store.wait_time()
+    if wait is None: break
+    time.sleep(min(wait, 5.0))
+    continue
+  """
+    {
+        '단지기본일련번호': 424658,
+        '물건식별자': 'KBM224203',
+        'wgs84포인트': 'AAAAAAEBAAAAd7LlphfCX0DKJNnZRs1CQA==',
+        '단지명': '한솔에코빌',
+        '법정동코드': '1129013600',
+        '매물종별구분명': '오피스텔',
+        '매물종별구분': '04',
+        '재건축여부': '0',
+        'wgs84경도': '127.03269360',
+        'wgs84위도': '37.6037247'
+    }
+  """
+  try:
+    apts = crawler.list_apts(task['key'])
+  except Exception as e:
+    print(f'[!] failed to list apartments in {task["key"]} ({e})')
+    gu_store.fail(task, repr(e))
+    continue
+  apts = [apt_ent for apt_ent in apts if not apt_ent.get('매물종별구분', '').startswith('C')] # 분양 매물
+  apt_store.add_tasks([(str(safe_int(apt_ent['단지기본일련번호'])), apt_ent) for apt_ent in apts])
+  gu_store.complete(task['key'])
 
 
 print('[*] Updating apartment info and types')
-db.create_indices()
-
 apt_col = db.get_kbliiv_apt_collection()
 apt_type_col = db.get_kbliiv_apt_type_collection()
 
-
 if args.truncate_db:
   apt_col.drop()
   apt_type_col.drop()
-  apt_col = db.get_kbliiv_apt_collection()
-  apt_type_col = db.get_kbliiv_apt_type_collection()
+  db.get_kbliiv_apt_detail_collection().drop()
+  db.create_indices()
 
+if args.truncate_db or not args.skip_downloaded:
+  apt_store.reset()
 
-prog_bar = tqdm(apt_lst)
-for apt_ent in prog_bar:
-  apt_id = safe_int(apt_ent['단지기본일련번호'])
-  if apt_col.count_documents({'_id': apt_id}) > 0 and args.skip_downloaded:
-    continue
-  if apt_ent.get('매물종별구분', '').startswith('C'):
-    continue # 분양 매물
-  
-  apt_info = None
-  apt_types = None
+if args.skip_downloaded:
+  existing_ids = [str(ent['_id']) for ent in apt_col.find({}, {'_id': 1})]
+  apt_store.complete_many(existing_ids)
+  print(f'[*] {len(existing_ids)} apartments already in db')
+
+
+# every worker thread rotates through the proxies on its own crawler
+thread_local = threading.local()
+worker_cnt = itertools.count()
+
+def get_crawler()->KBLiivCrawlerWithProxy:
+  if not hasattr(thread_local, 'crawler'):
+    thread_local.crawler = KBLiivCrawlerWithProxy(proxy_list=proxy_list)
+    thread_local.crawler.active_proxy_index = next(worker_cnt)
+  return thread_local.crawler
+
+
+def fetch_apt(apt_id: int, apt_ent: Dict[str, Any])->Tuple[RowKBApart, Any, List[RowKBApartType]]:
+  crawler = get_crawler()
+  apt_info = crawler.apt_info(apt_id, apt_ent['매물종별구분'])
+  apt_types = crawler.apt_type_info(apt_id)
 
-  while apt_info is None or apt_types is None:
-    try:
-      if apt_info is None:
-        apt_info = crawler.apt_info(apt_id, apt_ent['매물종별구분'])  
-      if apt_types is None:
-        apt_types = crawler.apt_type_info(apt_id)
-    except requests.exceptions.Timeout:
-      time.sleep(10)
-      prog_bar.display(f'retrying {apt_id}')
-  
   addrcode_city = None
   addrcode = None
   lawaddrcode_city = None
@@ -149,20 +155,73 @@ for apt_ent in prog_bar:
     'apttype': safe_int(apt_info['매물종별구분']),
     'lat': safe_float(apt_info['wgs84위도']),
     'lng': safe_float(apt_info['wgs84경도']),
-    'detail': apt_info
   }
-  apt_col.replace_one({'_id': apt_id}, row_apt, upsert=True)
 
+  rows_apt_type: List[RowKBApartType] = []
   for t in apt_types:
     apt_type_id = safe_int(t['면적일련번호'])
-    row_apt_type: RowKBApartType = {
+    rows_apt_type.append({
       '_id': apt_type_id,
       'id': apt_type_id,
       'apart_id': apt_id,
       'name': apt_info['단지명'],
       'size': math.floor(0.5 + safe_float(t['전용면적평'])),
       'detail': t,
-    } 
-    apt_type_col.replace_one({'_id': apt_type_id}, row_apt_type, upsert=True)
+    })
+  return row_apt, apt_info, rows_apt_type
+
+
+lock = threading.Lock()
+batch: List[Tuple[str, Tuple[RowKBApart, Any, List[RowKBApartType]]]] = []
+
+def flush():
+  # writes the batch and only then marks its tasks done
+  global batch
+  with lock:
+    cur_batch = batch
+    batch = []
+  if len(cur_batch) == 0: return
+  db.bulk_upsert_kb_aparts([entry for _, entry in cur_batch])
+  apt_store.complete_many([key for key, _ in cur_batch])
+
+
+def worker():
+  while True:
+    task = apt_store.claim()
+    if task is None:
+      # nothing left to claim: write out what is fetched so far, otherwise those tasks stay
+      # running until their lease expires and are claimed and fetched again
+      flush()
+      wait = apt_store.wait_time()
+      if wait is None: return
+      time.sleep(min(wait, 5.0))
+      continue
 
+    try:
+      entry = fetch_apt(int(task['key']), task['payload'])
+    except Exception as e:
+      print(f'[!] failed to fetch {task["key"]} ({e})')
+      apt_store.fail(task, repr(e))
+      continue
+
+    with lock:
+      batch.append((task['key'], entry))
+      is_full = len(batch) >= args.batch_size
+    prog_bar.update(1)
+    if is_full: flush()
+
+
+counts = apt_store.counts()
+num_todo = counts.get('pending', 0) + counts.get('failed', 0) + counts.get('running', 0)
+print(f'[*] downloading {num_todo} apartments')
+prog_bar = tqdm(total=num_todo)
+threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.workers)]
+for t in threads: t.start()
+for t in threads: t.join()
+flush()
+
+for task in apt_store.list_tasks('dead'):
+  print(f'[!] {task["key"]},{task["payload"]["단지명"]}: failed to fetch ({task["last_error"]})')
+
+db.bump_data_version('kb_aprtlst')
 print('[+] Done')
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import datetime
 import os
 import sys
@@ -9,30 +10,33 @@ sys.path.append(ROOT)
 
 
 from tqdm import tqdm
-import time
-import json
 
 import korea_apartment_price
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
-import re
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 
-from korea_apartment_price.path import RENT_DATA_ROOT, SCRIPT_ROOT
+from korea_apartment_price import archive
+from korea_apartment_price.path import SCRIPT_ROOT
 from korea_apartment_price.config import get_cfg
 from korea_apartment_price.db import RowRent
 from korea_apartment_price.utils import safe_int, safe_float
+from korea_apartment_price.utils.http_cache import CachedSession
+from korea_apartment_price.utils.throttle import Throttler, get_throttler
 
 
 region_codes = pd.read_csv(os.path.join(SCRIPT_ROOT, 'rents_region_code.csv'))
 
 class RentDownloader:
-  def __init__(self, timeout:float=20.0):
+  def __init__(self, timeout:float=20.0, throttler:Optional[Throttler]=None, session:Optional[requests.Session]=None, base_url:str='http://apis.data.go.kr'):
     self.api_key = get_cfg()['RENTS_API_KEY']
     self.timeout = timeout
+    self.base_url = base_url
+    self.session = session if session is not None else CachedSession()
+    self.throttler = throttler if throttler is not None else get_throttler('apis.data.go.kr', 10.0, adaptive=True)
 
   def get(self, ymd: int, region_code: int)->List[RowRent]:
     num_rows = 1000
@@ -70,8 +74,13 @@ class RentDownloader:
           'pageNo': cur_page,
       }
 
-      url = 'http://apis.data.go.kr/1613000/RTMSDataSvcAptRent/getRTMSDataSvcAptRent' 
-      resp = requests.get(url, params=params, timeout=self.timeout)
+      url = f'{self.base_url}/1613000/RTMSDataSvcAptRent/getRTMSDataSvcAptRent'
+      if not self.session.is_fresh('GET', url, params):
+        self.throttler.throttle()
+      resp = self.session.get(url, params=params, timeout=self.timeout)
+      if resp.status_code == 429:
+        self.throttler.report_failure()
+        return None
       soup = BeautifulSoup(resp.content, 'lxml-xml')
       items = soup.findAll('item')
       try:
@@ -115,6 +124,14 @@ class RentDownloader:
 
 
 def list_rent_entries_in_db()->List[Tuple[int, int, int]]:
+  col = korea_apartment_price.db.get_ingest_manifest_collection()
+  if col.count_documents({'kind': 'rents'}, limit=1) == 0:
+    print('[*] no ingest manifest found. building it from the rents collection')
+    korea_apartment_price.db.backfill_ingest_manifest('rents', scan_rent_entries_in_db())
+  return korea_apartment_price.db.list_ingest_manifest('rents')
+
+
+def scan_rent_entries_in_db()->List[Tuple[int, int, int, int]]:
   col = korea_apartment_price.db.get_rents_collection()
   entries = col.aggregate([{
     "$group": {
@@ -131,25 +148,19 @@ def list_rent_entries_in_db()->List[Tuple[int, int, int]]:
     year = safe_int(entry['_id']['year'])
     month = safe_int(entry['_id']['month'])
     location_code = safe_int(entry['_id']['location_code'])
-    ymregion = (year, month, location_code)
     if entry['count'] > 0:
-      res.append(ymregion)
+      res.append((year, month, location_code, entry['count']))
   return res
 
 
 
 def list_rent_entries_in_files()->List[Tuple[int, int, int]]:
-  res = []
-  regex = re.compile(r'^([0-9]{4})([0-9]{2})-([0-9]{5}).json$')
-
-  for fname in os.listdir(RENT_DATA_ROOT):
-    gp = regex.match(fname)
-    if gp is None: continue
-    year = safe_int(gp.group(1))
-    month = safe_int(gp.group(2))
-    location_code = safe_int(gp.group(3))
-    res.append((year, month, location_code))
-  return res
+  # the legacy json archive is moved over first. otherwise the region-months it holds look
+  # missing from the files, and would be deleted from the db and fetched again
+  num_converted = archive.convert_json_files('rents', skip_existing=True)
+  if num_converted > 0:
+    print(f'[*] moved {num_converted} legacy json files into the parquet archive')
+  return archive.list_entries('rents')
 
 
 def remove_rent_entries_from_db(ymregions: List[Tuple[int, int, int]]):
@@ -164,51 +175,109 @@ def remove_rent_entries_from_db(ymregions: List[Tuple[int, int, int]]):
         {'$expr': { '$eq': [ "$location_code", location_code ] }},
       ]
     })
+  korea_apartment_price.db.remove_ingest_manifest('rents', ymregions)
+
+
 
+def fetch_with_retry(dn: RentDownloader, ymd_code: int, region_code: int)->List[RowRent]:
+  data = None
+  while data is None:
+    print(f'fetching {ymd_code}-{region_code}')
+    try:
+      data = dn.get(ymd_code, region_code)
+    except requests.exceptions.Timeout:
+      dn.throttler.report_failure()
+      print(f'{ymd_code}: timeout')
+      continue
+    except Exception as e:
+      print(f'{ymd_code}: exception ({e})')
+      traceback.print_exc()
+      continue
+    if data is None:
+      dn.throttler.report_failure()
+    else:
+      dn.throttler.report_success()
+  return data
 
 
 def fetch_and_insert(arg: Tuple[int, int, int]):
   year, month, region_code = arg
   ymd_code = year * 100 + month
 
-  fname = f'{year:04d}{month:02d}-{region_code}.json'
-  fpath = os.path.join(RENT_DATA_ROOT, fname)
-
-  os.makedirs(RENT_DATA_ROOT, exist_ok=True)
+  fname = f'{year:04d}{month:02d}-{region_code}'
   dn = RentDownloader()
   data = None
 
-  if not os.path.exists(fpath):
-    while data is None:
-      print(f'fetching {ymd_code}-{region_code}')
-      try:
-        time.sleep(0.1)
-        data = dn.get(ymd_code, region_code)
-      except requests.exceptions.Timeout:
-        print(f'{ymd_code}: timeout')
-      except Exception as e:
-        print(f'{ymd_code}: exception ({e})')
-        traceback.print_exc()
-
-    if len(data) > 0:
-      with open(fpath, 'w') as f:
-        content = json.dumps(data, ensure_ascii=False)
-        f.write(content)
+  if not archive.has_entry('rents', year, month, region_code):
+    data = fetch_with_retry(dn, ymd_code, region_code)
+    archive.write_month('rents', year, month, region_code, data)
   else:
     print(f'loading {ymd_code}-{region_code}')
-    with open(fpath, 'r') as f:
-      data = json.loads(f.read())
+    data = archive.read_month('rents', year, month, region_code)
 
   if len(data) > 0:
     col = korea_apartment_price.db.get_rents_collection()
+    korea_apartment_price.db.begin_ingest('rents', year, month, region_code)
     col.insert_many(data)
+    korea_apartment_price.db.finish_ingest('rents', year, month, region_code, data)
     print(f'{fname}: {len(data)}')
   else:
     print(f'{fname}: 0 (nothing fetched)')
 
 
 
+def refresh_and_sync(arg: Tuple[int, int, int]):
+  year, month, region_code = arg
+  ymd_code = year * 100 + month
+
+  fname = f'{year:04d}{month:02d}-{region_code}'
+  # bypasses cached pages but stores the new ones
+  dn = RentDownloader(session=CachedSession(refresh=True))
+  data = fetch_with_retry(dn, ymd_code, region_code)
+
+  data_hash = korea_apartment_price.db.content_hash(data)
+  manifest = korea_apartment_price.db.get_ingest_manifest('rents', year, month, region_code)
+  stored_hash = None
+  if manifest is not None and manifest['status'] == 'done':
+    stored_hash = manifest.get('content_hash', None)
+
+  if stored_hash == data_hash:
+    print(f'{fname}: unchanged')
+    return
+
+  archive.write_month('rents', year, month, region_code, data)
+
+  col = korea_apartment_price.db.get_rents_collection()
+  korea_apartment_price.db.begin_ingest('rents', year, month, region_code)
+  num_inserted, num_deleted = korea_apartment_price.db.sync_rows(col, {
+    'year': year,
+    'month': month,
+    'location_code': region_code,
+  }, data)
+  # an empty month keeps its hash too, so it is not rewritten on every refresh
+  korea_apartment_price.db.finish_ingest('rents', year, month, region_code, data, data_hash)
+  print(f'{fname}: +{num_inserted} -{num_deleted}')
+
+
+def recent_months(num_months: int)->List[Tuple[int, int]]:
+  now = datetime.datetime.now()
+  res = []
+  for idx in range(num_months):
+    ym = now.year * 12 + now.month - 1 - idx
+    res.append((ym // 12, ym % 12 + 1))
+  return res
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--rate', type=float, default=10.0, help='max requests per second to apis.data.go.kr (lowered automatically on errors)')
+  parser.add_argument('--refresh-window', dest='refresh_window', type=int, default=0, help='re-fetch the most recent N months and write only changed rows')
+  return parser.parse_args()
+
+
 if __name__ == '__main__':
+  args = parse_args()
+  get_throttler('apis.data.go.kr', args.rate, adaptive=True)
   entries_to_fetch = []
   now = datetime.datetime.now()
   for year in range(2010, now.year+1):
@@ -222,16 +291,31 @@ if __name__ == '__main__':
 
   print('[*] checking db/file rent entries')
   entries_in_db = set(list_rent_entries_in_db())
+  entries_loading = set(korea_apartment_price.db.list_ingest_manifest('rents', status='loading'))
   entries_in_files = set(list_rent_entries_in_files())
 
-  to_be_removed_from_db = list(entries_in_db.difference(entries_in_files))
+  to_be_removed_from_db = list(entries_in_db.difference(entries_in_files).union(entries_loading))
   to_be_removed_from_db.sort()
   print(f'[*] removing {len(to_be_removed_from_db)} entries from db not presenting in filesystem')
   remove_rent_entries_from_db(to_be_removed_from_db)
 
   print('[*] fetching rent entries and save them to db/fs')
-  entries_to_fetch = list(set(entries_to_fetch).difference(entries_in_files))
+  entries_to_refresh = []
+  for year, month in recent_months(args.refresh_window):
+    for region_code in region_codes['code5']:
+      entries_to_refresh.append((year, month, int(region_code)))
+
+  entries_loaded = entries_in_files.intersection(entries_in_db)
+  entries_to_fetch = list(set(entries_to_fetch).difference(entries_loaded).difference(entries_to_refresh))
   entries_to_fetch.sort()
 
   for jobidx, job in enumerate(tqdm(entries_to_fetch)):
     fetch_and_insert(job)
+
+  if len(entries_to_refresh) > 0:
+    print(f'[*] refreshing {len(entries_to_refresh)} rent entries of the last {args.refresh_window} months')
+    entries_to_refresh.sort()
+    for jobidx, job in enumerate(tqdm(entries_to_refresh)):
+      refresh_and_sync(job)
+
+  korea_apartment_price.db.bump_data_version('rents')
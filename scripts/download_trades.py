@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import datetime
 import os
 import sys
@@ -9,31 +10,34 @@ sys.path.append(ROOT)
 
 
 from tqdm import tqdm
-import time
-import json
 
 import korea_apartment_price
 from korea_apartment_price.utils.converter import safe_date_serial
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
-import re
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 
-from korea_apartment_price.path import TRADE_DATA_ROOT, SCRIPT_ROOT
+from korea_apartment_price import archive, trade_volume
+from korea_apartment_price.path import SCRIPT_ROOT
 from korea_apartment_price.config import get_cfg
 from korea_apartment_price.db import RowTrade
 from korea_apartment_price.utils import safe_int, safe_float
+from korea_apartment_price.utils.http_cache import CachedSession
+from korea_apartment_price.utils.throttle import Throttler, get_throttler
 
 
 region_codes = pd.read_csv(os.path.join(SCRIPT_ROOT, 'trades_region_code.csv'))
 
 class TradeDownloader:
-  def __init__(self, timeout:float=20.0):
+  def __init__(self, timeout:float=20.0, throttler:Optional[Throttler]=None, session:Optional[requests.Session]=None, base_url:str='http://apis.data.go.kr'):
     self.api_key = get_cfg()['TRADES_API_KEY']
     self.timeout = timeout
+    self.base_url = base_url
+    self.session = session if session is not None else CachedSession()
+    self.throttler = throttler if throttler is not None else get_throttler('apis.data.go.kr', 10.0, adaptive=True)
 
   def get(self, ymd: int, region_code: int)->List[RowTrade]:
     num_rows = 1000
@@ -80,9 +84,14 @@ class TradeDownloader:
           'pageNo': cur_page,
       }
 
-      url = 'http://apis.data.go.kr/1613000/RTMSDataSvcAptTradeDev/getRTMSDataSvcAptTradeDev' 
+      url = f'{self.base_url}/1613000/RTMSDataSvcAptTradeDev/getRTMSDataSvcAptTradeDev'
 
-      resp = requests.get(url, params=params, timeout=self.timeout)
+      if not self.session.is_fresh('GET', url, params):
+        self.throttler.throttle()
+      resp = self.session.get(url, params=params, timeout=self.timeout)
+      if resp.status_code == 429:
+        self.throttler.report_failure()
+        return None
       soup = BeautifulSoup(resp.content, 'lxml-xml')
       items = soup.findAll('item')
       try:
@@ -138,6 +147,14 @@ class TradeDownloader:
 
 
 def list_trade_entries_in_db()->List[Tuple[int, int, int]]:
+  col = korea_apartment_price.db.get_ingest_manifest_collection()
+  if col.count_documents({'kind': 'trades'}, limit=1) == 0:
+    print('[*] no ingest manifest found. building it from the trades collection')
+    korea_apartment_price.db.backfill_ingest_manifest('trades', scan_trade_entries_in_db())
+  return korea_apartment_price.db.list_ingest_manifest('trades')
+
+
+def scan_trade_entries_in_db()->List[Tuple[int, int, int, int]]:
   col = korea_apartment_price.db.get_trades_collection()
   entries = col.aggregate([{
     "$group": {
@@ -154,25 +171,19 @@ def list_trade_entries_in_db()->List[Tuple[int, int, int]]:
     year = safe_int(entry['_id']['year'])
     month = safe_int(entry['_id']['month'])
     lawaddrcode_city = safe_int(entry['_id']['lawaddrcode_city'])
-    ymregion = (year, month, lawaddrcode_city)
     if entry['count'] > 0:
-      res.append(ymregion)
+      res.append((year, month, lawaddrcode_city, entry['count']))
   return res
 
 
 
 def list_trade_entries_in_files()->List[Tuple[int, int, int]]:
-  res = []
-  regex = re.compile(r'^([0-9]{4})([0-9]{2})-([0-9]{5}).json$')
-
-  for fname in os.listdir(TRADE_DATA_ROOT):
-    gp = regex.match(fname)
-    if gp is None: continue
-    year = safe_int(gp.group(1))
-    month = safe_int(gp.group(2))
-    lawaddrcode_city = safe_int(gp.group(3))
-    res.append((year, month, lawaddrcode_city))
-  return res
+  # the legacy json archive is moved over first. otherwise the region-months it holds look
+  # missing from the files, and would be deleted from the db and fetched again
+  num_converted = archive.convert_json_files('trades', skip_existing=True)
+  if num_converted > 0:
+    print(f'[*] moved {num_converted} legacy json files into the parquet archive')
+  return archive.list_entries('trades')
 
 
 def remove_trade_entries_from_db(ymregions: List[Tuple[int, int, int]]):
@@ -187,52 +198,113 @@ def remove_trade_entries_from_db(ymregions: List[Tuple[int, int, int]]):
         {'$expr': { '$eq': [ "$lawaddrcode_city", lawaddrcode_city ] }},
       ]
     })
+    trade_volume.update_volume_cube(year, month, lawaddrcode_city)
+  korea_apartment_price.db.remove_ingest_manifest('trades', ymregions)
+
+
 
+def fetch_with_retry(dn: TradeDownloader, ymd_code: int, region_code: int)->List[RowTrade]:
+  data = None
+  while data is None:
+    print(f'fetching {ymd_code}-{region_code}')
+    try:
+      data = dn.get(ymd_code, region_code)
+    except requests.exceptions.Timeout:
+      dn.throttler.report_failure()
+      print(f'{ymd_code}: timeout')
+      continue
+    except Exception as e:
+      print(f'{ymd_code}: exception ({e})')
+      traceback.print_exc()
+      continue
+    if data is None:
+      dn.throttler.report_failure()
+    else:
+      dn.throttler.report_success()
+  return data
 
 
 def fetch_and_insert(arg: Tuple[int, int, int]):
   year, month, region_code = arg
   ymd_code = year * 100 + month
 
-  fname = f'{year:04d}{month:02d}-{region_code}.json'
-  fpath = os.path.join(TRADE_DATA_ROOT, fname)
-
-  os.makedirs(TRADE_DATA_ROOT, exist_ok=True)
+  fname = f'{year:04d}{month:02d}-{region_code}'
   dn = TradeDownloader()
   data = None
 
-  if not os.path.exists(fpath):
-    while data is None:
-      print(f'fetching {ymd_code}-{region_code}')
-      try:
-        time.sleep(0.1)
-        data = dn.get(ymd_code, region_code)
-      except requests.exceptions.Timeout:
-        print(f'{ymd_code}: timeout')
-      except Exception as e:
-        print(f'{ymd_code}: exception ({e})')
-        traceback.print_exc()
-
-    if len(data) > 0:
-      with open(fpath, 'w') as f:
-        content = json.dumps(data, ensure_ascii=False)
-        f.write(content)
+  if not archive.has_entry('trades', year, month, region_code):
+    data = fetch_with_retry(dn, ymd_code, region_code)
+    archive.write_month('trades', year, month, region_code, data)
   else:
     print(f'loading {ymd_code}-{region_code}')
-    with open(fpath, 'r') as f:
-      data = json.loads(f.read())
+    data = archive.read_month('trades', year, month, region_code)
 
   if len(data) > 0:
     col = korea_apartment_price.db.get_trades_collection()
+    korea_apartment_price.db.begin_ingest('trades', year, month, region_code)
     col.insert_many(data)
+    trade_volume.update_volume_cube(year, month, region_code)
+    korea_apartment_price.db.finish_ingest('trades', year, month, region_code, data)
     print(f'{fname}: {len(data)}')
   else:
     print(f'{fname}: 0 (nothing fetched)')
 
 
 
+def refresh_and_sync(arg: Tuple[int, int, int]):
+  year, month, region_code = arg
+  ymd_code = year * 100 + month
+
+  fname = f'{year:04d}{month:02d}-{region_code}'
+  # bypasses cached pages but stores the new ones
+  dn = TradeDownloader(session=CachedSession(refresh=True))
+  data = fetch_with_retry(dn, ymd_code, region_code)
+
+  data_hash = korea_apartment_price.db.content_hash(data)
+  manifest = korea_apartment_price.db.get_ingest_manifest('trades', year, month, region_code)
+  stored_hash = None
+  if manifest is not None and manifest['status'] == 'done':
+    stored_hash = manifest.get('content_hash', None)
+
+  if stored_hash == data_hash:
+    print(f'{fname}: unchanged')
+    return
+
+  archive.write_month('trades', year, month, region_code, data)
+
+  col = korea_apartment_price.db.get_trades_collection()
+  korea_apartment_price.db.begin_ingest('trades', year, month, region_code)
+  num_inserted, num_deleted = korea_apartment_price.db.sync_rows(col, {
+    'year': year,
+    'month': month,
+    'lawaddrcode_city': region_code,
+  }, data)
+  trade_volume.update_volume_cube(year, month, region_code)
+  # an empty month keeps its hash too, so it is not rewritten on every refresh
+  korea_apartment_price.db.finish_ingest('trades', year, month, region_code, data, data_hash)
+  print(f'{fname}: +{num_inserted} -{num_deleted}')
+
+
+def recent_months(num_months: int)->List[Tuple[int, int]]:
+  now = datetime.datetime.now()
+  res = []
+  for idx in range(num_months):
+    ym = now.year * 12 + now.month - 1 - idx
+    res.append((ym // 12, ym % 12 + 1))
+  return res
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--rate', type=float, default=10.0, help='max requests per second to apis.data.go.kr (lowered automatically on errors)')
+  parser.add_argument('--refresh-window', dest='refresh_window', type=int, default=0, help='re-fetch the most recent N months and write only changed rows')
+  parser.add_argument('--rebuild-volume-cube', dest='rebuild_volume_cube', action='store_true', help='rebuild the weekly volume cube of /volume from every stored trade')
+  return parser.parse_args()
+
 
 if __name__ == '__main__':
+  args = parse_args()
+  get_throttler('apis.data.go.kr', args.rate, adaptive=True)
   entries_to_fetch = []
   now = datetime.datetime.now()
   for year in range(2006, now.year+1):
@@ -246,16 +318,35 @@ if __name__ == '__main__':
 
   print('[*] checking db/file trade entries')
   entries_in_db = set(list_trade_entries_in_db())
+  entries_loading = set(korea_apartment_price.db.list_ingest_manifest('trades', status='loading'))
   entries_in_files = set(list_trade_entries_in_files())
 
-  to_be_removed_from_db = list(entries_in_db.difference(entries_in_files))
+  to_be_removed_from_db = list(entries_in_db.difference(entries_in_files).union(entries_loading))
   to_be_removed_from_db.sort()
   print(f'[*] removing {len(to_be_removed_from_db)} entries from db not presenting in filesystem')
   remove_trade_entries_from_db(to_be_removed_from_db)
 
   print('[*] fetching trade entries and save them to db/fs')
-  entries_to_fetch = list(set(entries_to_fetch).difference(entries_in_files))
+  entries_to_refresh = []
+  for year, month in recent_months(args.refresh_window):
+    for region_code in region_codes['code5']:
+      entries_to_refresh.append((year, month, int(region_code)))
+
+  entries_loaded = entries_in_files.intersection(entries_in_db)
+  entries_to_fetch = list(set(entries_to_fetch).difference(entries_loaded).difference(entries_to_refresh))
   entries_to_fetch.sort()
 
   for jobidx, job in enumerate(tqdm(entries_to_fetch)):
     fetch_and_insert(job)
+
+  if len(entries_to_refresh) > 0:
+    print(f'[*] refreshing {len(entries_to_refresh)} trade entries of the last {args.refresh_window} months')
+    entries_to_refresh.sort()
+    for jobidx, job in enumerate(tqdm(entries_to_refresh)):
+      refresh_and_sync(job)
+
+  if args.rebuild_volume_cube:
+    print('[*] rebuilding volume cube')
+    trade_volume.rebuild_volume_cube(progress=tqdm)
+
+  korea_apartment_price.db.bump_data_version('trades')
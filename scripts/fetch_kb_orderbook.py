@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
-import json
-import traceback
 import datetime
+import logging
 import os
 import sys
+import threading
+import traceback
 from typing import Optional
 
 ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
@@ -16,22 +17,30 @@ import time
 import argparse
 import pandas as pd
 
-from korea_apartment_price.path import SCRIPT_ROOT
 from korea_apartment_price import db
-from korea_apartment_price.kb_liiv import KBLiivCrawler, KBLiivCrawlerWithProxy
+from korea_apartment_price.job_state import JobStateStore
+from korea_apartment_price.kb_liiv import KBLiivCrawler, proxy_requests_args
 from korea_apartment_price.utils import keyconvert
-from korea_apartment_price.utils.throttle import Throttler
+from korea_apartment_price.utils.throttle import get_throttler
 
 def parse_args():
   parser = argparse.ArgumentParser()
   parser.add_argument('-r,--remove_todays_orderbook', dest='remove_todays_orderbook', action='store_true', help='remove all orders fetched today')
   parser.add_argument('-l,--list', dest='region_code_list_csv', help='region code list.', default=os.path.join(ROOT, 'scripts/orderbook_region_code.csv'), required=False)
-  parser.add_argument('-i,--aptidx', dest='continue_from', type=int, help='continue from idx.', default=None)
   parser.add_argument('-p,--proxy', dest='proxy_list', help='proxy list file', default=os.path.join(ROOT, 'scripts/proxy_lst.txt'), required=False)
+  parser.add_argument('--rate', type=float, default=0.6, help='max requests per second for each proxy (lowered automatically on errors)')
+  parser.add_argument('--max_attempts', type=int, default=5, help='max attempts per apartment')
+  parser.add_argument('--max_proxies', type=int, default=None, help='use at most N endpoints (including the direct connection)')
+  parser.add_argument('--max_concurrent_pages', type=int, default=4, help='max orderbook pages fetched at once per proxy')
+  parser.add_argument('-v,--verbose', dest='verbose', action='store_true', help='log every fetched orderbook page')
+  parser.add_argument('--storage', choices=['full', 'delta'], default='full', help='"full" stores every listing per fetch, "delta" stores only listings that changed since the previous fetch')
+  parser.add_argument('--min_proxy_score', type=float, default=0.2, help='retire a proxy whose success score drops below this')
   return parser.parse_args()
 
 
 args = parse_args()
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+logging.getLogger('korea_apartment_price.kb_liiv').setLevel(logging.DEBUG if args.verbose else logging.WARNING)
 region_codes = pd.read_csv(args.region_code_list_csv)
 apt_idnames = set()
 proxy_list = []
@@ -55,49 +64,117 @@ for region_code in tqdm(region_codes['code5']):
 apt_idnames = sorted(list(apt_idnames))
 
 db.create_indices()
-col = db.get_kbliiv_apt_orderbook_collection()
 
 if args.remove_todays_orderbook:
   print ('[*] removing all orders fetched today')
   now = datetime.datetime.now()
   start_from = datetime.datetime(now.year, now.month, now.day)
-  col.delete_many({'fetched_at': {'$gte': start_from}})
-
-
-
-print ('[*] downloading orderbooks')
-
-
-crawler = KBLiivCrawlerWithProxy(proxy_list=proxy_list)
-throttler = Throttler(0.6)
-
-for idx, (apt_id, apt_name) in enumerate(apt_idnames):
-  if args.continue_from is not None and args.continue_from > idx + 1:
-    continue
-    
-  data = None
-  retry_cnt = 0
-  fail_cnt = 0
-  while data is None:
-    print(f'[{idx + 1} / {len(apt_idnames)}] {apt_id},{apt_name} <{retry_cnt}>')
+  db.remove_kb_orderbook_since(start_from)
+  JobStateStore(f'kb_orderbook:{now.strftime("%Y%m%d")}').clear()
+
+
+
+class ProxyHealth:
+  def __init__(self, addr: Optional[str]):
+    self.addr = addr
+    self.score = 1.0
+    self.num_success = 0
+    self.num_fail = 0
+    self.crawler: Optional[KBLiivCrawler] = None
+
+  def report(self, success: bool):
+    # exponentially weighted success rate
+    self.score = 0.8 * self.score + 0.2 * (1.0 if success else 0.0)
+    if success: self.num_success += 1
+    else: self.num_fail += 1
+
+  @property
+  def name(self)->str:
+    return self.addr if self.addr is not None else 'direct'
+
+  @property
+  def is_healthy(self)->bool:
+    return self.score >= args.min_proxy_score
+
+
+def worker(health: ProxyHealth):
+  # the crawler throttles each page request itself, parallel orderbook pages included
+  throttler = get_throttler(f'kbland:{health.name}', args.rate, adaptive=True)
+  crawler = KBLiivCrawler(reqeuests_args=proxy_requests_args(health.addr), max_concurrent_pages=args.max_concurrent_pages, throttler=throttler)
+  health.crawler = crawler
+
+  while True:
+    task = store.claim()
+    if task is None:
+      wait = store.wait_time()
+      if wait is None: return
+      time.sleep(min(wait, 5.0))
+      continue
+
+    apt_id = int(task['key'])
+    apt_name = task['payload']['name']
+    attempts = task['attempts']
+    print(f'[{health.name}] {apt_id},{apt_name} <{attempts}>')
     try:
-      throttler.throttle()
       data = crawler.cleansed_orderbook(apt_id, trade_types=[db.TradeType.WHOLE])
     except Exception as e:
-      print(f'Exception: {e}')
+      health.report(False)
+      throttler.report_failure()
+      print(f'[{health.name}] Exception: {e}')
       print(traceback.format_exc())
-      print(f'failed to retrieve apt_name={apt_name} apt_id={apt_id}. retrying..')
+      print(f'[{health.name}] failed to retrieve apt_name={apt_name} apt_id={apt_id} (score={health.score:.2f})')
+      store.fail(task, repr(e))
+      if not health.is_healthy:
+        print(f'[{health.name}] retiring unhealthy proxy')
+        return
       time.sleep(1.0)
+      continue
+
+    health.report(True)
+    throttler.report_success()
+    if len(data) == 0 and attempts == 1:
+      # an empty orderbook is often a transient error. try once more later
+      store.fail(task, 'empty orderbook')
+      continue
+
+    print(f'[{health.name}] {apt_id},{apt_name} ==> {len(data)}')
+    rows = [keyconvert(e, {'trade_type': lambda x: x.value}) for e in data]
+    if args.storage == 'delta':
+      fetched_at = rows[0]['fetched_at'] if len(rows) > 0 else datetime.datetime.now()
+      num_extended, num_inserted = db.insert_kb_orderbook_delta(apt_id, rows, fetched_at)
+      print(f'[{health.name}] {apt_id},{apt_name} ==> unchanged {num_extended}, new {num_inserted}')
+    else:
+      db.insert_kb_orderbook(rows)
+    store.complete(task['key'])
 
-    if data is not None and len(data) == 0:
-      retry_cnt += 1
-      if retry_cnt < 2: data = None
 
-  if data is not None:
-    print(f'[{idx + 1} / {len(apt_idnames)}] {apt_id},{apt_name} ==> {len(data)}')
-    if len(data) > 0:
-      col.insert_many([keyconvert(e, {'trade_type': lambda x: x.value}) for e in data])
-  else:
-    print(f'{apt_id},{apt_name}: failed to fetch')
+print ('[*] downloading orderbooks')
 
+# one job per day. restarts (or other processes running the same command) pick up the remaining apartments
+store = JobStateStore(f'kb_orderbook:{datetime.date.today().strftime("%Y%m%d")}', max_attempts=args.max_attempts, backoff_base=5.0, backoff_max=300.0)
+store.add_tasks([(str(apt_id), {'name': apt_name}) for apt_id, apt_name in apt_idnames])
+counts = store.counts()
+num_todo = counts.get('pending', 0) + counts.get('failed', 0) + counts.get('running', 0)
+print (f'[*] {num_todo} apartments to fetch ({counts.get("done", 0)} already done today)')
+
+proxies = [None] + proxy_list
+if args.max_proxies is not None:
+  proxies = proxies[:args.max_proxies]
+healths = [ProxyHealth(addr) for addr in proxies]
+threads = [threading.Thread(target=worker, args=(h,), daemon=True) for h in healths]
+for t in threads: t.start()
+for t in threads: t.join()
+
+for h in sorted(healths, key=lambda h: -h.num_success):
+  stats = h.crawler.connection_stats() if h.crawler is not None else {}
+  print(f'  {h.name}: success={h.num_success} fail={h.num_fail} score={h.score:.2f} '
+        f'requests={stats.get("requests", 0)} connections={stats.get("connections", 0)}')
+for task in store.list_tasks('dead'):
+  print(f'{task["key"]},{task["payload"]["name"]}: failed to fetch ({task["last_error"]})')
+counts = store.counts()
+num_left = counts.get('pending', 0) + counts.get('failed', 0)
+if num_left > 0:
+  print(f'[!] {num_left} apartments left unfetched since every proxy was retired. run again to resume')
+
+db.bump_data_version('kb_orderbook')
 print ('[*] done')
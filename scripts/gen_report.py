@@ -87,8 +87,8 @@ def render_graph(apts: List[ApartmentId], date_from=20190101)->Tuple[str, Figure
   fetched_price_date_lbls = {}
   for od in kb_orderbook:
     date_end = od['fetched_at']
-    if od['detail']['최소매매가'] is not None:
-      price = int(od['detail']['최소매매가']) / 10000
+    if od.get('min_price', None) is not None:
+      price = int(od['min_price']) / 10000
     else:
       price = od['price'] / 10000
     fetched_date_cnt[date_end] = fetched_date_cnt.get(date_end, 0) + 1
@@ -1,168 +1,92 @@
 #!/usr/bin/env python3
-import datetime
+import argparse
+import logging
 import os
 import sys
-import traceback
+import threading
+import time
 
 ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(ROOT)
 
-
-from tqdm import tqdm
-import time
-import json
-
-import korea_apartment_price
-from korea_apartment_price.utils.converter import safe_date_serial
-from typing import Dict, List, Optional, Tuple
-
-
-import re
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-
-from korea_apartment_price.path import TRADE_DATA_ROOT, SCRIPT_ROOT
-from korea_apartment_price.config import get_cfg
-from korea_apartment_price.db import RowTrade
-from korea_apartment_price.utils import safe_int, safe_float
-
-
-region_codes = pd.read_csv(os.path.join(SCRIPT_ROOT, 'trades_region_code.csv'))
-
-class BuildingLedgerDownloader:
-  def __init__(self, timeout:float=20.0):
-    self.api_key = get_cfg()['BLD_LEDGER_API_KEY']
-    self.timeout = timeout
-
-  def get(self, 
-          lawaddrcode_city:int, 
-          lawaddrcode_dong: int,
-          bun: Optional[str] = None, 
-          ji: Optional[str] = None,
-          )->List[RowTrade]:
-    num_rows = 1000
-    res_in_dict: Dict[str, Dict] = {}
-
-
-    keylist = [
-      ('newPlatPlc', 'addr_road'), # 도로명 주소
-      ('platPlc', 'lawaddr'), # 예전 주소
-      ('platArea', 'plat_area'), # 대지 면적
-      ('bcRat', 'building_coverage_ratio'), # 건폐율
-      ('vlRat', 'floor_area_ratio'), # 용적률
-      ('bldNm', 'name'), # 이름
-      ('hhldCnt', 'household_cnt'), # 세대수
-      ('useAprDay', 'used_after'), # 사용승인일
-      ('mgmBldrgstPk', 'pk'), # 건축물 관리대장 일련번호
-    ]
-
-    total_cnt = None
-    cur_page = 1
-    partial_res = []
-
-    while total_cnt is None or total_cnt > len(partial_res):
-      params = {
-          'sigunguCd': lawaddrcode_city,
-          'bjdongCd': lawaddrcode_dong,
-          'serviceKey': self.api_key,
-          'numOfRows': num_rows,
-          'pageNo': cur_page,
-      }
-      if bun is not None: params['bun'] = bun
-      if ji is not None: params['ji'] = ji
-
-      target = 'getBrRecapTitleInfo' # 총괄표제부
-      url = f'http://apis.data.go.kr/1613000/BldRgstService_v2/{target}'
-      resp = requests.get(url, params=params, timeout=self.timeout)
-      soup = BeautifulSoup(resp.content, 'lxml-xml')
-      items = soup.findAll('item')
-      try:
-        total_cnt = int(soup.findAll('totalCount')[0].text)
-      except IndexError as e:
-        print(resp.content.decode('utf-8'))
-        return None
-
-      for v in items:
-        item = {}
-        item_en = {}
-        for key, key_en in keylist:
-          elem = v.find(key)
-          item[key] = elem.text.strip() if elem is not None else None
-          item_en[key_en] = item[key]
-
-        partial_res.append(item_en)
-      cur_page += 1
-
-    for e in partial_res:
-      res_in_dict[e['pk']] = e
-
-
-
-    keylist = [
-      ('mgmBldrgstPk', 'pk'), # 건축물 관리대장 일련번호
-      ('jijiguCdNm', 'jigu'), # 지역지구구역
-      ('jijiguGbCdNm', 'jigu_gb'), # 지역지구구역
-      ('etcJijigu', 'jigu_etc'), # 지역지구구역
-    ]
-
-    total_cnt = None
-    cur_page = 1
-    partial_res = []
-
-    while total_cnt is None or total_cnt > len(partial_res):
-      params = {
-          'sigunguCd': lawaddrcode_city,
-          'bjdongCd': lawaddrcode_dong,
-          'serviceKey': self.api_key,
-          'numOfRows': num_rows,
-          'pageNo': cur_page,
-      }
-      if bun is not None: params['bun'] = bun
-      if ji is not None: params['ji'] = ji
-
-      target = 'getBrJijiguInfo' # 지역지구구역
-      url = f'http://apis.data.go.kr/1613000/BldRgstService_v2/{target}'
-      resp = requests.get(url, params=params, timeout=self.timeout)
-      soup = BeautifulSoup(resp.content, 'lxml-xml')
-      items = soup.findAll('item')
-      try:
-        total_cnt = int(soup.findAll('totalCount')[0].text)
-      except IndexError as e:
-        print(resp.content.decode('utf-8'))
-        return None
-
-      for v in items:
-        item = {}
-        item_en = {}
-        for key, key_en in keylist:
-          elem = v.find(key)
-          item[key] = elem.text.strip() if elem is not None else None
-          item_en[key_en] = item[key]
-
-        partial_res.append(item_en)
-      cur_page += 1
-    
-    for e in partial_res:
-      print(e)
-      if e['pk'] in res_in_dict:
-        if res_in_dict[e['pk']].get('jigu', None) is None:
-          res_in_dict[e['pk']]['jigu'] = []
-        if e.get('jigu', None) is not None:
-          res_in_dict[e['pk']]['jigu'].append(e['jigu'])
-        else:
-          print(e)
-
-    res = list(res_in_dict.values())
-    return res
-
+from pymongo import ReplaceOne
+from tqdm import tqdm
 
+from korea_apartment_price import db, region_code
+from korea_apartment_price.bld_ledger import BuildingLedgerDownloader
+from korea_apartment_price.job_state import JobStateStore
+from korea_apartment_price.path import SCRIPT_ROOT
+from korea_apartment_price.utils.throttle import get_throttler
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-l,--list', dest='region_code_list_csv', help='region code list.', default=os.path.join(SCRIPT_ROOT, 'trades_region_code.csv'), required=False)
+  parser.add_argument('--workers', type=int, default=4, help='number of dongs fetched concurrently')
+  parser.add_argument('--max_concurrent_pages', type=int, default=4, help='max pages fetched at once per dong')
+  parser.add_argument('--rate', type=float, default=10.0, help='max requests per second to apis.data.go.kr (lowered automatically on errors)')
+  parser.add_argument('--refresh', action='store_true', help='ignore cached responses and previous progress, fetch every dong again')
+  parser.add_argument('-v,--verbose', dest='verbose', action='store_true', help='log every fetched page')
+  return parser.parse_args()
+
+
+def worker():
+  dn = BuildingLedgerDownloader(throttler=throttler, max_concurrent_pages=args.max_concurrent_pages, use_cache=not args.refresh)
+  while True:
+    task = store.claim()
+    if task is None:
+      wait = store.wait_time()
+      if wait is None: break
+      time.sleep(min(wait, 5.0))
+      continue
+
+    lawaddrcode = task['key']
+    try:
+      rows = dn.get(int(lawaddrcode[:5]), int(lawaddrcode[5:]))
+    except Exception as e:
+      print(f'[!] {lawaddrcode}: {e}')
+      store.fail(task, repr(e))
+      continue
+
+    if len(rows) > 0:
+      col.bulk_write([ReplaceOne({'_id': row['_id']}, row, upsert=True) for row in rows], ordered=False)
+    store.complete(lawaddrcode)
+    prog_bar.update(1)
+  dn.close()
 
 
 if __name__ == '__main__':
-  d = BuildingLedgerDownloader()
-  lawaddrcode_city=int(sys.argv[1])
-  lawaddrcode_dong=int(sys.argv[2])
-  res = d.get(lawaddrcode_city, lawaddrcode_dong)
-  import pprint
-  pprint.pprint(res)
\ No newline at end of file
+  args = parse_args()
+  logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+  logging.getLogger('korea_apartment_price.bld_ledger').setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+  throttler = get_throttler('apis.data.go.kr', args.rate, adaptive=True)
+
+  db.create_indices()
+  col = db.get_bld_ledger_collection()
+
+  print('[*] gathering dong list')
+  region_codes = pd.read_csv(args.region_code_list_csv)
+  dongs = set()
+  for code5 in region_codes['code5']:
+    for ent in region_code.decode(str(code5)):
+      # 10 digit codes ending with 00000 are the sigungu itself
+      if len(ent['lawaddrcode']) == 10 and not ent['lawaddrcode'].endswith('00000'):
+        dongs.add(ent['lawaddrcode'])
+
+  store = JobStateStore('bld_ledger')
+  if args.refresh:
+    store.clear()
+  store.add_tasks([(code, None) for code in sorted(dongs)])
+
+  counts = store.counts()
+  num_todo = counts.get('pending', 0) + counts.get('failed', 0) + counts.get('running', 0)
+  print(f'[*] downloading building ledgers of {num_todo} dongs ({counts.get("done", 0)} already done)')
+  prog_bar = tqdm(total=num_todo)
+  threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.workers)]
+  for t in threads: t.start()
+  for t in threads: t.join()
+
+  for task in store.list_tasks('dead'):
+    print(f'[!] {task["key"]}: failed to fetch ({task["last_error"]})')
+  print('[+] Done')
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.collection import Collection
+from tqdm import tqdm
+
+from korea_apartment_price import db
+from korea_apartment_price.utils.converter import safe_float, safe_int
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--batch_size', type=int, default=1000, help='documents migrated per bulk write')
+  return parser.parse_args()
+
+
+def migrate(col: Collection, detail_col: Collection, promote: bool, batch_size: int)->int:
+  # moves inline 'detail' payloads to the side collection, promoting the hot fields of orderbook rows
+  total = col.count_documents({'detail': {'$exists': True}})
+  cnt = 0
+  with tqdm(total=total) as prog_bar:
+    while True:
+      ents = list(col.find({'detail': {'$exists': True}}, {'_id': 1, 'detail': 1}).limit(batch_size))
+      if len(ents) == 0: break
+
+      detail_ids = []
+      detail_ops = []
+      ops = []
+      for ent in ents:
+        detail = ent['detail']
+        if detail is not None:
+          detail_ids.append(ent['_id'])
+          detail_ops.append(InsertOne({'_id': ent['_id'], 'detail': detail}))
+        update = {'$unset': {'detail': ''}}
+        if promote:
+          detail = detail or {}
+          update['$set'] = {
+            'min_price': safe_float(detail.get('최소매매가', None)),
+            'listing_id': safe_int(detail.get('매물일련번호', None)),
+          }
+        ops.append(UpdateOne({'_id': ent['_id']}, update))
+
+      if len(detail_ops) > 0:
+        # replace any half-migrated copies from a previous run
+        detail_col.delete_many({'_id': {'$in': detail_ids}})
+        detail_col.bulk_write(detail_ops, ordered=False)
+      col.bulk_write(ops, ordered=False)
+      cnt += len(ents)
+      prog_bar.update(len(ents))
+  return cnt
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  db.create_indices()
+
+  print('[*] migrating kbliiv_apt')
+  cnt = migrate(db.get_kbliiv_apt_collection(), db.get_kbliiv_apt_detail_collection(), False, args.batch_size)
+  print(f'[+] {cnt} documents migrated')
+
+  print('[*] migrating kbliiv_apt_orderbook')
+  cnt = migrate(db.get_kbliiv_apt_orderbook_collection(), db.get_kbliiv_apt_orderbook_detail_collection(), True, args.batch_size)
+  print(f'[+] {cnt} documents migrated')
+
+  print('[*] migrating kbliiv_apt_orderbook_delta')
+  cnt = migrate(db.get_kbliiv_apt_orderbook_delta_collection(), db.get_kbliiv_apt_orderbook_detail_collection(), True, args.batch_size)
+  print(f'[+] {cnt} documents migrated')
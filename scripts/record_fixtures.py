@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'scripts'))
+
+from korea_apartment_price.kb_liiv import KBLiivCrawler
+from korea_apartment_price.path import DATA_ROOT
+from korea_apartment_price.utils.replay import RecordingSession
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-o,--out', dest='out', default=os.path.join(DATA_ROOT, 'fixtures'), help='fixture directory')
+  parser.add_argument('--trades', action='append', default=[], help='YYYYMM-REGION of trades to record (repeatable)')
+  parser.add_argument('--rents', action='append', default=[], help='YYYYMM-REGION of rents to record (repeatable)')
+  parser.add_argument('--kb_apt_id', type=int, action='append', default=[], help='KB apartment id whose orderbook and area types to record (repeatable)')
+  return parser.parse_args()
+
+
+def parse_ymregion(s: str):
+  ym, region = s.split('-')
+  return int(ym), int(region)
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  session = RecordingSession(args.out)
+
+  if len(args.trades) > 0:
+    from download_trades import TradeDownloader
+    dn = TradeDownloader(session=session)
+    for ent in args.trades:
+      print(f'[*] recording trades {ent}')
+      dn.get(*parse_ymregion(ent))
+
+  if len(args.rents) > 0:
+    from download_rents import RentDownloader
+    dn = RentDownloader(session=session)
+    for ent in args.rents:
+      print(f'[*] recording rents {ent}')
+      dn.get(*parse_ymregion(ent))
+
+  if len(args.kb_apt_id) > 0:
+    crawler = KBLiivCrawler(session=session)
+    for apt_id in args.kb_apt_id:
+      print(f'[*] recording KB apartment {apt_id}')
+      crawler.apt_type_info(apt_id)
+      crawler.orderbook(apt_id)
+
+  print(f'[+] {session.num_recorded} responses recorded in {args.out}')
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+
+ROOT=os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from korea_apartment_price.path import DATA_ROOT
+from korea_apartment_price.utils.replay import ReplayServer
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-f,--fixtures', dest='fixtures', default=os.path.join(DATA_ROOT, 'fixtures'), help='fixture directory')
+  parser.add_argument('--port', type=int, default=8765)
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+  parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added on top of latency')
+  parser.add_argument('--error_rate', type=float, default=0.0, help='fraction of requests answered with --error_status')
+  parser.add_argument('--error_status', type=int, default=503)
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  server = ReplayServer(args.fixtures, port=args.port, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, error_status=args.error_status)
+  print(f'[*] replaying {len(server.fixtures)} fixtures at {server.start()}')
+  try:
+    while True:
+      time.sleep(10.0)
+      print(f'[*] {server.stats}')
+  except KeyboardInterrupt:
+    pass
+  server.stop()
+  print(f'[+] {server.stats}')
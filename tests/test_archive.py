@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from korea_apartment_price import archive
+
+
+def _trade(month: int, price: int):
+  return {'name': 'A', 'price': price, 'year': 2023, 'month': month, 'date': 5, 'date_serial': 20230005 + month * 100, 'lawaddrcode_city': 11680}
+
+
+@pytest.fixture
+def trades_root(tmp_path, monkeypatch):
+  monkeypatch.setitem(archive._ROOTS, 'trades', str(tmp_path))
+  return tmp_path
+
+
+def _write_json(root, name: str, rows):
+  with open(os.path.join(root, name), 'w') as f:
+    json.dump(rows, f)
+
+
+def test_convert_json_files_moves_legacy_months(trades_root):
+  _write_json(trades_root, '202301-11680.json', [_trade(1, 100), _trade(1, 200)])
+  _write_json(trades_root, '202302-11680.json', [_trade(2, 300)])
+  _write_json(trades_root, '202303-11680.json', [])
+
+  assert archive.convert_json_files('trades', skip_existing=True) == 2
+  assert sorted(archive.list_entries('trades')) == [(2023, 1, 11680), (2023, 2, 11680)]
+  assert sorted(r['price'] for r in archive.read_month('trades', 2023, 1, 11680)) == [100, 200]
+  # the json files are kept unless asked otherwise
+  assert os.path.exists(os.path.join(trades_root, '202301-11680.json'))
+
+
+def test_convert_json_files_skip_existing_keeps_archived_months(trades_root):
+  archive.write_month('trades', 2023, 1, 11680, [_trade(1, 999)])
+  _write_json(trades_root, '202301-11680.json', [_trade(1, 100)])
+  _write_json(trades_root, '202302-11680.json', [_trade(2, 300)])
+
+  assert archive.convert_json_files('trades', skip_existing=True) == 1
+  assert [r['price'] for r in archive.read_month('trades', 2023, 1, 11680)] == [999]
+  assert [r['price'] for r in archive.read_month('trades', 2023, 2, 11680)] == [300]
+  # nothing left to move on the next run
+  assert archive.convert_json_files('trades', skip_existing=True) == 0
+
+
+def test_convert_json_files_without_legacy_files(trades_root):
+  assert archive.convert_json_files('trades', skip_existing=True) == 0
+  assert archive.list_entries('trades') == []
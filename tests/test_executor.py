@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import pytest
+
+from korea_apartment_price.webapp.executor import blocking, get_pool, pool_stats, shutdown_pools
+
+
+@pytest.fixture(autouse=True)
+def fresh_pools():
+  shutdown_pools()
+  yield
+  shutdown_pools()
+
+
+def test_search_pool_is_not_blocked_by_slow_db_handlers():
+  release = threading.Event()
+
+  @blocking('db')
+  def slow_db_handler():
+    release.wait(10.0)
+    return 'db'
+
+  @blocking('search')
+  def search_handler():
+    return 'search'
+
+  async def main():
+    # every db thread is stuck in a slow query
+    num_db = get_pool('db').max_workers
+    db_calls = [asyncio.ensure_future(slow_db_handler()) for _ in range(num_db + 2)]
+    await asyncio.sleep(0.1)
+    assert pool_stats()['db']['running'] == num_db
+    assert pool_stats()['db']['queued'] == 2
+
+    res = await asyncio.wait_for(search_handler(), timeout=2.0)
+    assert not any(call.done() for call in db_calls)
+
+    release.set()
+    assert await asyncio.gather(*db_calls) == ['db'] * (num_db + 2)
+    return res
+
+  try:
+    assert asyncio.run(main()) == 'search'
+  finally:
+    release.set()
+  assert pool_stats()['search']['completed'] == 1
+  assert pool_stats()['db']['completed'] == get_pool('db').max_workers + 2
+
+
+def test_blocking_handler_runs_off_the_event_loop_thread():
+  @blocking()
+  def handler(x, y=0):
+    return threading.current_thread().name, x + y
+
+  async def main():
+    return threading.current_thread().name, await handler(1, y=2)
+
+  loop_thread, (handler_thread, res) = asyncio.run(main())
+  assert res == 3
+  assert handler_thread != loop_thread
+  assert handler_thread.startswith('blocking-db')
+
+
+def test_failures_are_counted_and_raised():
+  @blocking()
+  def handler():
+    raise ValueError('boom')
+
+  with pytest.raises(ValueError):
+    asyncio.run(handler())
+  assert pool_stats()['db']['failed'] == 1
+
+
+def test_data_version_is_read_off_the_event_loop_thread(monkeypatch):
+  from korea_apartment_price import db
+  from korea_apartment_price.webapp import cache
+
+  threads = []
+  def get_data_version():
+    threads.append(threading.current_thread().name)
+    return 7
+
+  monkeypatch.setattr(db, 'get_data_version', get_data_version)
+  monkeypatch.setattr(cache, '_version', None)
+
+  async def main():
+    return await cache.data_version(), await cache.data_version()
+
+  assert asyncio.run(main()) == (7, 7)
+  # the second call is answered from the cached value
+  assert len(threads) == 1
+  assert threads[0].startswith('blocking-db')
@@ -0,0 +1,80 @@
+import asyncio
+
+import peewee
+import pytest
+from fastapi import HTTPException
+
+import korea_apartment_price
+from korea_apartment_price.webapp import models
+from korea_apartment_price.webapp.executor import shutdown_pools
+from korea_apartment_price.webapp.routers.fav import FavoriteAddReq, fav_add, fav_list
+
+SIZES = [18, 25, 32, 45]
+
+
+@pytest.fixture
+def fav_db(tmp_path, monkeypatch):
+  if not isinstance(models.db, peewee.SqliteDatabase):
+    pytest.skip('needs WEBAPP.DB_TYPE sqlite')
+  orig_database, orig_timeout = models.db.database, models.db._timeout
+  models.db.init(str(tmp_path / 'webapp.sqlite'), timeout=orig_timeout)
+  models.init_db()
+  # fav_add checks the size against the trades in mongodb
+  monkeypatch.setattr(korea_apartment_price.db, 'query_sizes', lambda apt_id: SIZES)
+  with models.db.connection_context():
+    user = models.User.create(email='user@example.com', pwhash='-', is_admin=False, is_active=True)
+  yield models.AuthClaims(user.id, user.email, False, True)
+  shutdown_pools()
+  models.close_db()
+  models.db.init(orig_database, timeout=orig_timeout)
+
+
+def _req(idx: int, size: int)->FavoriteAddReq:
+  return FavoriteAddReq(lawaddrcode='1168010300', address=f'서울특별시 강남구 개포동 {idx}', name=f'아파트{idx}', size=size)
+
+
+def test_database_is_in_wal_mode(fav_db):
+  with models.db.connection_context():
+    assert models.db.execute_sql('pragma journal_mode').fetchone()[0] == 'wal'
+
+
+def test_concurrent_adds_and_lists(fav_db):
+  user = fav_db
+  num_apts = 40
+
+  async def main():
+    # adds and lists interleaved on the db pool threads, each with its own connection
+    calls = []
+    for idx in range(num_apts):
+      for size in SIZES:
+        calls.append(fav_add(f=_req(idx, size), u=user))
+      calls.append(fav_list(u=user))
+    return await asyncio.gather(*calls)
+
+  results = asyncio.run(main())
+  assert all(res.success for res in results)
+
+  num_favs = num_apts * len(SIZES)
+  for res in results:
+    if res.result is None: continue
+    # a listing taken while adds are going on is a consistent, sorted snapshot
+    entries = [e for rows in res.result.values() for e in rows]
+    assert len(entries) <= num_favs
+    for rows in res.result.values():
+      assert [e['size'] for e in rows] == sorted(e['size'] for e in rows)
+
+  final = asyncio.run(fav_list(u=user)).result
+  assert len(final) == num_apts
+  assert all([e['size'] for e in rows] == SIZES for rows in final.values())
+
+
+def test_duplicate_add_is_rejected(fav_db):
+  user = fav_db
+
+  async def main():
+    return await asyncio.gather(*[fav_add(f=_req(0, 25), u=user) for _ in range(8)], return_exceptions=True)
+
+  results = asyncio.run(main())
+  assert sum(1 for res in results if not isinstance(res, Exception)) == 1
+  errors = [res for res in results if isinstance(res, Exception)]
+  assert all(isinstance(e, HTTPException) and e.detail == 'already exists' for e in errors)
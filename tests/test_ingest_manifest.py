@@ -0,0 +1,31 @@
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from korea_apartment_price import db
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+  database = mongomock.MongoClient().db
+  monkeypatch.setattr(db, 'get_ingest_manifest_collection', lambda: database['ingest_manifest'])
+  return database
+
+
+def test_empty_month_keeps_its_hash_but_is_not_listed(mongo):
+  db.finish_ingest('trades', 2023, 1, 11680, [{'serial': 'a', 'price': 1}])
+  db.finish_ingest('trades', 2023, 2, 11680, [])
+
+  # the refresh compares against this hash, so an empty answer is not rewritten every run
+  manifest = db.get_ingest_manifest('trades', 2023, 2, 11680)
+  assert manifest['status'] == 'done'
+  assert manifest['content_hash'] == db.content_hash([])
+
+  # the archive never holds empty months; listing it would get it removed as missing from the files
+  assert db.list_ingest_manifest('trades') == [(2023, 1, 11680)]
+
+
+def test_loading_entries_are_listed(mongo):
+  db.begin_ingest('rents', 2023, 3, 11680)
+  assert db.list_ingest_manifest('rents', status='loading') == [(2023, 3, 11680)]
+  assert db.list_ingest_manifest('rents') == []
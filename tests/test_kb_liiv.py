@@ -0,0 +1,29 @@
+import requests
+
+from korea_apartment_price.kb_liiv import KBLiivCrawler
+from korea_apartment_price.utils.http_cache import CachedSession
+
+
+def _fake_send(self, request, *args, **kwargs):
+  resp = requests.Response()
+  resp.status_code = 200
+  resp.headers['Content-Type'] = 'application/json'
+  resp._content = b'{}'
+  resp.url = request.url
+  resp.request = request
+  return resp
+
+
+def test_cache_hits_are_not_counted_as_requests(tmp_path, monkeypatch):
+  monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', _fake_send)
+  crawler = KBLiivCrawler(session=CachedSession(cache_root=str(tmp_path), max_bytes=None))
+  url = f'{crawler.url}/land-complex/complexComm/hscmList'
+
+  for _ in range(3):
+    crawler._get(url, {'법정동코드': '1168010300'})
+  # orderbooks are never cached
+  crawler._get(f'{crawler.url}/land-property/propList/main', {'단지기본일련번호': 1})
+
+  stats = crawler.connection_stats()
+  assert stats['requests'] == 2
+  assert crawler._session.num_hits == 2
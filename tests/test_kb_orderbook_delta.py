@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from korea_apartment_price import db
+
+APART_ID = 1234
+T1, T2, T3 = [datetime.datetime(2024, 1, d) for d in (1, 2, 3)]
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+  database = mongomock.MongoClient().db
+  monkeypatch.setattr(db, 'get_kbliiv_apt_orderbook_delta_collection', lambda: database['orderbook_delta'])
+  monkeypatch.setattr(db, 'get_kbliiv_apt_orderbook_fetch_collection', lambda: database['orderbook_fetch'])
+  monkeypatch.setattr(db, 'get_kbliiv_apt_orderbook_detail_collection', lambda: database['orderbook_detail'])
+  return database
+
+
+def _listing(listing_id: int, price: int):
+  return {'listing_id': listing_id, 'trade_type': 1, 'price': price, 'size': 84, 'detail': {'id': listing_id}}
+
+
+def test_remove_since_rolls_the_intervals_back(mongo):
+  db.insert_kb_orderbook_delta(APART_ID, [_listing(1, 100000)], T1)
+  db.insert_kb_orderbook_delta(APART_ID, [_listing(1, 100000), _listing(2, 90000)], T2)
+  db.insert_kb_orderbook_delta(APART_ID, [_listing(1, 100000)], T3)
+
+  db.remove_kb_orderbook_delta_since(T2)
+  deltas = list(mongo['orderbook_delta'].find())
+  assert [(e['listing_id'], e['first_seen'], e['last_seen']) for e in deltas] == [(1, T1, T1)]
+  assert mongo['orderbook_fetch'].count_documents({}) == 1
+  assert mongo['orderbook_detail'].count_documents({}) == 1
+
+
+def test_remove_since_without_an_earlier_fetch_drops_the_complex(mongo):
+  db.insert_kb_orderbook_delta(APART_ID, [_listing(1, 100000)], T1)
+  db.insert_kb_orderbook_delta(APART_ID, [_listing(1, 100000)], T2)
+  # the fetch log of T1 is gone, so nothing is left to end the interval at
+  mongo['orderbook_fetch'].delete_many({'fetched_at': T1})
+
+  db.remove_kb_orderbook_delta_since(T2)
+  assert mongo['orderbook_delta'].count_documents({}) == 0
+  assert mongo['orderbook_detail'].count_documents({}) == 0
@@ -0,0 +1,49 @@
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+from korea_apartment_price import db, trade_volume
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+  database = mongomock.MongoClient().db
+  monkeypatch.setattr(db, 'get_trades_collection', lambda: database['trades'])
+  monkeypatch.setattr(db, 'get_volume_daily_collection', lambda: database['volume_daily'])
+  monkeypatch.setattr(db, 'get_volume_weekly_collection', lambda: database['volume_weekly'])
+  monkeypatch.setattr(db, 'get_meta_collection', lambda: database['meta'])
+  return database
+
+
+def _trade(day: int, price: int, size: float=84.9):
+  # date_serial is built the way download_trades.py does (a missing day becomes 0)
+  return {
+    'lawaddrcode_city': 11680, 'addrcode_city': 11680, 'year': 2023, 'month': 1, 'date': day,
+    'date_serial': 20230100 + day, 'size': size, 'price': price,
+  }
+
+
+def test_week_start():
+  assert trade_volume.week_start(20230101) == 20221226  # sunday
+  assert trade_volume.week_start(20230102) == 20230102  # monday
+
+
+def test_update_volume_cube_skips_trades_without_a_day(mongo):
+  mongo['trades'].insert_many([_trade(0, 100000), _trade(2, 120000), _trade(4, 120500), _trade(9, 90000)])
+  trade_volume.update_volume_cube(2023, 1, 11680)
+
+  daily = sorted((e['date_serial'], e['cnt']) for e in mongo['volume_daily'].find())
+  assert daily == [(20230102, 1), (20230104, 1), (20230109, 1)]
+  weekly = sorted((e['week'], e['cnt'], e['money']) for e in mongo['volume_weekly'].find())
+  assert weekly == [(20230102, 2, 240500), (20230109, 1, 90000)]
+
+
+def test_query_volume_cube_needs_a_full_rebuild(mongo):
+  mongo['trades'].insert_many([_trade(0, 100000), _trade(2, 120000), _trade(9, 90000)])
+  mongo['trades'].insert_one({**_trade(3, 50000), 'year': None, 'month': None})
+
+  trade_volume.update_volume_cube(2023, 1, 11680)
+  assert trade_volume.query_volume_cube([11680]) is None
+
+  trade_volume.rebuild_volume_cube()
+  assert trade_volume.query_volume_cube([11680]) == [(20230102, 1, 120000), (20230109, 1, 90000)]